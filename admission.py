@@ -0,0 +1,222 @@
+# Admission control for /query
+# A fixed number of requests run the model-bound pipeline at once; the rest
+# wait in a bounded priority queue (interactive ahead of batch/eval). A request
+# is rejected up front (HTTP 429 + Retry-After) when the queue is full or its
+# estimated wait already exceeds its deadline, and again if the deadline passes
+# while it waits. Requests answered without the model bypass the queue.
+
+import heapq
+import itertools
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+PRIORITIES = {"interactive": 0, "batch": 1}
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", 2))   # pipelines running at once
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 32))           # waiting requests, all classes
+DEFAULT_DEADLINE_MS = {
+    "interactive": int(os.getenv("ADMISSION_INTERACTIVE_DEADLINE_MS", 20000)),
+    "batch": int(os.getenv("ADMISSION_BATCH_DEADLINE_MS", 300000)),
+}
+INITIAL_SERVICE_SECONDS = 5.0    # service-time estimate until the first request completes
+SERVICE_EWMA_ALPHA = 0.2
+
+
+class Overloaded(RuntimeError):
+    """Request not admitted; `retry_after` is the suggested wait in seconds."""
+
+    def __init__(self, message: str, retry_after: float, reason: str):
+        super().__init__(message)
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.reason = reason
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "deadline", "granted", "shed")
+
+    def __init__(self, priority: int, seq: int, deadline: float):
+        self.priority = priority
+        self.seq = seq
+        self.deadline = deadline
+        self.granted = False
+        self.shed = False
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class AdmissionController:
+    def __init__(self, max_concurrent: int = ADMISSION_MAX_CONCURRENT, queue_size: int = ADMISSION_QUEUE_SIZE):
+        if max_concurrent < 1:
+            raise ValueError("max_concurrent must be at least 1")
+        self.max_concurrent = max_concurrent
+        self.queue_size = queue_size
+        self._cond = threading.Condition()
+        self._waiting = []   # heap of _Waiter
+        self._seq = itertools.count()
+        self._in_flight = 0
+        self._service_s = None
+        self._waits_ms = deque(maxlen=1024)
+        self._counts = {"admitted": 0, "bypassed": 0, "completed": 0,
+                        "rejected_queue_full": 0, "rejected_deadline": 0, "timed_out": 0, "shed": 0}
+
+    # -------------------------------
+    # Estimates
+    # -------------------------------
+    def _service_estimate(self) -> float:
+        return self._service_s if self._service_s is not None else INITIAL_SERVICE_SECONDS
+
+    def _estimated_wait(self, priority: int) -> float:
+        """Seconds until a new request of `priority` would start running."""
+        if self._in_flight < self.max_concurrent and not self._waiting:
+            return 0.0
+        ahead = sum(1 for w in self._waiting if w.priority <= priority)
+        # One slot frees up every service/max_concurrent seconds on average
+        return (ahead + 1) * self._service_estimate() / self.max_concurrent
+
+    def estimated_wait(self, priority: str = "interactive") -> float:
+        with self._cond:
+            return self._estimated_wait(_priority_rank(priority))
+
+    # -------------------------------
+    # Admission
+    # -------------------------------
+    @contextmanager
+    def admit(self, priority: str = "interactive", deadline_ms: int = None, bypass: bool = False):
+        """Hold a pipeline slot for the duration of the block.
+
+        Raises Overloaded when the request cannot start before its deadline.
+        """
+        rank = _priority_rank(priority)
+        if bypass:
+            with self._cond:
+                self._counts["bypassed"] += 1
+            yield
+            return
+
+        if deadline_ms is None:
+            deadline_ms = DEFAULT_DEADLINE_MS[priority]
+        self._acquire(rank, time.monotonic() + deadline_ms / 1000)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._release(time.monotonic() - started)
+
+    def _acquire(self, rank: int, deadline: float):
+        arrived = time.monotonic()
+        with self._cond:
+            if self._in_flight < self.max_concurrent and not self._waiting:
+                self._in_flight += 1
+                self._admitted(0.0)
+                return
+
+            estimate = self._estimated_wait(rank)
+            if estimate > deadline - arrived:
+                self._counts["rejected_deadline"] += 1
+                raise Overloaded(f"Estimated wait {estimate:.1f}s exceeds the request deadline", estimate, "deadline")
+            if len(self._waiting) >= self.queue_size and not self._shed_lower_than(rank):
+                self._counts["rejected_queue_full"] += 1
+                raise Overloaded(f"Admission queue full ({self.queue_size} waiting)", estimate, "queue_full")
+
+            waiter = _Waiter(rank, next(self._seq), deadline)
+            heapq.heappush(self._waiting, waiter)
+            while not waiter.granted:
+                remaining = waiter.deadline - time.monotonic()
+                if waiter.shed or remaining <= 0:
+                    if not waiter.shed:
+                        self._waiting.remove(waiter)
+                        heapq.heapify(self._waiting)
+                        self._counts["timed_out"] += 1
+                    retry = self._estimated_wait(rank)
+                    reason = "shed" if waiter.shed else "timed_out"
+                    raise Overloaded(f"Request {reason.replace('_', ' ')} while queued", retry, reason)
+                self._cond.wait(remaining)
+            self._admitted(time.monotonic() - arrived)
+
+    def _shed_lower_than(self, rank: int) -> bool:
+        """Drop the newest queued request of a lower priority class to make room."""
+        victims = [w for w in self._waiting if w.priority > rank]
+        if not victims:
+            return False
+        victim = max(victims, key=lambda w: (w.priority, w.seq))
+        self._waiting.remove(victim)
+        heapq.heapify(self._waiting)
+        victim.shed = True
+        self._counts["shed"] += 1
+        self._cond.notify_all()
+        return True
+
+    def _admitted(self, waited: float):
+        self._counts["admitted"] += 1
+        self._waits_ms.append(waited * 1000)
+
+    def _release(self, service_seconds: float):
+        with self._cond:
+            self._in_flight -= 1
+            self._counts["completed"] += 1
+            if self._service_s is None:
+                self._service_s = service_seconds
+            else:
+                self._service_s += SERVICE_EWMA_ALPHA * (service_seconds - self._service_s)
+            while self._in_flight < self.max_concurrent and self._waiting:
+                heapq.heappop(self._waiting).granted = True
+                self._in_flight += 1
+            self._cond.notify_all()
+
+    # -------------------------------
+    # Metrics
+    # -------------------------------
+    def stats(self) -> dict:
+        with self._cond:
+            waits = sorted(self._waits_ms)
+            by_class = {name: sum(1 for w in self._waiting if w.priority == rank) for name, rank in PRIORITIES.items()}
+            return {
+                "max_concurrent": self.max_concurrent,
+                "queue_size": self.queue_size,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiting),
+                "queue_depth_by_priority": by_class,
+                "estimated_wait_s": {name: round(self._estimated_wait(rank), 2) for name, rank in PRIORITIES.items()},
+                "service_ewma_s": round(self._service_estimate(), 3),
+                "wait_ms": {
+                    "p50": round(_percentile(waits, 0.50), 1),
+                    "p95": round(_percentile(waits, 0.95), 1),
+                    "max": round(waits[-1], 1) if waits else 0.0,
+                    "samples": len(waits),
+                },
+                **self._counts,
+            }
+
+
+def _priority_rank(priority: str) -> int:
+    try:
+        return PRIORITIES[priority]
+    except KeyError:
+        raise ValueError(f"Unknown priority {priority!r}; expected one of {sorted(PRIORITIES)}") from None
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller() -> AdmissionController:
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                _controller = AdmissionController()
+    return _controller
+
+
+def admission_stats() -> dict:
+    return get_controller().stats()
@@ -1,13 +1,55 @@
 # FastAPI backend for NL → SQL system
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from nl_to_sql_pipeline import run_nl_to_sql
+from typing import Literal, Optional
+from nl_to_sql_pipeline import answerable_without_model, run_nl_to_sql
+from admission import DEFAULT_DEADLINE_MS, Overloaded, admission_stats, get_controller
+from deadlines import Deadline, deadline_stats
+from prompt_assembler import prompt_stats
+from sql_templates import template_stats
+from result_frames import frame_stats
+from profiling import PROFILE_HEADER, PROFILING_ENABLED, list_profiles, profile_file, request_profiler
+from traffic_capture import capture_request, capture_stats
+from explanation_jobs import explanation_events, explanation_job_stats, get_explanation
+from batch_query import batch_stats, plan_batch, run_batch
+from pagination import fetch_next_page
+from db import pool_stats
+from replica_router import replica_stats
+from execution_backends import snapshot_stats
+from startup import lifespan, readiness
+from result_encoding import encode_payload, negotiate
 
-app = FastAPI(title="NL → SQL Analytics API")
+# Preloads and warms up the model in the background; see /ready
+app = FastAPI(title="NL → SQL Analytics API", lifespan=lifespan)
 
 class QueryRequest(BaseModel):
     query: str
+    # "fresh" (live MySQL), "fast" (local analytics snapshot) or "auto"
+    freshness: Optional[str] = None
+    # "interactive" (default) or "batch"; batch waits behind interactive traffic
+    priority: Literal["interactive", "batch"] = "interactive"
+    # How long the caller is willing to wait for the answer, queueing included;
+    # stages are cut short (see "degraded" in the response) to fit it
+    deadline_ms: Optional[int] = None
+    # Follow-ups in the same session can be answered from its last result
+    session_id: Optional[str] = None
+    # "deferred" returns SQL and rows without waiting for the explanation;
+    # fetch it from /explain/{result_id}. "none" skips the explanation.
+    explain: Literal["inline", "deferred", "none"] = "inline"
+
+class NextPageRequest(BaseModel):
+    token: str
+
+class BatchItem(BaseModel):
+    query: str
+    session_id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    queries: list[BatchItem]
+    freshness: Optional[str] = None
+    explain: Literal["inline", "deferred", "none"] = "inline"
 
 class QueryResponse(BaseModel):
     status: str
@@ -16,8 +58,128 @@ class QueryResponse(BaseModel):
     explanation: str | None = None
     question: str | None = None
     error: str | None = None
+    next_token: str | None = None
+    sql_source: str | None = None
+    refinement: list | None = None
+    degraded: dict | None = None
+    result_id: str | None = None
+
+def _encoded(response: dict, fmt: str) -> Response:
+    # Encode directly instead of going through jsonable_encoder per value
+    body, media_type = encode_payload(response, fmt)
+    return Response(content=body, media_type=media_type)
 
 @app.post("/query", response_model=QueryResponse)
-def query_db(req: QueryRequest):
-    response = run_nl_to_sql(req.query)
-    return response
+def query_db(req: QueryRequest, request: Request):
+    fmt = negotiate(request.headers.get("accept"))
+    deadline = Deadline.after_ms(req.deadline_ms or DEFAULT_DEADLINE_MS[req.priority])
+    profiler = request_profiler(request.headers.get(PROFILE_HEADER), label=req.query)
+    capture = capture_request(req.query, session_id=req.session_id, priority=req.priority,
+                              freshness=req.freshness, deadline_ms=req.deadline_ms, result_format=fmt,
+                              explain=req.explain)
+    with profiler, capture:
+        try:
+            bypass = answerable_without_model(req.query, session_id=req.session_id)
+            with get_controller().admit(req.priority, req.deadline_ms, bypass=bypass):
+                response = run_nl_to_sql(req.query, result_format="rows" if fmt == "rows" else "columnar",
+                                         freshness=req.freshness, session_id=req.session_id, deadline=deadline,
+                                         explain=req.explain)
+            capture.set_response(response)
+        except Overloaded as e:
+            capture.set_response({"status": "overloaded"})
+            return JSONResponse(
+                content={"status": "overloaded", "error": str(e), "reason": e.reason},
+                status_code=429, headers={"Retry-After": str(e.retry_after)},
+            )
+        encoded = _encoded(response, fmt)
+    if hasattr(profiler, "id"):
+        encoded.headers["X-Profile-Id"] = profiler.id
+    return encoded
+
+@app.post("/query/batch")
+def query_batch(req: BatchRequest, request: Request):
+    fmt = "rows" if negotiate(request.headers.get("accept")) == "rows" else "columnar"
+    entries = [{"query": item.query, "session_id": item.session_id} for item in req.queries]
+    try:
+        plan_batch(entries)
+    except ValueError as e:
+        return JSONResponse(content={"status": "error", "error": str(e)}, status_code=400)
+    # Every question is admitted on its own at batch priority
+    items = run_batch(entries, result_format=fmt, freshness=req.freshness, explain=req.explain,
+                      admission=get_controller())
+    return StreamingResponse((encode_payload(item, fmt)[0] + b"\n" for item in items),
+                             media_type="application/x-ndjson")
+
+@app.post("/query/next", response_model=QueryResponse)
+def query_next(req: NextPageRequest, request: Request):
+    fmt = negotiate(request.headers.get("accept"))
+    return _encoded(fetch_next_page(req.token, result_format="rows" if fmt == "rows" else "columnar"), fmt)
+
+@app.get("/explain/{result_id}")
+def explanation(result_id: str):
+    job = get_explanation(result_id)
+    if job is None:
+        return JSONResponse(content={"error": f"Unknown or expired result id: {result_id}"}, status_code=404)
+    return job
+
+@app.get("/explain/{result_id}/events")
+def explanation_stream(result_id: str):
+    if get_explanation(result_id) is None:
+        return JSONResponse(content={"error": f"Unknown or expired result id: {result_id}"}, status_code=404)
+    return StreamingResponse(explanation_events(result_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+@app.get("/metrics/db")
+def db_metrics():
+    return {"pool": pool_stats(), "replicas": replica_stats(), "snapshot": snapshot_stats()}
+
+@app.get("/metrics/queue")
+def queue_metrics():
+    return admission_stats()
+
+@app.get("/metrics/prompts")
+def prompt_metrics():
+    return prompt_stats()
+
+@app.get("/metrics/templates")
+def template_metrics():
+    return template_stats()
+
+@app.get("/metrics/frames")
+def frame_metrics():
+    return frame_stats()
+
+@app.get("/metrics/batch")
+def batch_metrics():
+    return batch_stats()
+
+@app.get("/metrics/explanations")
+def explanation_metrics():
+    return explanation_job_stats()
+
+@app.get("/metrics/deadlines")
+def deadline_metrics():
+    return deadline_stats()
+
+@app.get("/metrics/capture")
+def capture_metrics():
+    return capture_stats()
+
+@app.get("/admin/profiles")
+def profiles():
+    if not PROFILING_ENABLED:
+        return JSONResponse(content={"error": "Profiling is disabled"}, status_code=404)
+    return {"profiles": list_profiles()}
+
+@app.get("/admin/profiles/{name}")
+def profile_download(name: str):
+    path = profile_file(name) if PROFILING_ENABLED else None
+    if path is None:
+        return JSONResponse(content={"error": f"No such profile file: {name}"}, status_code=404)
+    return FileResponse(path, filename=name, media_type="text/plain" if name.endswith(".collapsed") else "application/json")
+
+@app.get("/ready")
+def ready():
+    # 503 until the model is loaded and every stage is warmed up
+    state = readiness()
+    return JSONResponse(content=state, status_code=200 if state["ready"] else 503)
@@ -0,0 +1,150 @@
+# Batch questions: /query/batch and run_batch()
+# Many questions are answered together instead of one request each:
+# - identical questions without a session are answered once (whitespace and
+#   case do not matter) and the answer is returned for every copy
+# - questions run concurrently (BATCH_CONCURRENCY), so their clarification,
+#   SQL and explanation prompts meet in batched generate() calls: on the
+#   inference server, or on an in-process BatchScheduler in local mode
+# - the SQL runs concurrently over the pooled read connections
+# - a session's questions run in order with their own pending clarification,
+#   separate from the process-wide one interactive /query uses
+# - with an admission controller (/query/batch) every question takes its own
+#   pipeline slot at batch priority, and no more questions are in flight than
+#   it has slots: a batch never runs more pipelines than ADMISSION_MAX_CONCURRENT
+#   and interactive requests go ahead of it. A question that is not admitted is
+#   answered with status "overloaded"
+# Results are yielded as each question completes, tagged with its index.
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+
+from admission import Overloaded
+
+from conversation_state import ConversationState
+from inference import batched_generation
+from nl_to_sql_pipeline import run_nl_to_sql
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 16))     # questions in flight per batch
+BATCH_MAX_QUESTIONS = int(os.getenv("BATCH_MAX_QUESTIONS", 500))
+
+_stats = {"batches": 0, "questions": 0, "answered": 0, "deduplicated": 0, "errors": 0, "overloaded": 0,
+          "busy_seconds": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+
+def batch_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["busy_seconds"] = round(stats["busy_seconds"], 2)
+    stats["ms_per_question"] = (
+        round(stats["busy_seconds"] * 1000 / stats["questions"], 1) if stats["questions"] else None
+    )
+    return stats
+
+
+def _normalize(question: str) -> str:
+    return " ".join(question.lower().split())
+
+
+def _item(entry) -> dict:
+    if isinstance(entry, str):
+        return {"query": entry, "session_id": None}
+    return {"query": entry["query"], "session_id": entry.get("session_id")}
+
+
+def plan_batch(entries):
+    """Group a batch into units of work: [(indices per turn, question, session_id), ...] per unit.
+
+    A session is one unit (its turns in order); every other distinct question
+    is its own unit, answering all the indices that asked it.
+    """
+    if not entries:
+        raise ValueError("A batch needs at least one question")
+    if len(entries) > BATCH_MAX_QUESTIONS:
+        raise ValueError(f"A batch takes at most {BATCH_MAX_QUESTIONS} questions, got {len(entries)}")
+    units, sessions, seen = [], {}, {}
+    for index, entry in enumerate(entries):
+        item = _item(entry)
+        if item["session_id"] is not None:
+            if item["session_id"] not in sessions:
+                sessions[item["session_id"]] = []
+                units.append(sessions[item["session_id"]])
+            sessions[item["session_id"]].append(([index], item["query"], item["session_id"]))
+            continue
+        key = _normalize(item["query"])
+        if key in seen:
+            seen[key][0].append(index)
+        else:
+            seen[key] = ([index], item["query"], None)
+            units.append([seen[key]])
+    return units
+
+
+def run_batch(entries, result_format: str = "rows", freshness: str = None, explain: str = "inline",
+              concurrency: int = BATCH_CONCURRENCY, admission=None):
+    """Answer a list of questions (strings or {"query", "session_id"} dicts).
+
+    Yields one response per input question as soon as it is answered, in
+    completion order, with "index" (its position in `entries`) and "query".
+    Later copies of a deduplicated question are marked "deduplicated".
+    With an admission.AdmissionController each question runs in its own slot.
+    """
+    units = plan_batch(entries)
+    done = queue.Queue()
+
+    def run_unit(turns):
+        conversation = ConversationState()
+        with batched_generation():
+            for indices, question, session_id in turns:
+                try:
+                    with admission.admit("batch") if admission is not None else nullcontext():
+                        response = run_nl_to_sql(question, result_format=result_format, freshness=freshness,
+                                                 session_id=session_id, explain=explain, conversation=conversation)
+                except Overloaded as e:
+                    response = {"status": "overloaded", "sql": None, "error": str(e), "reason": e.reason,
+                                "retry_after": e.retry_after}
+                except Exception as e:   # one failing question must not end the batch
+                    response = {"status": "error", "sql": None, "error": str(e)}
+                done.put((indices, question, session_id, response))
+
+    if admission is not None:
+        # More questions in flight than slots would only fill the admission queue
+        concurrency = min(concurrency, admission.max_concurrent)
+    started = time.perf_counter()
+    pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="batch-query")
+    try:
+        for unit in units:
+            pool.submit(run_unit, unit)
+        remaining = sum(len(unit) for unit in units)
+        while remaining:
+            indices, question, session_id, response = done.get()
+            remaining -= 1
+            _count(answered=1, errors=response.get("status") == "error",
+                   overloaded=response.get("status") == "overloaded", deduplicated=len(indices) - 1)
+            for n, index in enumerate(indices):
+                item = dict(response, index=index, query=question, session_id=session_id)
+                if n:
+                    item["deduplicated"] = True
+                yield item
+    finally:
+        # A consumer that stops early (client gone) drops the questions not started yet
+        pool.shutdown(wait=False, cancel_futures=True)
+        _count(batches=1, questions=len(entries), busy_seconds=time.perf_counter() - started)
+
+
+def answer_batch(entries, **options) -> list:
+    """run_batch() collected into a list in input order."""
+    answers = [None] * len(entries)
+    for item in run_batch(entries, **options):
+        answers[item["index"]] = item
+    return answers
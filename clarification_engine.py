@@ -1,51 +1,18 @@
 # Uses Qwen2.5-32B to decide if clarification is needed
 
-import torch
-from llm_loader import load_llm
-from clarification_prompt import (
-    CLARIFICATION_SYSTEM_PROMPT,
-    build_clarification_prompt
-)
-
-# llm_loader.py
-_model = None
-_tokenizer = None
-
-def get_llm():
-    global _model, _tokenizer
-    if _model is None:
-        _tokenizer, _model = load_llm()
-    return _tokenizer, _model
-
+from inference import generate_prompt
+from clarification_prompt import build_clarification_segments
+from deadlines import EXECUTION_RESERVE_MS, DeadlineExceeded, current_deadline, stage_cost_ms, token_budget
 
 def check_clarification(user_query: str, schema_json: dict) -> str:
-    messages = [
-        {"role": "system", "content": CLARIFICATION_SYSTEM_PROMPT},
-        {
-            "role": "user",
-            "content": build_clarification_prompt(user_query, schema_json)
-        }
-    ]
-
-    text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True
-    )
-
-    inputs = tokenizer(text, return_tensors="pt").to(model.device)
-
-    with torch.no_grad():
-        output = model.generate(
-            **inputs,
-            max_new_tokens=64,
-            temperature=0.2
-        )
-
-    response = tokenizer.decode(
-        output[0][inputs["input_ids"].shape[-1]:],
-        skip_special_tokens=True
-    ).strip()
+    # SQL generation waits on the clarifier's verdict, so it cannot be skipped:
+    # when it does not fit alongside SQL generation and execution, give up
+    max_new_tokens = token_budget("clarification", 64, reserve_ms=stage_cost_ms("sql") + EXECUTION_RESERVE_MS)
+    if not max_new_tokens:
+        raise DeadlineExceeded("clarification", current_deadline().remaining_ms())
+
+    prompt = build_clarification_segments(user_query, schema_json)
+    response = generate_prompt(prompt, max_new_tokens=max_new_tokens, temperature=0.2)
 
     # Normalize common "no clarification needed" replies coming from the model.
     import re
@@ -24,3 +24,15 @@ USER QUERY:
 
 Is clarification required?
 """
+
+
+def build_clarification_segments(user_query: str, schema_json: dict) -> dict:
+    """Segmented form of build_clarification_prompt for prompt_assembler."""
+    from prompt_assembler import make_prompt, schema_segments, segment
+
+    return make_prompt("clarification", CLARIFICATION_SYSTEM_PROMPT, [
+        segment("schema_header", "\nDATABASE SCHEMA:\n", "instructions", static=True),
+        *schema_segments(schema_json, user_query),
+        segment("question", f"\nUSER QUERY:\n{user_query}\n", "question"),
+        segment("footer", "\nIs clarification required?\n", "instructions", static=True),
+    ])
@@ -1,12 +1,22 @@
 # Lightweight conversation memory for follow-up queries
 # Stores resolved clarifications to enrich future queries
+# Bounded: only the most recent MAX_CONTEXT_ITEMS entries are kept and the
+# injected context is capped at MAX_CONTEXT_CHARS (the prompt assembler
+# truncates further to the stage token budget).
+
+MAX_CONTEXT_ITEMS = 8
+MAX_CONTEXT_CHARS = 500
 
 class ConversationMemory:
     def __init__(self):
         self.context = {}
 
     def update(self, key: str, value: str):
+        # Re-inserting moves the key to the newest position
+        self.context.pop(key, None)
         self.context[key] = value
+        while len(self.context) > MAX_CONTEXT_ITEMS:
+            self.context.pop(next(iter(self.context)))
 
     def apply_context(self, user_query: str) -> str:
         """
@@ -17,6 +27,6 @@ class ConversationMemory:
 
         context_str = " ".join(
             f"{k}: {v}" for k, v in self.context.items()
-        )
+        )[-MAX_CONTEXT_CHARS:]
 
         return f"{user_query}. Context: {context_str}"
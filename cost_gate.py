@@ -0,0 +1,309 @@
+# Pre-execution cost gate for generated SQL
+# Runs EXPLAIN FORMAT=JSON (MySQL) or EXPLAIN QUERY PLAN (SQLite), estimates
+# rows examined, flags full scans / filesorts / cartesian joins and decides
+# whether to allow, warn, rewrite or reject the query before it runs.
+# Plans are cached per SQL fingerprint so repeat queries skip the EXPLAIN.
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from sql_rewriter import cap_limit, normalize
+
+# off: never explain; warn: annotate only; enforce: warn + rewrite + reject
+COST_GATE_MODE = os.getenv("COST_GATE_MODE", "enforce").lower()
+COST_WARN_ROWS = int(os.getenv("COST_WARN_ROWS", 1_000_000))         # rows examined before warning
+COST_REJECT_ROWS = int(os.getenv("COST_REJECT_ROWS", 50_000_000))    # rows examined before rejecting
+COST_REWRITE_LIMIT = int(os.getenv("COST_REWRITE_LIMIT", 100))       # LIMIT applied to expensive sorted listings
+PLAN_CACHE_SIZE = 512
+PLAN_CACHE_TTL = 300     # Seconds; plans go stale as tables grow
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def fingerprint(sql: str) -> str:
+    """Stable hash of a statement with literals and whitespace normalized."""
+    s = re.sub(r"'(?:[^'\\]|\\.)*'", "?", sql)
+    s = re.sub(r"\b\d+(?:\.\d+)?\b", "?", s)
+    s = re.sub(r"\s+", " ", s).strip().rstrip(";").lower()
+    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+
+
+def _cache_get(key):
+    with _cache_lock:
+        entry = _cache.get(key)
+        if entry is None:
+            return None
+        stored_at, plan = entry
+        if time.monotonic() - stored_at > PLAN_CACHE_TTL:
+            del _cache[key]
+            return None
+        _cache.move_to_end(key)
+        return plan
+
+
+def _cache_put(key, plan):
+    with _cache_lock:
+        _cache[key] = (time.monotonic(), plan)
+        _cache.move_to_end(key)
+        while len(_cache) > PLAN_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def clear_plan_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+# -------------------------------
+# Plan analysis
+# -------------------------------
+def _empty_plan():
+    return {
+        "rows_examined": 0,
+        "full_scans": [],
+        "filesort": False,
+        "temporary": False,
+        "cartesian": False,
+        "query_cost": None,
+    }
+
+
+def _walk_mysql(node, plan, prefix_rows):
+    """Accumulate rows examined over a MySQL EXPLAIN JSON subtree.
+
+    Returns the number of rows the subtree produces, which becomes the
+    fan-out multiplier for the next table in a nested loop.
+    """
+    if isinstance(node, list):
+        rows = prefix_rows
+        for item in node:
+            rows = _walk_mysql(item, plan, rows)
+        return rows
+
+    if not isinstance(node, dict):
+        return prefix_rows
+
+    if node.get("using_filesort"):
+        plan["filesort"] = True
+    if node.get("using_temporary_table"):
+        plan["temporary"] = True
+
+    if "table" in node and isinstance(node["table"], dict):
+        t = node["table"]
+        examined = float(t.get("rows_examined_per_scan", 0) or 0)
+        produced = float(t.get("rows_produced_per_join", examined) or 0)
+        plan["rows_examined"] += prefix_rows * examined
+        if t.get("access_type") == "ALL":
+            plan["full_scans"].append(t.get("table_name"))
+            # A second full scan joined through a join buffer is a cartesian/unindexed join
+            if t.get("using_join_buffer") and prefix_rows > 1:
+                plan["cartesian"] = True
+        # Derived tables / subqueries nested under this table
+        if "materialized_from_subquery" in t:
+            _walk_mysql(t["materialized_from_subquery"], plan, 1)
+        return max(produced, 1.0)
+
+    rows = prefix_rows
+    for key, value in node.items():
+        if key == "nested_loop":
+            # rows_produced_per_join is cumulative in MySQL, so each table's
+            # output is already the fan-out for the next table in the loop
+            rows = _walk_mysql(value, plan, prefix_rows)
+        elif isinstance(value, (dict, list)):
+            _walk_mysql(value, plan, prefix_rows)
+    return rows
+
+
+def _explain_mysql(cursor, sql, params=None):
+    cursor.execute(f"EXPLAIN FORMAT=JSON {sql}", params)
+    row = cursor.fetchone()
+    raw = row[0] if not isinstance(row, dict) else next(iter(row.values()))
+    doc = json.loads(raw)
+
+    plan = _empty_plan()
+    block = doc.get("query_block", {})
+    cost = block.get("cost_info", {}).get("query_cost")
+    plan["query_cost"] = float(cost) if cost is not None else None
+    _walk_mysql(block, plan, 1)
+    return plan
+
+
+def _sqlite_table_rows(cursor, table, stats):
+    from schema_stats import row_estimate
+
+    estimate = row_estimate(stats, table)
+    if estimate is not None:
+        return estimate
+    try:
+        # rowid tables: MAX(rowid) is an O(log n) lookup and a decent upper bound
+        cursor.execute(f"SELECT MAX(rowid) FROM `{table}`")
+        return int(cursor.fetchone()[0] or 0)
+    except Exception:
+        return 0
+
+
+_SQL_KEYWORDS = {"WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "CROSS", "ON", "GROUP", "ORDER", "LIMIT", "USING"}
+
+
+def _alias_map(sql: str) -> dict:
+    """Map table aliases in FROM / JOIN clauses to table names."""
+    aliases = {}
+    pattern = r"(?:\bFROM|\bJOIN|,)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?"
+    for m in re.finditer(pattern, sql, flags=re.IGNORECASE):
+        table, alias = m.group(1), m.group(2)
+        aliases[table] = table
+        if alias and alias.upper() not in _SQL_KEYWORDS:
+            aliases[alias] = table
+    return aliases
+
+
+def _walk_sqlite(children, parent, plan, cursor, aliases, stats, derived, prefix_rows):
+    """Accumulate rows examined over the EXPLAIN QUERY PLAN rows under `parent`.
+
+    Scans and searches directly under one parent are a nested loop, so each
+    multiplies the rows examined by the next; subqueries (LIST SUBQUERY,
+    CO-ROUTINE, MATERIALIZE, compound arms) run once and add to the total,
+    correlated ones once per outer row. Returns the rows the loop produces.
+    """
+    fan_out = 1
+    full_scans = 0
+    for node_id, detail in children.get(parent, ()):
+        m = re.match(r"(SCAN|SEARCH)\s+(?:TABLE\s+)?(\w+)", detail)
+        if m:
+            kind, name = m.group(1), m.group(2)
+            if name in derived:
+                table_rows = derived[name]
+            else:
+                table = aliases.get(name, name)
+                table_rows = _sqlite_table_rows(cursor, table, stats)
+            if kind == "SCAN":
+                plan["rows_examined"] += prefix_rows * fan_out * table_rows
+                fan_out *= max(table_rows, 1)
+                if name not in derived and "COVERING INDEX" not in detail:
+                    plan["full_scans"].append(table)
+                    full_scans += 1
+                    if full_scans > 1:
+                        plan["cartesian"] = True
+            else:
+                # Index lookup: a handful of rows per outer row
+                plan["rows_examined"] += prefix_rows * fan_out
+        elif re.match(r"(CO-ROUTINE|MATERIALIZE)\s+(\w+)", detail):
+            name = detail.split()[1]
+            derived[name] = _walk_sqlite(children, node_id, plan, cursor, aliases, stats, derived, prefix_rows)
+        elif detail.startswith("CORRELATED"):
+            _walk_sqlite(children, node_id, plan, cursor, aliases, stats, derived, prefix_rows * fan_out)
+        else:
+            _walk_sqlite(children, node_id, plan, cursor, aliases, stats, derived, prefix_rows)
+        if "TEMP B-TREE" in detail:
+            if "ORDER BY" in detail:
+                plan["filesort"] = True
+            else:
+                plan["temporary"] = True
+    return fan_out
+
+
+def _explain_sqlite(cursor, sql, stats, params=None):
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params or ())
+    children = {}
+    for node_id, parent, _unused, detail in cursor.fetchall():
+        children.setdefault(parent, []).append((node_id, detail))
+
+    plan = _empty_plan()
+    _walk_sqlite(children, 0, plan, cursor, _alias_map(sql), stats, {}, 1)
+    return plan
+
+
+def explain(sql: str, conn, dialect: str = "mysql", stats=None, use_cache: bool = True, params=None):
+    """Return the analysed plan for `sql`, using the fingerprint cache."""
+    key = (dialect, fingerprint(sql))
+    if use_cache:
+        cached = _cache_get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+
+    cursor = conn.cursor()
+    try:
+        if dialect == "sqlite":
+            plan = _explain_sqlite(cursor, sql, stats, params)
+        else:
+            plan = _explain_mysql(cursor, sql, params)
+    finally:
+        cursor.close()
+
+    plan["rows_examined"] = int(plan["rows_examined"])
+    if use_cache:
+        _cache_put(key, plan)
+    return dict(plan, cached=False)
+
+
+# -------------------------------
+# Decision
+# -------------------------------
+def _is_plain_listing(sql: str) -> bool:
+    upper = sql.upper()
+    return not re.search(r"\bGROUP\s+BY\b|\b(SUM|COUNT|AVG|MIN|MAX)\s*\(", upper)
+
+
+def check_query_cost(sql: str, conn, dialect: str = "mysql", mode: str = None, stats=None, params=None) -> dict:
+    """Decide what to do with `sql` before executing it.
+
+    Returns {"action": "allow"|"warn"|"rewrite"|"reject", "sql": <sql to run>,
+    "plan": <plan or None>, "reasons": [...]}.
+    """
+    mode = (mode or COST_GATE_MODE).lower()
+    decision = {"action": "allow", "sql": sql, "plan": None, "reasons": []}
+    if mode == "off":
+        return decision
+
+    if stats is None:
+        from schema_stats import load_stats
+        stats = load_stats()
+
+    try:
+        plan = explain(sql, conn, dialect=dialect, stats=stats, params=params)
+    except Exception as e:
+        # Let execution surface the real error (syntax, missing table, ...)
+        decision["reasons"].append(f"EXPLAIN failed: {e}")
+        return decision
+
+    decision["plan"] = plan
+    rows = plan["rows_examined"]
+    reasons = decision["reasons"]
+
+    if plan["cartesian"]:
+        reasons.append("unindexed join between full table scans (cartesian product)")
+    if rows > COST_WARN_ROWS:
+        reasons.append(f"estimated {rows:,} rows examined (budget {COST_WARN_ROWS:,})")
+    if plan["full_scans"] and rows > COST_WARN_ROWS:
+        reasons.append("full scan of " + ", ".join(sorted(set(t for t in plan["full_scans"] if t))))
+    if plan["filesort"] and rows > COST_WARN_ROWS:
+        reasons.append("filesort over a large intermediate result")
+
+    if not reasons:
+        return decision
+
+    if mode != "enforce":
+        decision["action"] = "warn"
+        return decision
+
+    if rows > COST_REJECT_ROWS or (plan["cartesian"] and rows > COST_WARN_ROWS):
+        decision["action"] = "reject"
+        return decision
+
+    # Sorted row listings can use a top-N sort instead of a full filesort
+    if plan["filesort"] and _is_plain_listing(sql):
+        rewritten = cap_limit(sql, COST_REWRITE_LIMIT)
+        if rewritten != normalize(sql):
+            decision["action"] = "rewrite"
+            decision["sql"] = rewritten
+            reasons.append(f"LIMIT capped at {COST_REWRITE_LIMIT}")
+            return decision
+
+    decision["action"] = "warn"
+    return decision
@@ -0,0 +1,348 @@
+# Scale-factor bulk data generator (replaces the row-by-row seed.py loop)
+# Generates stores / customers / orders in batches with a deterministic RNG
+# and loads them into MySQL or a local SQLite stand-in.
+#
+# Usage examples:
+#
+# # ~seed.py sized dataset into SQLite (no MySQL server required)
+# python data_generator.py --scale 0.005 --target sqlite
+#
+# # 10M orders into MySQL using LOAD DATA LOCAL INFILE
+# python data_generator.py --scale 100 --target mysql --method load-data --reset
+
+import argparse
+import csv
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Rows generated per unit of scale. scale=1 -> 100k orders, scale=100 -> 10M orders.
+ORDERS_PER_SCALE = 100_000
+CUSTOMERS_PER_SCALE = 10_000
+STORES_PER_SCALE = 40
+
+CITIES = ["Bengaluru", "Mumbai", "Delhi", "Chennai", "Hyderabad", "Pune", "Kolkata", "Ahmedabad"]
+FIRST_NAMES = ["Aarav", "Vivaan", "Aditya", "Diya", "Ananya", "Ishaan", "Kavya", "Rohan",
+               "Saanvi", "Arjun", "Meera", "Kabir", "Priya", "Rahul", "Neha", "Vikram"]
+LAST_NAMES = ["Sharma", "Iyer", "Reddy", "Patel", "Gupta", "Nair", "Singh", "Das",
+              "Mehta", "Rao", "Kapoor", "Joshi", "Menon", "Bose", "Khan", "Verma"]
+
+DEFAULT_BATCH_SIZE = 10_000
+DEFAULT_COMMIT_EVERY = 100_000
+DEFAULT_SEED = 42
+DEFAULT_SQLITE_PATH = os.getenv("SQLITE_PATH", "nlsql_bench.db")
+ORDER_HISTORY_DAYS = 365
+RETURN_RATE = 0.25       # ~25% returns, same as the original seed script
+
+# SQLite stand-in for the MySQL schema in schema.json. Indexes mirror the
+# implicit FK indexes InnoDB creates on orders.customer_id / orders.store_id.
+SQLITE_DDL = [
+    """
+    CREATE TABLE IF NOT EXISTS stores (
+        store_id INTEGER PRIMARY KEY,
+        city VARCHAR(64) NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS customers (
+        customer_id INTEGER PRIMARY KEY,
+        name VARCHAR(128) NOT NULL,
+        city VARCHAR(64) NOT NULL,
+        age INT NOT NULL
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS orders (
+        order_id INTEGER PRIMARY KEY,
+        customer_id INT NOT NULL REFERENCES customers(customer_id),
+        store_id INT NOT NULL REFERENCES stores(store_id),
+        order_date DATE NOT NULL,
+        amount DECIMAL(10, 2) NOT NULL,
+        returned TINYINT NOT NULL
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_orders_customer_id ON orders (customer_id)",
+    "CREATE INDEX IF NOT EXISTS idx_orders_store_id ON orders (store_id)",
+]
+
+TABLE_COLUMNS = {
+    "stores": ("store_id", "city"),
+    "customers": ("customer_id", "name", "city", "age"),
+    "orders": ("order_id", "customer_id", "store_id", "order_date", "amount", "returned"),
+}
+
+
+def table_sizes(scale: float) -> dict:
+    """Row counts per table for a scale factor (at least one store per city)."""
+    return {
+        "stores": max(len(CITIES), int(round(STORES_PER_SCALE * scale))),
+        "customers": max(1, int(round(CUSTOMERS_PER_SCALE * scale))),
+        "orders": max(1, int(round(ORDERS_PER_SCALE * scale))),
+    }
+
+
+def create_sqlite_schema(conn):
+    """Create the stores/customers/orders tables in a SQLite database."""
+    for ddl in SQLITE_DDL:
+        conn.execute(ddl)
+    conn.commit()
+
+
+def get_sqlite_connection(path: str = DEFAULT_SQLITE_PATH):
+    """Open the SQLite stand-in database, creating the schema if needed."""
+    conn = sqlite3.connect(path, check_same_thread=False)
+    create_sqlite_schema(conn)
+    return conn
+
+
+# -------------------------------
+# Batch generators
+# -------------------------------
+# IDs are explicit (LOAD DATA needs them) and start at first_ids[table], so a
+# load into tables that already hold rows appends after them.
+def _store_batches(n_stores: int, batch_size: int, first_id: int = 1):
+    for start in range(0, n_stores, batch_size):
+        stop = min(start + batch_size, n_stores)
+        yield [(first_id + i, CITIES[i % len(CITIES)]) for i in range(start, stop)]
+
+
+def _customer_batches(rng: random.Random, n_customers: int, batch_size: int, first_id: int = 1):
+    full_names = [f"{f} {l}" for f in FIRST_NAMES for l in LAST_NAMES]
+    for start in range(0, n_customers, batch_size):
+        size = min(batch_size, n_customers - start)
+        names = rng.choices(full_names, k=size)
+        cities = rng.choices(CITIES, k=size)
+        ages = [18 + int(r * 48) for r in (rng.random() for _ in range(size))]
+        yield list(zip(range(first_id + start, first_id + start + size), names, cities, ages))
+
+
+def _order_batches(rng: random.Random, n_orders: int, n_customers: int, n_stores: int,
+                   batch_size: int, today: date, first_ids: dict = None):
+    first_ids = first_ids or {}
+    first_order, first_customer, first_store = (first_ids.get(t, 1) for t in ("orders", "customers", "stores"))
+    # Pre-compute the date strings once; orders draw an index into this table.
+    day_table = [(today - timedelta(days=d)).isoformat() for d in range(ORDER_HISTORY_DAYS + 1)]
+    for start in range(0, n_orders, batch_size):
+        size = min(batch_size, n_orders - start)
+        rand = rng.random
+        customer_ids = [first_customer + int(rand() * n_customers) for _ in range(size)]
+        store_ids = [first_store + int(rand() * n_stores) for _ in range(size)]
+        dates = [day_table[int(rand() * len(day_table))] for _ in range(size)]
+        amounts = [round(100 + rand() * 4900, 2) for _ in range(size)]
+        returned = [1 if rand() < RETURN_RATE else 0 for _ in range(size)]
+        yield list(zip(range(first_order + start, first_order + start + size), customer_ids, store_ids, dates,
+                       amounts, returned))
+
+
+# -------------------------------
+# Loaders
+# -------------------------------
+class _Progress:
+    """Prints rows loaded and throughput for one table."""
+
+    def __init__(self, table: str, total: int, quiet: bool = False):
+        self.table = table
+        self.total = total
+        self.quiet = quiet
+        self.done = 0
+        self.started = time.perf_counter()
+
+    def update(self, n: int):
+        self.done += n
+        if self.quiet:
+            return
+        elapsed = time.perf_counter() - self.started
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        pct = 100.0 * self.done / self.total if self.total else 100.0
+        print(f"\r  {self.table}: {self.done:,}/{self.total:,} rows ({pct:5.1f}%) {rate:,.0f} rows/s",
+              end="", file=sys.stderr, flush=True)
+
+    def finish(self) -> float:
+        elapsed = time.perf_counter() - self.started
+        if not self.quiet:
+            print(file=sys.stderr)
+        return elapsed
+
+
+def _insert_sql(table: str, placeholder: str, rows_per_statement: int = 1) -> str:
+    cols = TABLE_COLUMNS[table]
+    group = "(" + ", ".join([placeholder] * len(cols)) + ")"
+    values = ", ".join([group] * rows_per_statement)
+    return f"INSERT INTO {table} ({', '.join(cols)}) VALUES {values}"
+
+
+def _load_executemany(conn, cursor, table, batches, placeholder, progress, commit_every):
+    stmt = _insert_sql(table, placeholder)
+    since_commit = 0
+    for batch in batches:
+        cursor.executemany(stmt, batch)
+        since_commit += len(batch)
+        if since_commit >= commit_every:
+            conn.commit()
+            since_commit = 0
+        progress.update(len(batch))
+    conn.commit()
+
+
+def _load_multirow(conn, cursor, table, batches, placeholder, progress, commit_every, max_params):
+    # One statement per chunk with many VALUES groups; chunk size respects the
+    # driver's bound-parameter limit (SQLite defaults to 32766).
+    width = len(TABLE_COLUMNS[table])
+    rows_per_stmt = max(1, max_params // width)
+    since_commit = 0
+    cached = {}
+    for batch in batches:
+        for i in range(0, len(batch), rows_per_stmt):
+            chunk = batch[i:i + rows_per_stmt]
+            stmt = cached.get(len(chunk))
+            if stmt is None:
+                stmt = cached[len(chunk)] = _insert_sql(table, placeholder, len(chunk))
+            cursor.execute(stmt, [v for row in chunk for v in row])
+        since_commit += len(batch)
+        if since_commit >= commit_every:
+            conn.commit()
+            since_commit = 0
+        progress.update(len(batch))
+    conn.commit()
+
+
+def _load_data_infile(conn, cursor, table, batches, progress):
+    # Stream the generated rows into a temporary CSV, then hand it to the server
+    # in a single LOAD DATA LOCAL INFILE statement.
+    fd, path = tempfile.mkstemp(prefix=f"nlsql_{table}_", suffix=".csv")
+    try:
+        with os.fdopen(fd, "w", newline="") as f:
+            writer = csv.writer(f)
+            for batch in batches:
+                writer.writerows(batch)
+                progress.update(len(batch))
+        cols = ", ".join(TABLE_COLUMNS[table])
+        cursor.execute(
+            f"LOAD DATA LOCAL INFILE '{path}' INTO TABLE {table} "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' "
+            f"LINES TERMINATED BY '\\r\\n' ({cols})"
+        )
+        conn.commit()
+    finally:
+        os.remove(path)
+
+
+def _first_ids(cursor) -> dict:
+    """First free ID per table: one past its current MAX(id)."""
+    first_ids = {}
+    for table, cols in TABLE_COLUMNS.items():
+        cursor.execute(f"SELECT COALESCE(MAX({cols[0]}), 0) FROM {table}")
+        first_ids[table] = int(cursor.fetchone()[0]) + 1
+    return first_ids
+
+
+def _connect(target: str, method: str, sqlite_path: str):
+    if target == "sqlite":
+        if method == "load-data":
+            raise ValueError("LOAD DATA LOCAL INFILE is only supported for the MySQL target")
+        return get_sqlite_connection(sqlite_path), "?"
+
+    import mysql.connector
+    from db import DB_CONFIG
+
+    config = dict(DB_CONFIG)
+    if method == "load-data":
+        config["allow_local_infile"] = True
+    return mysql.connector.connect(**config), "%s"
+
+
+def generate(scale: float = 1.0, seed: int = DEFAULT_SEED, target: str = "sqlite",
+             method: str = "executemany", batch_size: int = DEFAULT_BATCH_SIZE,
+             commit_every: int = DEFAULT_COMMIT_EVERY, sqlite_path: str = DEFAULT_SQLITE_PATH,
+             reset: bool = False, quiet: bool = False, today: date = None) -> dict:
+    """Generate and load a dataset of the given scale.
+
+    Without `reset` the rows are appended after those already loaded.
+    Returns a dict with per-table row counts, seconds and rows/s.
+    """
+    if method not in ("executemany", "multirow", "load-data"):
+        raise ValueError(f"Unknown load method: {method}")
+
+    rng = random.Random(seed)
+    today = today or date.today()
+    sizes = table_sizes(scale)
+
+    conn, placeholder = _connect(target, method, sqlite_path)
+    cursor = conn.cursor()
+    max_params = 32766 if target == "sqlite" else 65535
+
+    if reset:
+        for table in ("orders", "customers", "stores"):
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+    first_ids = _first_ids(cursor)
+
+    batches = {
+        "stores": _store_batches(sizes["stores"], batch_size, first_ids["stores"]),
+        "customers": _customer_batches(rng, sizes["customers"], batch_size, first_ids["customers"]),
+        "orders": _order_batches(rng, sizes["orders"], sizes["customers"], sizes["stores"], batch_size, today,
+                                 first_ids),
+    }
+
+    report = {}
+    try:
+        for table in ("stores", "customers", "orders"):
+            progress = _Progress(table, sizes[table], quiet=quiet)
+            if method == "executemany":
+                _load_executemany(conn, cursor, table, batches[table], placeholder, progress, commit_every)
+            elif method == "multirow":
+                _load_multirow(conn, cursor, table, batches[table], placeholder, progress, commit_every, max_params)
+            else:
+                _load_data_infile(conn, cursor, table, batches[table], progress)
+            elapsed = progress.finish()
+            report[table] = {
+                "rows": sizes[table],
+                "seconds": round(elapsed, 3),
+                "rows_per_sec": round(sizes[table] / elapsed) if elapsed > 0 else None,
+            }
+    finally:
+        cursor.close()
+        conn.close()
+
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate a scaled stores/customers/orders dataset")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help=f"Scale factor ({ORDERS_PER_SCALE:,} orders per unit; 0.005 matches the old seed.py)")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED, help="RNG seed (same seed -> same data)")
+    parser.add_argument("--target", choices=["mysql", "sqlite"], default="sqlite", help="Where to load the data")
+    parser.add_argument("--method", choices=["executemany", "multirow", "load-data"], default="executemany",
+                        help="Insert strategy (load-data is MySQL only)")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Rows generated per batch")
+    parser.add_argument("--commit-every", type=int, default=DEFAULT_COMMIT_EVERY, help="Rows per transaction")
+    parser.add_argument("--sqlite-path", default=DEFAULT_SQLITE_PATH, help="SQLite database file (sqlite target)")
+    parser.add_argument("--reset", action="store_true",
+                        help="Delete existing rows before loading (otherwise new rows are appended)")
+    parser.add_argument("--quiet", action="store_true", help="Suppress progress output")
+    args = parser.parse_args()
+
+    sizes = table_sizes(args.scale)
+    print(f"Generating scale={args.scale} seed={args.seed}: "
+          + ", ".join(f"{t}={n:,}" for t, n in sizes.items()))
+
+    result = generate(
+        scale=args.scale,
+        seed=args.seed,
+        target=args.target,
+        method=args.method,
+        batch_size=args.batch_size,
+        commit_every=args.commit_every,
+        sqlite_path=args.sqlite_path,
+        reset=args.reset,
+        quiet=args.quiet,
+    )
+
+    for table, stats in result.items():
+        print(f"  {table}: {stats['rows']:,} rows in {stats['seconds']}s ({stats['rows_per_sec']:,} rows/s)")
+    print(f"✅ {args.target} database loaded successfully")
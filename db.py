@@ -1,7 +1,13 @@
 # db.py
+# Lazy, health-checked connection pool with checkout metrics.
+# Nothing connects at import time: the pool is created on the first
+# get_connection() call, sized from configuration, validates connections on
+# checkout (ping / reconnect), recycles idle ones and records wait times.
 import os
-import mysql.connector
-from mysql.connector import pooling
+import threading
+import time
+from collections import deque
+from queue import Empty, LifoQueue
 
 # ---- Load from environment variables ----
 DB_CONFIG = {
@@ -14,15 +20,321 @@ DB_CONFIG = {
     "connection_timeout": 10,
 }
 
-# ---- Connection Pool (IMPORTANT) ----
-connection_pool = pooling.MySQLConnectionPool(
-    pool_name="nlsql_pool",
-    pool_size=5,
-    **DB_CONFIG
-)
+# ---- Pool sizing / health settings ----
+# Size the pool to the number of threads that can run queries concurrently
+# (the FastAPI/anyio worker threads of one process) rather than a fixed 5.
+EXECUTOR_THREADS = int(os.environ.get("EXECUTOR_THREADS", 8))
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", EXECUTOR_THREADS))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 5))          # Seconds to wait for a free connection
+DB_POOL_MAX_IDLE = float(os.environ.get("DB_POOL_MAX_IDLE", 300))      # Recycle connections idle longer than this
+DB_POOL_VALIDATE_IDLE = float(os.environ.get("DB_POOL_VALIDATE_IDLE", 1))  # Ping if idle longer than this
+WAIT_SAMPLES = 1024
+
+
+def _mysql_connect(config):
+    import mysql.connector
+    return mysql.connector.connect(**config)
+
+
+def _mysql_ping(conn):
+    conn.ping(reconnect=True, attempts=1, delay=0)
+
+
+class PooledConnection:
+    """Proxy returned by PoolManager.get_connection(); close() returns it to the pool."""
+
+    def __init__(self, manager, raw):
+        self._manager = manager
+        self._raw = raw
+        self._closed = False
+        self.dialect = manager.dialect
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._manager._release(self._raw)
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PoolManager:
+    """Bounded pool of DB connections.
+
+    `connect` creates a raw connection; `ping` validates (and may reconnect)
+    one. Works for mysql.connector and for sqlite3 stand-ins alike; `dialect`
+    is exposed on checked-out connections so callers can adapt their SQL.
+    """
+
+    def __init__(self, connect, size=DB_POOL_SIZE, name="nlsql_pool", ping=None,
+                 timeout=DB_POOL_TIMEOUT, max_idle=DB_POOL_MAX_IDLE, validate_idle=DB_POOL_VALIDATE_IDLE,
+                 dialect="mysql"):
+        if size < 1:
+            raise ValueError("Pool size must be at least 1")
+        self.name = name
+        self.dialect = dialect
+        self.size = size
+        self.timeout = timeout
+        self.max_idle = max_idle
+        self.validate_idle = validate_idle
+        self._connect = connect
+        self._ping = ping
+        self._idle = LifoQueue()          # (raw_connection, returned_at); LIFO keeps hot connections warm
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._open = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._counters = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "created": 0,
+            "recycled": 0,
+            "ping_failures": 0,
+            "wait_total_ms": 0.0,
+        }
+
+    # ---- checkout / return ----
+    def get_connection(self, timeout=None):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout if timeout is None else timeout):
+            with self._lock:
+                self._counters["timeouts"] += 1
+            raise RuntimeError(
+                f"Database pool '{self.name}' exhausted: no connection free within "
+                f"{self.timeout if timeout is None else timeout}s (size={self.size})"
+            )
+
+        try:
+            raw = self._checkout_raw()
+        except Exception:
+            self._slots.release()
+            raise
+
+        wait_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._in_use += 1
+            self._counters["checkouts"] += 1
+            self._counters["wait_total_ms"] += wait_ms
+            self._waits.append(wait_ms)
+        return PooledConnection(self, raw)
+
+    def _checkout_raw(self):
+        now = time.monotonic()
+        while True:
+            try:
+                raw, returned_at = self._idle.get_nowait()
+            except Empty:
+                break
+            idle_for = now - returned_at
+            if idle_for > self.max_idle:
+                self._discard(raw, recycled=True)
+                continue
+            if self._ping is not None and idle_for > self.validate_idle:
+                try:
+                    self._ping(raw)
+                except Exception:
+                    with self._lock:
+                        self._counters["ping_failures"] += 1
+                    self._discard(raw)
+                    continue
+            return raw
+
+        raw = self._connect()
+        with self._lock:
+            self._open += 1
+            self._counters["created"] += 1
+        return raw
+
+    def _release(self, raw):
+        try:
+            if getattr(raw, "in_transaction", False):
+                raw.rollback()
+            self._idle.put((raw, time.monotonic()))
+        except Exception:
+            self._discard(raw)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _discard(self, raw, recycled=False):
+        try:
+            raw.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._open -= 1
+            if recycled:
+                self._counters["recycled"] += 1
+
+    # ---- maintenance / metrics ----
+    def recycle_idle(self):
+        """Close connections idle longer than max_idle (call periodically if desired)."""
+        keep = []
+        now = time.monotonic()
+        while True:
+            try:
+                raw, returned_at = self._idle.get_nowait()
+            except Empty:
+                break
+            if now - returned_at > self.max_idle:
+                self._discard(raw, recycled=True)
+            else:
+                keep.append((raw, returned_at))
+        for item in reversed(keep):
+            self._idle.put(item)
+
+    def close_all(self):
+        while True:
+            try:
+                raw, _ = self._idle.get_nowait()
+            except Empty:
+                break
+            self._discard(raw)
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            counters = dict(self._counters)
+            in_use = self._in_use
+            open_ = self._open
+        checkouts = counters["checkouts"]
+        return {
+            "name": self.name,
+            "size": self.size,
+            "in_use": in_use,
+            "open": open_,
+            "idle": self._idle.qsize(),
+            "utilization": round(in_use / self.size, 3),
+            "checkouts": checkouts,
+            "timeouts": counters["timeouts"],
+            "created": counters["created"],
+            "recycled": counters["recycled"],
+            "ping_failures": counters["ping_failures"],
+            "wait_avg_ms": round(counters["wait_total_ms"] / checkouts, 3) if checkouts else 0.0,
+            "wait_p95_ms": round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+            "wait_max_ms": round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+# ---- Default pool (created lazily) ----
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PoolManager(lambda: _mysql_connect(DB_CONFIG), size=DB_POOL_SIZE,
+                                    name="nlsql_pool", ping=_mysql_ping)
+    return _pool
+
 
 def get_connection():
     try:
-        return connection_pool.get_connection()
+        return get_pool().get_connection()
     except Exception as e:
         raise RuntimeError(f"Database connection failed: {e}")
+
+
+def pool_stats():
+    """Metrics for the default pool, or None if it has not been created yet."""
+    return _pool.stats() if _pool is not None else None
+
+
+# ---- Async variant (aiomysql) for an async pipeline ----
+class AsyncPoolManager:
+    """aiomysql pool created on first use, with the same wait metrics.
+
+    Usage:
+        async with async_pool.connection() as conn:
+            async with conn.cursor() as cur: ...
+    """
+
+    def __init__(self, config=None, size=DB_POOL_SIZE, max_idle=DB_POOL_MAX_IDLE, timeout=DB_POOL_TIMEOUT):
+        self.config = dict(config or DB_CONFIG)
+        self.size = size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._pool = None
+        self._init_lock = None
+        self._in_use = 0
+        self._waits = deque(maxlen=WAIT_SAMPLES)
+        self._checkouts = 0
+
+    async def _get_pool(self):
+        import asyncio
+
+        if self._init_lock is None:
+            self._init_lock = asyncio.Lock()
+        async with self._init_lock:
+            if self._pool is None:
+                try:
+                    import aiomysql
+                except Exception as e:
+                    raise RuntimeError("aiomysql is required for the async pool. Install with: pip install aiomysql") from e
+                cfg = self.config
+                self._pool = await aiomysql.create_pool(
+                    host=cfg["host"], port=cfg["port"], user=cfg["user"], password=cfg["password"],
+                    db=cfg["database"], minsize=0, maxsize=self.size,
+                    pool_recycle=int(self.max_idle), connect_timeout=cfg.get("connection_timeout", 10),
+                )
+        return self._pool
+
+    def connection(self):
+        manager = self
+
+        class _Checkout:
+            async def __aenter__(self_inner):
+                import asyncio
+
+                pool = await manager._get_pool()
+                started = time.perf_counter()
+                try:
+                    self_inner.conn = await asyncio.wait_for(pool.acquire(), timeout=manager.timeout)
+                except asyncio.TimeoutError:
+                    raise RuntimeError(f"Async database pool exhausted (size={manager.size})")
+                try:
+                    await self_inner.conn.ping(reconnect=True)
+                except BaseException:
+                    # A dead connection is closed and handed back so its slot is not lost
+                    self_inner.conn.close()
+                    pool.release(self_inner.conn)
+                    raise
+                manager._waits.append((time.perf_counter() - started) * 1000)
+                manager._checkouts += 1
+                manager._in_use += 1
+                return self_inner.conn
+
+            async def __aexit__(self_inner, *exc):
+                manager._in_use -= 1
+                manager._pool.release(self_inner.conn)
+
+        return _Checkout()
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+    def stats(self):
+        waits = sorted(self._waits)
+        return {
+            "name": "nlsql_async_pool",
+            "size": self.size,
+            "in_use": self._in_use,
+            "utilization": round(self._in_use / self.size, 3),
+            "checkouts": self._checkouts,
+            "wait_p95_ms": round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+            "wait_max_ms": round(waits[-1], 3) if waits else 0.0,
+        }
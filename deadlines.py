@@ -0,0 +1,123 @@
+# End-to-end request deadlines
+# /query opens a Deadline when the request arrives (its deadline_ms, or the
+# admission default for its priority), so queueing and every pipeline stage
+# draw from one budget. Stages ask the active deadline what they can afford:
+# - model stages cap max_new_tokens to what fits (DEADLINE_MS_PER_TOKEN),
+#   keeping back the time later required stages need
+# - the guardrail retry and the explanation are skipped when not even their
+#   minimum fits; the clarifier, SQL generation and execution cannot be
+#   skipped and end the request with DeadlineExceeded instead
+# - execution gets MAX_EXECUTION_TIME / the embedded-engine timeout from the
+#   remaining budget instead of the full QUERY_TIMEOUT
+# Every cut is recorded per stage and returned as the response's "degraded".
+# Without an active deadline (CLI tools, /query/next) stages run unchanged.
+
+import os
+import threading
+import time
+
+DEADLINE_MS_PER_TOKEN = float(os.getenv("DEADLINE_MS_PER_TOKEN", 40))   # decode time per generated token
+DEADLINE_PREFILL_MS = float(os.getenv("DEADLINE_PREFILL_MS", 300))      # fixed cost of one model call
+EXECUTION_RESERVE_MS = float(os.getenv("EXECUTION_RESERVE_MS", 1000))   # kept for running the SQL
+MIN_EXECUTION_MS = 50
+# Fewer tokens than this cannot produce a useful answer for the stage
+STAGE_MIN_TOKENS = {"clarification": 8, "sql": 48, "sql_retry": 48, "explanation": 32}
+
+_active = threading.local()
+_stats = {"requests": 0, "degraded_requests": 0, "exceeded": 0, "stages": {}}
+_stats_lock = threading.Lock()
+
+
+class DeadlineExceeded(RuntimeError):
+    """A required stage cannot run within the request's remaining time."""
+
+    def __init__(self, stage: str, remaining_ms: float):
+        super().__init__(f"Deadline exceeded before {stage} ({max(0.0, remaining_ms):.0f}ms left)")
+        self.stage = stage
+
+
+class Deadline:
+    """A request's time budget; active for the calling thread inside `with`."""
+
+    def __init__(self, seconds: float):
+        self.expires = time.monotonic() + seconds
+        self.degraded = {}   # stage -> what was cut
+
+    @classmethod
+    def after_ms(cls, ms: float) -> "Deadline":
+        return cls(ms / 1000)
+
+    def remaining_ms(self) -> float:
+        return (self.expires - time.monotonic()) * 1000
+
+    def degrade(self, stage: str, reason: str):
+        self.degraded[stage] = reason
+
+    def __enter__(self):
+        self._previous = getattr(_active, "deadline", None)
+        _active.deadline = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.deadline = self._previous
+        with _stats_lock:
+            _stats["requests"] += 1
+            _stats["exceeded"] += isinstance(exc, DeadlineExceeded)
+            if self.degraded:
+                _stats["degraded_requests"] += 1
+            for stage in self.degraded:
+                _stats["stages"][stage] = _stats["stages"].get(stage, 0) + 1
+        return False
+
+
+def current_deadline():
+    return getattr(_active, "deadline", None)
+
+
+def stage_cost_ms(stage: str) -> float:
+    """Least time a model call for `stage` needs (prefill + its minimum tokens)."""
+    return DEADLINE_PREFILL_MS + STAGE_MIN_TOKENS.get(stage, 1) * DEADLINE_MS_PER_TOKEN
+
+
+def token_budget(stage: str, max_new_tokens: int, reserve_ms: float = 0.0) -> int:
+    """max_new_tokens for a `stage` model call that finishes `reserve_ms` before the deadline.
+
+    Returns `max_new_tokens` unchanged without an active deadline, and 0 when
+    not even STAGE_MIN_TOKENS fit (the caller skips the stage or gives up).
+    """
+    deadline = current_deadline()
+    if deadline is None:
+        return max_new_tokens
+    fit = int((deadline.remaining_ms() - reserve_ms - DEADLINE_PREFILL_MS) / DEADLINE_MS_PER_TOKEN)
+    if fit >= max_new_tokens:
+        return max_new_tokens
+    if fit < STAGE_MIN_TOKENS.get(stage, 1):
+        return 0
+    deadline.degrade(stage, f"max_new_tokens capped at {fit}")
+    return fit
+
+
+def skip_stage(stage: str):
+    """Record that `stage` was skipped for lack of time."""
+    deadline = current_deadline()
+    if deadline is not None:
+        deadline.degrade(stage, f"skipped ({max(0.0, deadline.remaining_ms()):.0f}ms left)")
+
+
+def execution_timeout_s(default: float) -> float:
+    """Query timeout in seconds: `default`, or what is left of the active deadline if less."""
+    deadline = current_deadline()
+    if deadline is None:
+        return default
+    left_ms = deadline.remaining_ms()
+    if left_ms < MIN_EXECUTION_MS:
+        raise DeadlineExceeded("execution", left_ms)
+    if left_ms < default * 1000:
+        deadline.degrade("execution", f"timeout {left_ms:.0f}ms")
+        return left_ms / 1000
+    return default
+
+
+def deadline_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats, stages=dict(_stats["stages"]))
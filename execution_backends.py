@@ -0,0 +1,395 @@
+# Pluggable execution backends for generated SQL
+# - mysql:    the live database (read replica / primary), always fresh
+# - snapshot: an embedded engine over a periodically synced local copy of the
+#             tables; DuckDB (columnar, fast GROUP BY scans) when installed,
+#             otherwise SQLite
+#
+# Per query the caller trades freshness for scan speed:
+#   freshness="fresh"  always MySQL
+#   freshness="fast"   the snapshot whenever one exists
+#   freshness="auto"   the snapshot for aggregate queries while it is younger
+#                      than SNAPSHOT_MAX_STALENESS, MySQL otherwise
+#
+# Build / refresh the snapshot manually with:
+#   python execution_backends.py --sync                       (from MySQL)
+#   python execution_backends.py --sync --source-sqlite bench.db
+
+import argparse
+import contextlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+try:
+    import duckdb
+    _HAS_DUCKDB = True
+except Exception:
+    duckdb = None
+    _HAS_DUCKDB = False
+
+from db import DB_POOL_SIZE, PoolManager
+
+QUERY_FRESHNESS = os.getenv("QUERY_FRESHNESS", "fresh")                 # default per-query choice
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshot")
+SNAPSHOT_ENGINE = os.getenv("SNAPSHOT_ENGINE", "auto")                   # auto | duckdb | sqlite
+SNAPSHOT_TABLES = [t.strip() for t in os.getenv("SNAPSHOT_TABLES", "stores,customers,orders").split(",") if t.strip()]
+SNAPSHOT_SYNC_INTERVAL = float(os.getenv("SNAPSHOT_SYNC_INTERVAL", 900))   # seconds; 0 disables background sync
+SNAPSHOT_MAX_STALENESS = float(os.getenv("SNAPSHOT_MAX_STALENESS", 3600))  # "auto" ignores older snapshots
+SNAPSHOT_BATCH_ROWS = int(os.getenv("SNAPSHOT_BATCH_ROWS", 50_000))
+
+# Errors raised by the embedded engines (MySQL errors are handled by the executor)
+ENGINE_ERRORS = (sqlite3.Error,) + ((duckdb.Error,) if _HAS_DUCKDB else ())
+
+
+# -------------------------------
+# Snapshot building
+# -------------------------------
+def _column_type(values, engine: str) -> str:
+    sample = next((v for v in values if v is not None), None)
+    if isinstance(sample, int):
+        return "BIGINT" if engine == "duckdb" else "INTEGER"
+    if isinstance(sample, (float, Decimal)):
+        # DECIMAL precision is not exposed by the cursor; DOUBLE is exact enough for analytics
+        return "DOUBLE" if engine == "duckdb" else "REAL"
+    if isinstance(sample, datetime):
+        return "TIMESTAMP" if engine == "duckdb" else "TEXT"
+    if isinstance(sample, date):
+        return "DATE" if engine == "duckdb" else "TEXT"
+    if isinstance(sample, (bytes, bytearray)):
+        return "BLOB"
+    return "VARCHAR" if engine == "duckdb" else "TEXT"
+
+
+def _sqlite_value(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime)):
+        return value.isoformat(sep=" ") if isinstance(value, datetime) else value.isoformat()
+    if isinstance(value, timedelta):
+        return str(value)
+    return value
+
+
+def _load_schema(path: str = "schema.json"):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _open_target(path: str, engine: str):
+    if engine == "duckdb":
+        return duckdb.connect(path)
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=OFF")
+    conn.execute("PRAGMA synchronous=OFF")
+    return conn
+
+
+def _insert_batch(target, engine: str, table: str, names, rows):
+    placeholders = ", ".join("?" for _ in names)
+    sql = f'INSERT INTO "{table}" VALUES ({placeholders})'
+    if engine == "duckdb":
+        try:
+            import pyarrow
+        except Exception:
+            pyarrow = None
+        if pyarrow is not None:
+            # One vectorized append instead of a row-at-a-time executemany
+            columns = [pyarrow.array(list(col)) for col in zip(*rows)]
+            target.register("_snapshot_batch", pyarrow.Table.from_arrays(columns, names=list(names)))
+            target.execute(f'INSERT INTO "{table}" SELECT * FROM _snapshot_batch')
+            target.unregister("_snapshot_batch")
+            return
+        target.executemany(sql, [list(r) for r in rows])
+        return
+    target.executemany(sql, [tuple(_sqlite_value(v) for v in r) for r in rows])
+
+
+def _table_keys(schema: dict, table: str):
+    """(primary key columns, foreign key columns) of `table` from schema.json."""
+    info = (schema or {}).get(table, {})
+    foreign = [fk.split("\u2192")[0].split("->")[0].strip() for fk in info.get("foreign_keys", [])]
+    return list(info.get("primary_key", [])), foreign
+
+
+def _copy_table(source, target, engine: str, table: str, batch_rows: int, schema: dict = None) -> int:
+    primary, foreign = _table_keys(schema, table)
+    cursor = source.cursor()
+    try:
+        cursor.execute(f"SELECT * FROM {table}")
+        names = [d[0] for d in cursor.description]
+        rows = cursor.fetchmany(batch_rows)
+        types = [_column_type(col, engine) for col in zip(*rows)] if rows else ["VARCHAR" if engine == "duckdb" else "TEXT"] * len(names)
+        columns = [f'"{n}" {t}' for n, t in zip(names, types)]
+        if engine == "sqlite" and primary:
+            # Same row lookups as the source: an integer key becomes the rowid
+            if len(primary) == 1 and types[names.index(primary[0])] == "INTEGER":
+                columns[names.index(primary[0])] += " PRIMARY KEY"
+            else:
+                columns.append("PRIMARY KEY (" + ", ".join(f'"{c}"' for c in primary) + ")")
+        target.execute(f'CREATE TABLE "{table}" ({", ".join(columns)})')
+
+        copied = 0
+        while rows:
+            _insert_batch(target, engine, table, names, rows)
+            copied += len(rows)
+            rows = cursor.fetchmany(batch_rows)
+    finally:
+        cursor.close()
+
+    if engine == "sqlite":
+        # No columnar scans here, so keep the join keys indexed like the source
+        for name in foreign or [n for n in names if n.endswith("_id") and n not in primary]:
+            target.execute(f'CREATE INDEX "idx_{table}_{name}" ON "{table}" ("{name}")')
+    return copied
+
+
+# -------------------------------
+# Snapshot backend
+# -------------------------------
+class SnapshotBackend:
+    """Read-only embedded copy of SNAPSHOT_TABLES, swapped atomically on each sync."""
+
+    def __init__(self, directory=SNAPSHOT_DIR, engine=SNAPSHOT_ENGINE, tables=None, pool_size=DB_POOL_SIZE):
+        if engine == "duckdb" and not _HAS_DUCKDB:
+            raise RuntimeError("duckdb is required for SNAPSHOT_ENGINE=duckdb. Install with: pip install duckdb")
+        self.engine = "duckdb" if engine in ("auto", "duckdb") and _HAS_DUCKDB else "sqlite"
+        self.directory = directory
+        self.tables = list(tables or SNAPSHOT_TABLES)
+        self.pool_size = pool_size
+        self.synced_at = None
+        self.row_counts = {}
+        self.last_error = None
+        self._path = None
+        self._pool = None
+        self._base = None            # DuckDB database handle the pooled cursors come from
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._thread = None
+        self._load_manifest()
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.directory, "manifest.json")
+
+    def _load_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return
+        path = os.path.join(self.directory, manifest["file"])
+        if manifest.get("engine") == self.engine and os.path.exists(path):
+            self._activate(path, manifest["synced_at"], manifest.get("tables", {}))
+
+    def _activate(self, path, synced_at, row_counts):
+        """Point new checkouts at `path`; connections to the previous file are dropped."""
+        if self.engine == "duckdb":
+            base = duckdb.connect(path, read_only=True)
+            pool = PoolManager(base.cursor, size=self.pool_size, name=f"snapshot:{os.path.basename(path)}",
+                               ping=lambda c: c.execute("SELECT 1"), dialect="duckdb")
+        else:
+            base = None
+            uri = f"file:{os.path.abspath(path)}?mode=ro"
+            pool = PoolManager(lambda: sqlite3.connect(uri, uri=True, check_same_thread=False), size=self.pool_size,
+                               name=f"snapshot:{os.path.basename(path)}", ping=lambda c: c.execute("SELECT 1"),
+                               dialect="sqlite")
+
+        with self._lock:
+            old = (self._pool, self._base, self._path)
+            self._pool, self._base, self._path = pool, base, path
+            self.synced_at = synced_at
+            self.row_counts = dict(row_counts)
+
+        # Idle connections to the old file are closed now; checked-out ones finish
+        # their query and are dropped with the old pool (an unlinked file stays
+        # readable while open)
+        old_pool, _, old_path = old
+        if old_pool is not None:
+            old_pool.close_all()
+        if old_path and old_path != path:
+            with contextlib.suppress(OSError):
+                os.remove(old_path)
+
+    # ---- sync ----
+    def sync(self, source=None, batch_rows: int = SNAPSHOT_BATCH_ROWS) -> dict:
+        """Copy the tables from `source` (default: a read connection) into a new snapshot file."""
+        with self._sync_lock:
+            own_source = source is None
+            if own_source:
+                from replica_router import get_read_connection
+                source = get_read_connection()
+            os.makedirs(self.directory, exist_ok=True)
+            ext = "duckdb" if self.engine == "duckdb" else "db"
+            filename = f"snapshot-{int(time.time() * 1000)}.{ext}"
+            path = os.path.join(self.directory, filename)
+
+            started = time.perf_counter()
+            target = _open_target(path, self.engine)
+            try:
+                schema = _load_schema()
+                row_counts = {t: _copy_table(source, target, self.engine, t, batch_rows, schema) for t in self.tables}
+                target.commit()
+            except BaseException:
+                target.close()
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+                raise
+            finally:
+                if own_source:
+                    source.close()
+            target.close()
+
+            synced_at = time.time()
+            from extract_schema import write_json_atomic
+            write_json_atomic(self.manifest_path, {
+                "file": filename, "engine": self.engine, "synced_at": synced_at, "tables": row_counts,
+            })
+            self._activate(path, synced_at, row_counts)
+            self.last_error = None
+            return {"engine": self.engine, "path": path, "tables": row_counts,
+                    "seconds": round(time.perf_counter() - started, 2)}
+
+    def start_sync_thread(self, interval: float = SNAPSHOT_SYNC_INTERVAL):
+        """Refresh the snapshot in the background every `interval` seconds (idempotent)."""
+        if interval <= 0 or (self._thread is not None and self._thread.is_alive()):
+            return
+
+        def loop():
+            while True:
+                age = self.age()
+                if age is None or age >= interval:
+                    try:
+                        self.sync()
+                    except Exception as e:
+                        self.last_error = str(e)
+                    time.sleep(interval)
+                else:
+                    time.sleep(interval - age)
+
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=loop, name="snapshot-sync", daemon=True)
+                self._thread.start()
+
+    # ---- queries ----
+    def available(self) -> bool:
+        return self._pool is not None
+
+    def age(self):
+        return None if self.synced_at is None else time.time() - self.synced_at
+
+    def get_connection(self):
+        with self._lock:
+            pool = self._pool
+        if pool is None:
+            raise RuntimeError("Snapshot has not been synced yet. Run: python execution_backends.py --sync")
+        return pool.get_connection()
+
+    def stats(self):
+        age = self.age()
+        return {
+            "engine": self.engine,
+            "path": self._path,
+            "age_seconds": round(age, 1) if age is not None else None,
+            "tables": self.row_counts,
+            "last_error": self.last_error,
+            "pool": self._pool.stats() if self._pool is not None else None,
+        }
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot() -> SnapshotBackend:
+    global _snapshot
+    if _snapshot is None:
+        with _snapshot_lock:
+            if _snapshot is None:
+                _snapshot = SnapshotBackend()
+    return _snapshot
+
+
+def snapshot_stats():
+    return _snapshot.stats() if _snapshot is not None else None
+
+
+# -------------------------------
+# Backend selection
+# -------------------------------
+_AGGREGATE = re.compile(r"\bGROUP\s+BY\b|\b(SUM|COUNT|AVG|MIN|MAX)\s*\(", re.IGNORECASE)
+_TABLE_REF = re.compile(r"\b(?:FROM|JOIN)\s+[`\"]?([A-Za-z_]\w*)", re.IGNORECASE)
+
+
+def choose_backend(sql: str, freshness: str = None) -> str:
+    """Return "mysql" or "snapshot" for `sql` under the requested freshness."""
+    freshness = (freshness or QUERY_FRESHNESS).lower()
+    if freshness not in ("fast", "auto"):
+        return "mysql"
+
+    snapshot = get_snapshot()
+    snapshot.start_sync_thread()
+    if not snapshot.available():
+        return "mysql"
+    if not set(_TABLE_REF.findall(sql)) <= set(snapshot.tables):
+        return "mysql"
+    if freshness == "fast":
+        return "snapshot"
+    if snapshot.age() <= SNAPSHOT_MAX_STALENESS and _AGGREGATE.search(sql):
+        return "snapshot"
+    return "mysql"
+
+
+@contextlib.contextmanager
+def execution_timeout(conn, cursor, dialect: str, seconds: float):
+    """Abort an embedded-engine query after `seconds` (MySQL uses MAX_EXECUTION_TIME instead).
+
+    SQLite is interrupted through the connection's progress handler; a DuckDB
+    cursor is its own connection, so the cursor itself is interrupted.
+    """
+    if dialect == "sqlite":
+        deadline = time.monotonic() + seconds
+        conn.set_progress_handler(lambda: int(time.monotonic() > deadline), 10_000)
+        try:
+            yield
+        finally:
+            conn.set_progress_handler(None, 0)
+    elif dialect == "duckdb":
+        timer = threading.Timer(seconds, cursor.interrupt)
+        timer.start()
+        try:
+            yield
+        finally:
+            timer.cancel()
+    else:
+        yield
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the embedded analytics snapshot")
+    parser.add_argument("--sync", action="store_true", help="Copy the tables into a fresh snapshot now")
+    parser.add_argument("--source-sqlite", help="Sync from this SQLite database instead of MySQL")
+    parser.add_argument("--batch-rows", type=int, default=SNAPSHOT_BATCH_ROWS)
+    args = parser.parse_args()
+
+    snapshot = get_snapshot()
+    if args.sync:
+        source = sqlite3.connect(args.source_sqlite) if args.source_sqlite else None
+        try:
+            print(json.dumps(snapshot.sync(source=source, batch_rows=args.batch_rows), indent=2))
+        finally:
+            if source is not None:
+                source.close()
+    print(json.dumps(snapshot.stats(), indent=2, default=str))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
 # Prompt template for explaining SQL results safely
 # Explanation is grounded ONLY in SQL + result metadata
+# The result is described by per-column statistics over every returned row
+# (see result_summary.py), not by a handful of sample rows
+
+from result_summary import format_rows, format_summary, summarize_result
 
 EXPLANATION_SYSTEM_PROMPT = """
 You are a data explanation assistant.
@@ -29,9 +33,23 @@ USER QUESTION:
 EXECUTED SQL QUERY:
 {sql}
 
-QUERY RESULT METADATA:
-Row count: {result.get("row_count", 0)}
-Sample rows: {result.get("data", [])[:5]}
+QUERY RESULT SUMMARY:
+{format_summary(summarize_result(result))}
+First rows:
+{format_rows(result)}
 
 Explain the result clearly in natural language.
 """
+
+
+def build_explanation_segments(user_query: str, sql: str, result: dict) -> dict:
+    """Segmented form of build_explanation_prompt for prompt_assembler; the first rows are cut first."""
+    from prompt_assembler import make_prompt, segment
+
+    return make_prompt("explanation", EXPLANATION_SYSTEM_PROMPT, [
+        segment("question", f"\nUSER QUESTION:\n{user_query}\n", "question"),
+        segment("sql", f"\nEXECUTED SQL QUERY:\n{sql}\n", "context"),
+        segment("summary", f"\nQUERY RESULT SUMMARY:\n{format_summary(summarize_result(result))}\n", "instructions"),
+        segment("sample_rows", f"First rows:\n{format_rows(result)}\n", "examples"),
+        segment("footer", "\nExplain the result clearly in natural language.\n", "instructions", static=True),
+    ])
@@ -0,0 +1,168 @@
+# Deferred explanations
+# With explain="deferred" the pipeline returns SQL and rows as soon as the
+# query has run, with a result_id; the explanation is generated by a small
+# background worker pool and fetched from /explain/{result_id}, or pushed over
+# SSE from /explain/{result_id}/events. Jobs are kept for EXPLAIN_JOB_TTL_SECONDS
+# and at most EXPLAIN_JOBS_MAX at a time (oldest evicted first; an evicted job
+# that has not started is never run).
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+EXPLAIN_WORKERS = int(os.getenv("EXPLAIN_WORKERS", 2))
+EXPLAIN_JOBS_MAX = int(os.getenv("EXPLAIN_JOBS_MAX", 1000))
+EXPLAIN_JOB_TTL_SECONDS = float(os.getenv("EXPLAIN_JOB_TTL_SECONDS", 600))
+EXPLAIN_SSE_KEEPALIVE_SECONDS = 15
+
+_stats = {"submitted": 0, "completed": 0, "failed": 0, "evicted": 0, "expired": 0, "total_ms": 0.0}
+_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+
+class ExplanationJob:
+    def __init__(self, user_query: str, sql: str, execution_result: dict):
+        self.id = uuid.uuid4().hex
+        self.status = "pending"   # pending | running | done | failed
+        self.explanation = None
+        self.error = None
+        self.created = time.time()
+        self.finished = None
+        self.cancelled = False
+        self.done = threading.Event()
+        self._inputs = (user_query, sql, execution_result)
+
+    def run(self):
+        from result_explainer import explain_result
+
+        if self.cancelled:
+            return
+        self.status = "running"
+        started = time.perf_counter()
+        user_query, sql, execution_result = self._inputs
+        try:
+            self.explanation = explain_result(user_query=user_query, sql=sql, execution_result=execution_result)
+            self.status = "done"
+            _count(completed=1, total_ms=(time.perf_counter() - started) * 1000)
+        except Exception as e:
+            self.error = str(e)
+            self.status = "failed"
+            _count(failed=1)
+        finally:
+            self._inputs = None   # the rows are not needed any more
+            self.finished = time.time()
+            self.done.set()
+
+    def view(self) -> dict:
+        return {"result_id": self.id, "status": self.status, "explanation": self.explanation, "error": self.error}
+
+
+class JobStore:
+    """Jobs by result id, oldest first; expired and overflowing jobs are evicted."""
+
+    def __init__(self, max_jobs: int = EXPLAIN_JOBS_MAX, ttl: float = EXPLAIN_JOB_TTL_SECONDS):
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _expire(self, now: float):
+        while self._jobs:
+            job = next(iter(self._jobs.values()))
+            if now - job.created <= self.ttl:
+                break
+            self._jobs.popitem(last=False)
+            job.cancelled = True
+            _count(expired=1)
+
+    def put(self, job: ExplanationJob):
+        with self._lock:
+            self._expire(time.time())
+            self._jobs[job.id] = job
+            while len(self._jobs) > self.max_jobs:
+                _, evicted = self._jobs.popitem(last=False)
+                evicted.cancelled = True
+                _count(evicted=1)
+
+    def get(self, result_id: str):
+        with self._lock:
+            self._expire(time.time())
+            return self._jobs.get(result_id)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(1 for job in self._jobs.values() if job.status in ("pending", "running"))
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+
+_store = JobStore()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=EXPLAIN_WORKERS, thread_name_prefix="explainer")
+    return _pool
+
+
+def submit_explanation(user_query: str, sql: str, execution_result: dict) -> str:
+    """Queue the explanation of an executed query; returns its result id."""
+    job = ExplanationJob(user_query, sql, execution_result)
+    _store.put(job)
+    _count(submitted=1)
+    _get_pool().submit(job.run)
+    return job.id
+
+
+def get_explanation(result_id: str):
+    """Status and (when done) explanation of a result, or None if unknown or expired."""
+    job = _store.get(result_id)
+    return job.view() if job else None
+
+
+def wait_explanation(result_id: str, timeout: float = None):
+    """Like get_explanation, after waiting up to `timeout` seconds for the job to finish."""
+    job = _store.get(result_id)
+    if job is None:
+        return None
+    job.done.wait(timeout)
+    return job.view()
+
+
+def explanation_events(result_id: str, keepalive: float = EXPLAIN_SSE_KEEPALIVE_SECONDS):
+    """Server-sent events for a result: comments while pending, then one "explanation" event."""
+    job = _store.get(result_id)
+    while job is not None and not job.done.wait(keepalive):
+        yield ": pending\n\n"
+        if job.cancelled:
+            job = None
+    if job is None:
+        yield f"event: expired\ndata: {json.dumps({'result_id': result_id})}\n\n"
+        return
+    yield f"event: explanation\ndata: {json.dumps(job.view())}\n\n"
+
+
+def explanation_job_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["mean_ms"] = round(stats.pop("total_ms") / stats["completed"], 1) if stats["completed"] else None
+    stats["jobs"] = len(_store)
+    stats["pending"] = _store.pending()
+    stats["workers"] = EXPLAIN_WORKERS
+    return stats
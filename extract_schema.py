@@ -31,98 +31,237 @@ def _get(row, key, pos=0):
             raise KeyError(f"Cannot extract '{key}' from row of type {type(row)}: {row}")
 
 
-def extract_schema(database_name="nlsql_db"):
+# Bulk information_schema queries: a fixed number of round trips per database
+# regardless of table count. Each accepts an optional "AND table_name IN (...)"
+# suffix used by incremental extraction.
+TABLES_SQL = """
+    SELECT table_name, create_time, update_time
+    FROM information_schema.tables
+    WHERE table_schema = %s
+"""
+
+COLUMNS_SQL = """
+    SELECT table_name, column_name, data_type
+    FROM information_schema.columns
+    WHERE table_schema = %s{table_filter}
+    ORDER BY table_name, ordinal_position
+"""
+
+KEYS_SQL = """
+    SELECT
+        table_name,
+        column_name,
+        constraint_name,
+        referenced_table_name,
+        referenced_column_name
+    FROM information_schema.key_column_usage
+    WHERE table_schema = %s{table_filter}
+      AND (constraint_name = 'PRIMARY' OR referenced_table_name IS NOT NULL)
+    ORDER BY table_name, constraint_name, ordinal_position
+"""
+
+
+def _table_filter(tables):
+    """Return (sql_suffix, params) restricting a bulk query to `tables`."""
+    if tables is None:
+        return "", ()
+    placeholders = ", ".join(["%s"] * len(tables))
+    return f" AND table_name IN ({placeholders})", tuple(tables)
+
+
+def _group_schema(tables, column_rows, key_rows):
+    """Group flat information_schema rows into the schema.json shape."""
+    schema = {
+        table: {"columns": {}, "primary_key": [], "foreign_keys": []}
+        for table in tables
+    }
+
+    for row in column_rows:
+        table = _get(row, "table_name")
+        if table not in schema:
+            continue
+        col_name = _get(row, "column_name", pos=1)
+        data_type = _get(row, "data_type", pos=2)
+        schema[table]["columns"][col_name] = str(data_type).upper()
+
+    for row in key_rows:
+        table = _get(row, "table_name")
+        if table not in schema:
+            continue
+        col = _get(row, "column_name", pos=1)
+        if _get(row, "constraint_name", pos=2) == "PRIMARY":
+            schema[table]["primary_key"].append(col)
+            continue
+        ref_table = _get(row, "referenced_table_name", pos=3)
+        ref_col = _get(row, "referenced_column_name", pos=4)
+        if ref_table is not None:
+            schema[table]["foreign_keys"].append(f"{col} → {ref_table}.{ref_col}")
+
+    return schema
+
+
+def _table_versions(cursor, database_name):
+    """Return {table: [create_time, update_time]} as ISO strings (or None)."""
+    cursor.execute(TABLES_SQL, (database_name,))
+    versions = {}
+    for row in cursor.fetchall():
+        table = _get(row, "table_name")
+        created = _get(row, "create_time", pos=1)
+        updated = _get(row, "update_time", pos=2)
+        versions[table] = [
+            created.isoformat() if created is not None else None,
+            updated.isoformat() if updated is not None else None,
+        ]
+    return versions
+
+
+def _extract_tables(cursor, database_name, tables):
+    """Extract columns/keys for `tables` (None = every table) in two bulk queries."""
+    table_filter, filter_params = _table_filter(tables)
+
+    cursor.execute(COLUMNS_SQL.format(table_filter=table_filter), (database_name, *filter_params))
+    column_rows = cursor.fetchall()
+
+    cursor.execute(KEYS_SQL.format(table_filter=table_filter), (database_name, *filter_params))
+    key_rows = cursor.fetchall()
+
+    return column_rows, key_rows
+
+
+def _connect():
+    # Always the primary: schema must not be read from a lagging replica
     try:
-        conn = get_connection()
+        return get_connection()
     except Exception as e:
         raise RuntimeError(
             "Failed to connect to MySQL. Ensure the server is running and credentials in `db.py` are correct. "
             f"Driver error: {e}"
         ) from e
 
-    cursor = conn.cursor(dictionary=True)
 
-    schema = {}
-
-    # -------------------------------
-    # 1. Get all tables
-    # -------------------------------
-    cursor.execute("""
-        SELECT table_name
-        FROM information_schema.tables
-        WHERE table_schema = %s
-    """, (database_name,))
-    
-    tables = [_get(row, "table_name") for row in cursor.fetchall()]
+def extract_schema(database_name="nlsql_db", previous=None, previous_versions=None, return_versions=False):
+    """Extract the schema of `database_name` in three bulk queries.
 
-    for table in tables:
-        schema[table] = {
-            "columns": {},
-            "primary_key": [],
-            "foreign_keys": []
-        }
+    If `previous` (an earlier schema dict) and `previous_versions` (its
+    {table: [create_time, update_time]} map) are given, only tables whose
+    timestamps changed, or that are new, are re-read; unchanged tables are
+    copied from `previous` and dropped tables are removed.
+    """
+    conn = _connect()
+    cursor = conn.cursor(dictionary=True)
 
+    try:
         # -------------------------------
-        # 2. Get columns + data types
+        # 1. Get all tables + change timestamps
         # -------------------------------
-        cursor.execute("""
-            SELECT column_name, data_type
-            FROM information_schema.columns
-            WHERE table_schema = %s AND table_name = %s
-        """, (database_name, table))
+        versions = _table_versions(cursor, database_name)
+        tables = sorted(versions)
 
-        for row in cursor.fetchall():
-            col_name = _get(row, "column_name")
-            data_type = _get(row, "data_type")
-            schema[table]["columns"][col_name] = str(data_type).upper()
+        if previous is not None and previous_versions is not None:
+            changed = [
+                t for t in tables
+                if t not in previous or previous_versions.get(t) != versions[t]
+            ]
+        else:
+            changed = tables
 
         # -------------------------------
-        # 3. Get primary keys
+        # 2. Columns, primary keys and foreign keys in bulk
         # -------------------------------
-        cursor.execute("""
-            SELECT column_name
-            FROM information_schema.key_column_usage
-            WHERE table_schema = %s
-              AND table_name = %s
-              AND constraint_name = 'PRIMARY'
-        """, (database_name, table))
-
-        schema[table]["primary_key"] = [
-            _get(row, "column_name") for row in cursor.fetchall()
-        ]
+        if changed:
+            only = None if len(changed) == len(tables) else changed
+            column_rows, key_rows = _extract_tables(cursor, database_name, only)
+            fresh = _group_schema(changed, column_rows, key_rows)
+        else:
+            fresh = {}
+    finally:
+        cursor.close()
+        conn.close()
 
-        # -------------------------------
-        # 4. Get foreign keys
-        # -------------------------------
-        cursor.execute("""
-            SELECT
-                column_name,
-                referenced_table_name,
-                referenced_column_name
-            FROM information_schema.key_column_usage
-            WHERE table_schema = %s
-              AND table_name = %s
-              AND referenced_table_name IS NOT NULL
-        """, (database_name, table))
-
-        for row in cursor.fetchall():
-            col = _get(row, "column_name")
-            ref_table = _get(row, "referenced_table_name")
-            ref_col = _get(row, "referenced_column_name")
-            fk = f"{col} → {ref_table}.{ref_col}"
-            schema[table]["foreign_keys"].append(fk)
-
-    cursor.close()
-    conn.close()
+    schema = {}
+    for table in tables:
+        schema[table] = fresh[table] if table in fresh else previous[table]
+
+    if return_versions:
+        return schema, versions
     return schema
 
 
+def extract_schemas(database_names, max_workers=4, previous=None, previous_versions=None):
+    """Extract several databases concurrently, one pooled connection each.
+
+    Returns {database: (schema, versions)}. `previous` / `previous_versions`
+    are optional {database: ...} maps enabling incremental extraction.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    previous = previous or {}
+    previous_versions = previous_versions or {}
+
+    def _one(db_name):
+        return extract_schema(
+            db_name,
+            previous=previous.get(db_name),
+            previous_versions=previous_versions.get(db_name),
+            return_versions=True,
+        )
+
+    workers = max(1, min(max_workers, len(database_names)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_one, database_names))
+    return dict(zip(database_names, results))
+
+
+def write_json_atomic(path, data):
+    """Write JSON to a temp file in the same directory, then rename over `path`."""
+    import os
+    import tempfile
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix=".schema-", suffix=".json.tmp", dir=directory)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _state_path(output_path):
+    import os
+    return os.path.splitext(output_path)[0] + ".state.json"
+
+
+def _load_json(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
 if __name__ == "__main__":
     import argparse
 
     parser = argparse.ArgumentParser(description="Extract DB schema or run a dry-run test")
     parser.add_argument("--dry-run", action="store_true", help="Run local tests for _get without connecting to a DB")
-    parser.add_argument("--database", default="nlsql_db", help="Database name to extract from")
+    parser.add_argument("--database", nargs="+", default=["nlsql_db"], help="Database name(s) to extract from")
+    parser.add_argument("--output", default=None,
+                        help="Output path; may contain {database} (default: schema.json, or schema_{database}.json for several)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only re-read tables whose CREATE_TIME/UPDATE_TIME changed since the last run")
+    parser.add_argument("--workers", type=int, default=4, help="Databases extracted concurrently")
+    parser.add_argument("--stats", action="store_true",
+                        help="Also collect row estimates, indexes and sampled column stats into a sidecar file")
+    parser.add_argument("--stats-output", default=None,
+                        help="Stats sidecar path; may contain {database} (default: schema_stats.json)")
+    parser.add_argument("--stats-max-age", type=float, default=None,
+                        help="Skip stats collection if the sidecar is younger than this many seconds (for cron)")
+    parser.add_argument("--stats-sample-rows", type=int, default=None, help="Rows sampled per table for column stats")
     args = parser.parse_args()
 
     if args.dry_run:
@@ -139,12 +278,64 @@ if __name__ == "__main__":
         # tuple row
         r4 = ("products",)
         assert _get(r4, "table_name", pos=0) == "products"
-        print("✅ _get tests passed")
+        # bulk rows grouped per table
+        grouped = _group_schema(
+            ["orders", "stores"],
+            [("orders", "order_id", "int"), ("orders", "store_id", "int"), ("stores", "store_id", "int")],
+            [("orders", "order_id", "PRIMARY", None, None),
+             ("orders", "store_id", "orders_ibfk_1", "stores", "store_id"),
+             ("stores", "store_id", "PRIMARY", None, None)],
+        )
+        assert grouped["orders"]["columns"] == {"order_id": "INT", "store_id": "INT"}
+        assert grouped["orders"]["primary_key"] == ["order_id"]
+        assert grouped["orders"]["foreign_keys"] == ["store_id → stores.store_id"]
+        assert grouped["stores"]["foreign_keys"] == []
+        print("✅ _get / _group_schema tests passed")
         raise SystemExit(0)
 
-    schema_json = extract_schema(args.database)
-    
-    with open("schema.json", "w") as f:
-        json.dump(schema_json, f, indent=2)
+    databases = args.database
+    if args.output:
+        output_template = args.output
+    else:
+        output_template = "schema.json" if len(databases) == 1 else "schema_{database}.json"
+    outputs = {db_name: output_template.format(database=db_name) for db_name in databases}
+
+    previous, previous_versions = {}, {}
+    if args.incremental:
+        for db_name, path in outputs.items():
+            state = _load_json(_state_path(path))
+            schema = _load_json(path)
+            if schema is not None and state is not None and state.get("database") == db_name:
+                previous[db_name] = schema
+                previous_versions[db_name] = state.get("tables", {})
+
+    results = extract_schemas(databases, max_workers=args.workers,
+                              previous=previous, previous_versions=previous_versions)
+
+    for db_name, (schema_json, versions) in results.items():
+        path = outputs[db_name]
+        write_json_atomic(path, schema_json)
+        write_json_atomic(_state_path(path), {"database": db_name, "tables": versions})
+        print(f"✅ Schema for {db_name} extracted and saved to {path}")
+
+    if args.stats:
+        import schema_stats
 
-    print("✅ Schema extracted and saved to schema.json")
+        stats_template = args.stats_output or (
+            schema_stats.SCHEMA_STATS_PATH if len(databases) == 1 else "schema_stats_{database}.json"
+        )
+        for db_name, (schema_json, _) in results.items():
+            stats_path = stats_template.format(database=db_name)
+            conn = _connect()
+            try:
+                stats = schema_stats.refresh_stats(
+                    conn,
+                    schema_json,
+                    database_name=db_name,
+                    path=stats_path,
+                    max_age=args.stats_max_age if args.stats_max_age is not None else 0,
+                    sample_rows=args.stats_sample_rows or schema_stats.SAMPLE_ROWS,
+                )
+            finally:
+                conn.close()
+            print(f"✅ Stats for {db_name} ({len(stats['tables'])} tables) saved to {stats_path}")
@@ -0,0 +1,216 @@
+# Text generation entry point shared by every pipeline stage
+# - local mode: the process-wide model from llm_loader
+# - server mode (INFERENCE_SOCKET set): prompts go to inference_server.py over
+#   a Unix socket, so API workers never import torch or hold model weights
+#
+# Stages call generate_prompt(prompt, ...) with a prompt_assembler prompt (or
+# generate_chat(messages, ...) with plain chat messages) and get the decoded
+# completion back in either mode; prompts are assembled where the tokenizer is.
+
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+INFERENCE_SOCKET = os.getenv("INFERENCE_SOCKET", "")
+INFERENCE_TIMEOUT = float(os.getenv("INFERENCE_TIMEOUT", 120))   # seconds per request in server mode
+
+
+_batching = threading.local()
+
+
+def remote_enabled() -> bool:
+    return bool(INFERENCE_SOCKET)
+
+
+@contextmanager
+def batched_generation():
+    """Local-mode calls from this thread share batched generate() calls with other
+    threads inside this context (the inference server already batches remote ones)."""
+    previous = getattr(_batching, "on", False)
+    _batching.on = True
+    try:
+        yield
+    finally:
+        _batching.on = previous
+
+
+def _local_llm():
+    from llm_loader import load_llm
+
+    try:
+        return load_llm()
+    except RuntimeError as e:
+        # If the failure is due to missing `accelerate` (required for device_map="auto"),
+        # retry loading on CPU to provide a friendlier fallback.
+        msg = str(e).lower()
+        if "accelerate" in msg or "torch.set_default_device" in msg:
+            return load_llm(force_cpu=True)
+        raise
+
+
+def _generation_kwargs(params: dict) -> dict:
+    return {k: v for k, v in params.items() if v is not None}
+
+
+def _encode_batch(tokenizer, items):
+    """Input ids for chat message lists or prompt_assembler prompts, plus assembly reports."""
+    from prompt_assembler import assemble, is_prompt
+
+    ids, reports = [], []
+    for item in items:
+        if is_prompt(item):
+            item_ids, report = assemble(tokenizer, item)
+        else:
+            text = tokenizer.apply_chat_template(item, tokenize=False, add_generation_prompt=True)
+            item_ids, report = tokenizer(text)["input_ids"], None
+        ids.append(item_ids)
+        reports.append(report)
+    return ids, reports
+
+
+def generate_batch_local(tokenizer, model, batch, params: dict):
+    """Run one batched generate() over several prompts with the same parameters.
+
+    Returns (texts, reports); a report is None for plain message lists. With
+    num_return_sequences > 1 each text is a list of that many completions.
+    """
+    import torch
+    from profiling import torch_profiler
+
+    ids, reports = _encode_batch(tokenizer, batch)
+    # Decoder-only batching: pad on the left so every prompt ends at the same position
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    inputs = tokenizer.pad({"input_ids": ids}, return_tensors="pt").to(model.device)
+
+    # torch.profiler trace when the calling request is profiled with PROFILE_TORCH (see profiling.py)
+    with torch.no_grad(), torch_profiler():
+        output = model.generate(**inputs, **_generation_kwargs(params))
+
+    prompt_len = inputs["input_ids"].shape[-1]
+    texts = [tokenizer.decode(seq[prompt_len:], skip_special_tokens=True).strip() for seq in output]
+    n = params.get("num_return_sequences") or 1
+    if n > 1:
+        # generate() returns the n sequences of each prompt consecutively
+        texts = [texts[i * n:(i + 1) * n] for i in range(len(ids))]
+    return texts, reports
+
+
+def _generate(item, params: dict, tokenizer, model) -> str:
+    from prompt_assembler import record
+    from traffic_capture import capture_llm, recorded_output
+
+    # Replays (replay.py) answer from the captured outputs instead of the model
+    stage = item.get("stage", "chat") if isinstance(item, dict) else "chat"
+    text = recorded_output(stage)
+    if text is not None:
+        return text
+
+    started = time.perf_counter()
+    if (tokenizer is None or model is None) and remote_enabled():
+        text, report = get_client().generate(item, params)
+    elif (tokenizer is None or model is None) and getattr(_batching, "on", False):
+        text, report = get_local_scheduler().submit(item, params).result()
+    else:
+        if tokenizer is None or model is None:
+            tokenizer, model = _local_llm()
+        texts, reports = generate_batch_local(tokenizer, model, [item], params)
+        text, report = texts[0], reports[0]
+    if report:
+        record(report)
+    capture_llm(stage, text, (time.perf_counter() - started) * 1000)
+    return text
+
+
+def generate_chat(messages, max_new_tokens: int = 256, temperature: float = None, top_p: float = None,
+                  tokenizer=None, model=None) -> str:
+    """Generate a completion for one chat prompt.
+
+    Uses `tokenizer`/`model` when given, otherwise the inference server (if
+    INFERENCE_SOCKET is set) or the shared local model.
+    """
+    params = {"max_new_tokens": max_new_tokens, "temperature": temperature, "top_p": top_p}
+    return _generate(messages, params, tokenizer, model)
+
+
+def generate_prompt(prompt: dict, max_new_tokens: int = 256, temperature: float = None, top_p: float = None,
+                    tokenizer=None, model=None) -> str:
+    """Like generate_chat, for a prompt_assembler prompt (budgeted, cached static segments)."""
+    params = {"max_new_tokens": max_new_tokens, "temperature": temperature, "top_p": top_p}
+    return _generate(prompt, params, tokenizer, model)
+
+
+def generate_candidates(prompt: dict, n: int, max_new_tokens: int = 256, tokenizer=None, model=None,
+                        **generation) -> list:
+    """`n` completions of one prompt from a single generate() call (num_return_sequences).
+
+    `generation` holds the decoding strategy, e.g. do_sample/temperature or num_beams.
+    """
+    params = dict(generation, max_new_tokens=max_new_tokens, num_return_sequences=n)
+    texts = _generate(prompt, params, tokenizer, model)
+    return texts if isinstance(texts, list) else [texts]
+
+
+# -------------------------------
+# Client for inference_server.py
+# -------------------------------
+class InferenceClient:
+    """Newline-delimited JSON over a Unix socket; one short-lived connection per call."""
+
+    def __init__(self, socket_path: str = INFERENCE_SOCKET, timeout: float = INFERENCE_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def _call(self, payload: dict) -> dict:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+                with sock.makefile("rb") as f:
+                    line = f.readline()
+        except OSError as e:
+            raise RuntimeError(f"Inference server unavailable at {self.socket_path}: {e}") from e
+        if not line:
+            raise RuntimeError("Inference server closed the connection without a reply")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(f"Inference server error: {reply['error']}")
+        return reply
+
+    def generate(self, item, params: dict):
+        """(text, assembly report) for a message list or prompt_assembler prompt."""
+        reply = self._call({"op": "generate", "messages": item, "params": params})
+        return reply["text"], reply.get("report")
+
+    def status(self) -> dict:
+        return self._call({"op": "status"})
+
+
+_client = None
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_local_scheduler():
+    """In-process inference_server.BatchScheduler over the shared local model."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from inference_server import BatchScheduler
+
+                tokenizer, model = _local_llm()
+                _scheduler = BatchScheduler(tokenizer, model)
+    return _scheduler
+
+
+def get_client() -> InferenceClient:
+    global _client
+    if _client is None:
+        _client = InferenceClient()
+    return _client
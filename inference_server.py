@@ -0,0 +1,188 @@
+"""inference_server.py
+
+One process owns the model and a batching scheduler; API workers send chat
+prompts (message lists or prompt_assembler prompts, assembled and token-cached
+here) over a Unix socket (see inference.InferenceClient), so adding uvicorn
+workers does not add model copies.
+
+Usage:
+python inference_server.py --socket /tmp/nlsql-inference.sock
+INFERENCE_SOCKET=/tmp/nlsql-inference.sock uvicorn main:app --workers 4
+
+# Canned completions at simulated model latency (no torch; see mock_llm.py)
+python inference_server.py --socket /tmp/nlsql-inference.sock --mock
+"""
+import argparse
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 8))
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", 10))   # how long the first request waits for company
+DEFAULT_SOCKET = os.getenv("INFERENCE_SOCKET", "/tmp/nlsql-inference.sock")
+
+
+class BatchScheduler:
+    """Collects concurrent requests into batches and runs them on one model thread.
+
+    Requests wait at most BATCH_MAX_WAIT_MS for others to arrive; a batch is
+    split by generation parameters, since one generate() call takes one config.
+    """
+
+    def __init__(self, tokenizer, model, max_batch: int = BATCH_MAX_SIZE, max_wait_ms: float = BATCH_MAX_WAIT_MS,
+                 generate=None):
+        self.tokenizer = tokenizer
+        self.model = model
+        # generate(batch, params) -> (texts, reports); defaults to the local model
+        self.generate = generate
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._stats = {"requests": 0, "batches": 0, "generate_calls": 0, "busy_seconds": 0.0, "max_batch_seen": 0}
+        self._lock = threading.Lock()
+        threading.Thread(target=self._loop, name="batch-scheduler", daemon=True).start()
+
+    def submit(self, messages, params: dict) -> Future:
+        future = Future()
+        self._queue.put((messages, params, future))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        from inference import generate_batch_local
+
+        generate = self.generate or (lambda batch, params: generate_batch_local(self.tokenizer, self.model, batch, params))
+        while True:
+            batch = self._collect()
+            groups = {}
+            for item in batch:
+                groups.setdefault(json.dumps(item[1], sort_keys=True), []).append(item)
+
+            started = time.perf_counter()
+            for items in groups.values():
+                try:
+                    texts, reports = generate([m for m, _, _ in items], items[0][1])
+                    for (_, _, future), text, report in zip(items, texts, reports):
+                        future.set_result((text, report))
+                except Exception as e:
+                    for _, _, future in items:
+                        future.set_exception(e)
+
+            with self._lock:
+                self._stats["requests"] += len(batch)
+                self._stats["batches"] += 1
+                self._stats["generate_calls"] += len(groups)
+                self._stats["busy_seconds"] += time.perf_counter() - started
+                self._stats["max_batch_seen"] = max(self._stats["max_batch_seen"], len(batch))
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+        stats["queued"] = self._queue.qsize()
+        stats["avg_batch_size"] = round(stats["requests"] / stats["batches"], 2) if stats["batches"] else 0.0
+        stats["busy_seconds"] = round(stats["busy_seconds"], 2)
+        return stats
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                reply = self.server.dispatch(request)
+            except Exception as e:
+                reply = {"error": str(e)}
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, scheduler: BatchScheduler, timeout: float, mock: bool = False):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super().__init__(socket_path, _Handler)
+        os.chmod(socket_path, 0o660)
+        self.scheduler = scheduler
+        self.timeout_seconds = timeout
+        self.mock = mock
+
+    def dispatch(self, request: dict) -> dict:
+        op = request.get("op")
+        if op == "generate":
+            future = self.scheduler.submit(request["messages"], request.get("params") or {})
+            text, report = future.result(timeout=self.timeout_seconds)
+            return {"text": text, "report": report}
+        if op == "status":
+            from startup import local_readiness
+            server = {"status": "mock", "ready": True, "models": []} if self.mock else local_readiness()
+            return {"server": server, "scheduler": self.scheduler.stats(), "pid": os.getpid()}
+        return {"error": f"Unknown op: {op!r}"}
+
+
+def main():
+    from inference import INFERENCE_TIMEOUT
+
+    parser = argparse.ArgumentParser(description="Serve the shared model to API workers over a Unix socket")
+    parser.add_argument("--socket", default=DEFAULT_SOCKET, help="Unix socket path")
+    parser.add_argument("--max-batch", type=int, default=BATCH_MAX_SIZE)
+    parser.add_argument("--max-wait-ms", type=float, default=BATCH_MAX_WAIT_MS)
+    parser.add_argument("--model-name", default=None, help="Model to load (default: llm_loader.MODEL_NAME)")
+    parser.add_argument("--mock", action="store_true", help="Serve canned completions at simulated latency (mock_llm.py)")
+    args = parser.parse_args()
+
+    if args.mock:
+        from mock_llm import MockGenerator
+
+        scheduler = BatchScheduler(None, None, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms,
+                                   generate=MockGenerator().generate_batch)
+        _serve(InferenceServer(args.socket, scheduler, timeout=INFERENCE_TIMEOUT, mock=True), args.socket)
+        return
+
+    import startup
+    from llm_loader import MODEL_NAME, load_llm
+
+    # Load and warm up before accepting connections: clients see "unavailable" until then
+    print("Loading model ...")
+    if args.model_name and args.model_name != MODEL_NAME:
+        tokenizer, model = load_llm(args.model_name)
+    else:
+        startup.preload_and_warm_up()
+        state = startup.local_readiness()
+        if not state["ready"]:
+            raise SystemExit(f"Model failed to load: {state['error']}")
+        tokenizer, model = load_llm()
+
+    scheduler = BatchScheduler(tokenizer, model, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+    _serve(InferenceServer(args.socket, scheduler, timeout=INFERENCE_TIMEOUT), args.socket)
+
+
+def _serve(server: InferenceServer, socket_path: str):
+    print(f"Inference server ready on {socket_path} (pid {os.getpid()})")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+if __name__ == "__main__":
+    main()
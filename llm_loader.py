@@ -1,7 +1,37 @@
 # Loads Qwen2.5-32B-Instruct locally using HuggingFace
 # Assumes GPU (recommended: ≥24GB VRAM) or quantized/optimized weights
+# Loads from the local safetensors layout written by prepare_model.py when it
+# exists (memory-mapped, dtype baked in), and keeps one loaded copy per
+# process so every pipeline stage shares it.
+
+import json
+import os
+import threading
 
 MODEL_NAME = "Qwen/Qwen2.5-0.5B-Instruct"
+PREPARED_MODEL_DIR = os.getenv("PREPARED_MODEL_DIR", "prepared_model")
+PREPARED_MANIFEST = "prepared.json"
+
+_loaded = {}
+_load_lock = threading.Lock()
+
+
+def prepared_manifest(path: str = PREPARED_MODEL_DIR):
+    """Manifest of a prepared model directory, or None if there is none."""
+    try:
+        with open(os.path.join(path, PREPARED_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def loaded_models():
+    """Describe the models loaded in this process (for readiness reporting)."""
+    return [
+        {"model": name, "force_cpu": force_cpu, "source": getattr(model, "_nlsql_source", None),
+         "device": str(getattr(model, "device", "")), "dtype": str(getattr(model, "dtype", ""))}
+        for (name, force_cpu), (_, model) in _loaded.items()
+    ]
 
 
 def load_llm(model_name: str = MODEL_NAME, force_cpu: bool = False):
@@ -9,12 +39,25 @@ def load_llm(model_name: str = MODEL_NAME, force_cpu: bool = False):
     to avoid import-time side effects (segfaults or CUDA init) when the module
     is imported in a minimal environment.
 
+    The first call per (model_name, force_cpu) loads the model; later calls
+    return the same instance.
+
     Parameters:
         model_name: HF model identifier
         force_cpu: if True, force loading on CPU even if CUDA is available
 
     Returns: (tokenizer, model)
     """
+    key = (model_name, force_cpu)
+    if key in _loaded:
+        return _loaded[key]
+    with _load_lock:
+        if key not in _loaded:
+            _loaded[key] = _load(model_name, force_cpu)
+    return _loaded[key]
+
+
+def _load(model_name: str, force_cpu: bool):
     try:
         from transformers import AutoModelForCausalLM, AutoTokenizer
     except Exception as e:
@@ -25,8 +68,14 @@ def load_llm(model_name: str = MODEL_NAME, force_cpu: bool = False):
     except Exception as e:
         raise RuntimeError("PyTorch is required to load the LLM. Install with: pip install torch") from e
 
+    # Prefer the pre-converted local copy of this model
+    manifest = prepared_manifest()
+    prepared = manifest is not None and manifest.get("source_model") == model_name
+    source = PREPARED_MODEL_DIR if prepared else model_name
+    extra = {"low_cpu_mem_usage": True, "use_safetensors": True, "local_files_only": True} if prepared else {}
+
     # Load tokenizer
-    tokenizer = AutoTokenizer.from_pretrained(model_name, trust_remote_code=True)
+    tokenizer = AutoTokenizer.from_pretrained(source, trust_remote_code=True, **({"local_files_only": True} if prepared else {}))
 
     # Choose dtype/device settings based on availability and user override
     if force_cpu:
@@ -50,12 +99,20 @@ def load_llm(model_name: str = MODEL_NAME, force_cpu: bool = False):
             dtype = torch.float32
             device_map = "cpu"
 
+    if prepared:
+        # Use the dtype the weights were saved in (no conversion at load time),
+        # except half precision on CPU, which is not safe for every op
+        baked = getattr(torch, manifest["dtype"])
+        if not (device_map == "cpu" and baked == torch.float16):
+            dtype = baked
+
     try:
         model = AutoModelForCausalLM.from_pretrained(
-            model_name,
+            source,
             dtype=dtype,
             device_map=device_map,
-            trust_remote_code=True
+            trust_remote_code=True,
+            **extra
         )
     except Exception as e:
         raise RuntimeError(
@@ -63,4 +120,5 @@ def load_llm(model_name: str = MODEL_NAME, force_cpu: bool = False):
         ) from e
 
     model.eval()
+    model._nlsql_source = "prepared" if prepared else "hub"
     return tokenizer, model
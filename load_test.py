@@ -0,0 +1,378 @@
+"""load_test.py
+
+Load generator for the /query API: replays a weighted mix of questions
+(cacheable, ambiguous, multi-turn follow-ups, heavy aggregation) at stepped
+concurrency (closed loop) or arrival rate (open loop) and reports throughput,
+p50/p99 latency, error and shed (429) rate per step, plus the highest step
+that stayed within the error budget and latency SLO.
+
+Usage examples:
+
+# Against an app that is already running
+python load_test.py --url http://127.0.0.1:8000 --mode closed --steps 1,2,4,8,16 --duration 30
+
+# Self-contained: mock inference server (mock_llm.py) + SQLite stand-in + uvicorn main:app
+python data_generator.py --scale 1 --target sqlite --sqlite-path bench.db
+python load_test.py --launch mock --sqlite-path bench.db --mode open --steps 1,2,5,10,20
+
+# Same with the real model, saved; later builds are compared against it
+python load_test.py --launch model --sqlite-path bench.db --save baseline.json
+python load_test.py --launch model --sqlite-path bench.db --compare baseline.json
+"""
+import argparse
+import http.client
+import itertools
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from mock_llm import HEAVY_SQL
+from test_cases import GOLDEN_SQL
+
+# category: (weight, scripts); a script is the turns of one user session
+QUESTION_MIX = {
+    "cacheable": (4, [[case["question"]] for case in GOLDEN_SQL]),
+    "ambiguous": (1, [["Show top stores"], ["Who are the best customers?"], ["Which city has the most orders?"]]),
+    "multi_turn": (2, [
+        ["Show total revenue per city", "now only Mumbai and Delhi", "sort that by total revenue ascending"],
+        ["Show revenue, order count and return rate per customer city and store city", "only Pune", "top 3"],
+    ]),
+    "heavy": (1, [[case["question"]] for case in HEAVY_SQL]),
+}
+REQUEST_TIMEOUT = 120   # seconds per HTTP request
+
+
+def parse_mix(spec: str) -> dict:
+    """'cacheable=4,heavy=1' -> QUESTION_MIX with those weights (others dropped)."""
+    if not spec:
+        return dict(QUESTION_MIX)
+    mix = {}
+    for part in spec.split(","):
+        name, _, weight = part.partition("=")
+        if name not in QUESTION_MIX:
+            raise SystemExit(f"Unknown mix category {name!r}; choose from {sorted(QUESTION_MIX)}")
+        mix[name] = (float(weight or 1), QUESTION_MIX[name][1])
+    return mix
+
+
+# -------------------------------
+# Client
+# -------------------------------
+class Client:
+    """One keep-alive HTTP connection (use one per thread)."""
+
+    def __init__(self, base_url: str, timeout: float = REQUEST_TIMEOUT):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self._conn = None
+
+    def request(self, method: str, path: str, body: dict = None):
+        payload = json.dumps(body).encode("utf-8") if body is not None else None
+        for attempt in (0, 1):
+            if self._conn is None:
+                self._conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                self._conn.request(method, path, body=payload, headers={"Content-Type": "application/json"})
+                response = self._conn.getresponse()
+                return response.status, response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                # The server closed an idle keep-alive connection: reconnect once
+                self._conn.close()
+                self._conn = None
+                if attempt:
+                    raise
+
+    def close(self):
+        if self._conn is not None:
+            self._conn.close()
+
+
+_local = threading.local()
+
+
+def _client(base_url: str) -> Client:
+    if getattr(_local, "client", None) is None:
+        _local.client = Client(base_url)
+    return _local.client
+
+
+def _outcome(status: int, body: bytes) -> str:
+    if status == 429:
+        return "shed"
+    if status != 200:
+        return "error"
+    try:
+        return "error" if json.loads(body).get("status") in ("error", "timeout") else "ok"
+    except ValueError:
+        return "error"
+
+
+class Recorder:
+    """Request samples of one step: (category, latency seconds, outcome)."""
+
+    def __init__(self):
+        self.samples = []
+        self._lock = threading.Lock()
+
+    def add(self, category: str, latency: float, outcome: str):
+        with self._lock:
+            self.samples.append((category, latency, outcome))
+
+
+_session_ids = itertools.count()
+
+
+def run_script(base_url: str, category: str, turns, recorder: Recorder, started: float = None, record: bool = True):
+    """Run one session's turns in order. `started` is the intended start of the
+    first turn (open loop), so time spent waiting for a free thread counts."""
+    client = _client(base_url)
+    session_id = f"load-{os.getpid()}-{next(_session_ids)}"
+    for turn in turns:
+        begin = started if started is not None else time.perf_counter()
+        started = None
+        try:
+            status, body = client.request("POST", "/query", {"query": turn, "session_id": session_id})
+            outcome = _outcome(status, body)
+        except (OSError, http.client.HTTPException):
+            client.close()
+            _local.client = None
+            outcome = "error"
+        if record:
+            recorder.add(category, time.perf_counter() - begin, outcome)
+        if outcome != "ok":
+            break   # the rest of the conversation depends on this turn
+
+
+# -------------------------------
+# Load shapes
+# -------------------------------
+def _picker(mix: dict, rng: random.Random):
+    names = list(mix)
+    weights = [mix[name][0] for name in names]
+
+    def pick():
+        name = rng.choices(names, weights)[0]
+        return name, rng.choice(mix[name][1])
+    return pick
+
+
+def closed_loop(base_url: str, mix: dict, concurrency: int, duration: float, warmup: float, seed: int) -> Recorder:
+    """`concurrency` users, each starting its next session as soon as the last one ends."""
+    recorder = Recorder()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def user(index):
+        pick = _picker(mix, random.Random(seed + index))
+        while time.perf_counter() < stop_at:
+            category, turns = pick()
+            run_script(base_url, category, turns, recorder, record=time.perf_counter() >= measure_from)
+
+    threads = [threading.Thread(target=user, args=(i,), daemon=True) for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return recorder
+
+
+def open_loop(base_url: str, mix: dict, rate: float, duration: float, warmup: float, seed: int,
+              max_inflight: int = 512) -> Recorder:
+    """Sessions arrive as a Poisson process at `rate` per second, whether or not earlier ones finished."""
+    recorder = Recorder()
+    rng = random.Random(seed)
+    pick = _picker(mix, rng)
+    begin = time.perf_counter()
+    measure_from, stop_at = begin + warmup, begin + warmup + duration
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        arrival = begin
+        while True:
+            arrival += rng.expovariate(rate)
+            if arrival >= stop_at:
+                break
+            delay = arrival - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            category, turns = pick()
+            pool.submit(run_script, base_url, category, turns, recorder, arrival, arrival >= measure_from)
+    return recorder
+
+
+# -------------------------------
+# Reporting
+# -------------------------------
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return None
+    # Nearest rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return round(sorted_values[index] * 1000, 1)
+
+
+def summarize(samples, duration: float) -> dict:
+    latencies = sorted(s[1] for s in samples)
+    n = len(samples)
+    ok = sum(1 for s in samples if s[2] == "ok")
+    return {
+        "requests": n,
+        "throughput_rps": round(ok / duration, 2),
+        "p50_ms": _percentile(latencies, 0.50),
+        "p99_ms": _percentile(latencies, 0.99),
+        "error_rate": round(sum(1 for s in samples if s[2] == "error") / n, 4) if n else 0.0,
+        "shed_rate": round(sum(1 for s in samples if s[2] == "shed") / n, 4) if n else 0.0,
+    }
+
+
+def step_report(mode: str, level: float, recorder: Recorder, duration: float) -> dict:
+    row = {"mode": mode, "level": level}
+    row.update(summarize(recorder.samples, duration))
+    by_category = {}
+    for sample in recorder.samples:
+        by_category.setdefault(sample[0], []).append(sample)
+    row["by_category"] = {name: summarize(samples, duration) for name, samples in sorted(by_category.items())}
+    return row
+
+
+def saturation(steps, max_error_rate: float, slo_ms: float = None):
+    """Highest-throughput step within the error budget (errors + shed) and p99 SLO."""
+    healthy = [
+        s for s in steps
+        if s["error_rate"] + s["shed_rate"] <= max_error_rate and (slo_ms is None or (s["p99_ms"] or 0) <= slo_ms)
+    ]
+    return max(healthy, key=lambda s: s["throughput_rps"], default=None)
+
+
+def print_step(row: dict, baseline: dict = None):
+    line = (f"  {row['mode']:6} level={row['level']:<6g} req={row['requests']:<6} "
+            f"rps={row['throughput_rps']:<8} p50={row['p50_ms']}ms p99={row['p99_ms']}ms "
+            f"err={row['error_rate']:.2%} shed={row['shed_rate']:.2%}")
+    if baseline:
+        line += (f"  | vs baseline: rps {row['throughput_rps'] - baseline['throughput_rps']:+.2f}, "
+                 f"p99 {(row['p99_ms'] or 0) - (baseline['p99_ms'] or 0):+.1f}ms")
+    print(line)
+    for name, cat in row["by_category"].items():
+        print(f"      {name:11} req={cat['requests']:<6} p50={cat['p50_ms']}ms p99={cat['p99_ms']}ms "
+              f"err={cat['error_rate']:.2%} shed={cat['shed_rate']:.2%}")
+
+
+# -------------------------------
+# Launching a local stack
+# -------------------------------
+def _wait_ready(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    client = Client(base_url, timeout=5)
+    while time.monotonic() < deadline:
+        try:
+            status, _ = client.request("GET", "/ready")
+            if status == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            client = Client(base_url, timeout=5)
+        time.sleep(0.5)
+    raise SystemExit(f"App at {base_url} did not become ready within {timeout:.0f}s")
+
+
+def launch(backend: str, app: str, port: int, workers: int, sqlite_path: str, ready_timeout: float):
+    """Start inference_server.py (mock or model) and uvicorn; returns (base_url, processes)."""
+    socket_path = os.path.join(tempfile.mkdtemp(prefix="nlsql-load-"), "inference.sock")
+    env = dict(os.environ, INFERENCE_SOCKET=socket_path)
+    if sqlite_path:
+        env["DB_READ_ENDPOINTS"] = f"sqlite:///{os.path.abspath(sqlite_path)}"
+
+    server_cmd = [sys.executable, "inference_server.py", "--socket", socket_path]
+    if backend == "mock":
+        server_cmd.append("--mock")
+    processes = [subprocess.Popen(server_cmd, env=env)]
+    app_cmd = [sys.executable, "-m", "uvicorn", f"{app}:app", "--host", "127.0.0.1", "--port", str(port),
+               "--workers", str(workers), "--log-level", "warning"]
+    processes.append(subprocess.Popen(app_cmd, env=env))
+
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_ready(base_url, ready_timeout)
+    except SystemExit:
+        stop(processes)
+        raise
+    return base_url, processes
+
+
+def stop(processes):
+    for process in reversed(processes):
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Throughput/latency curve of the /query API")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="App to load (ignored with --launch)")
+    parser.add_argument("--launch", choices=["mock", "model"], help="Start inference_server.py + uvicorn first")
+    parser.add_argument("--app", choices=["main", "api"], default="main", help="App module for --launch")
+    parser.add_argument("--port", type=int, default=8765, help="Port for --launch")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for --launch")
+    parser.add_argument("--sqlite-path", default=None, help="SQLite stand-in (DB_READ_ENDPOINTS) for --launch")
+    parser.add_argument("--ready-timeout", type=float, default=600, help="Seconds to wait for /ready")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed")
+    parser.add_argument("--steps", default="1,2,4,8,16",
+                        help="Concurrent users (closed) or sessions per second (open), comma separated")
+    parser.add_argument("--duration", type=float, default=30, help="Measured seconds per step")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds at the start of each step")
+    parser.add_argument("--mix", default="", help="Category weights, e.g. cacheable=4,ambiguous=1,multi_turn=2,heavy=1")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error + shed budget for the saturation point")
+    parser.add_argument("--slo-ms", type=float, default=None, help="p99 latency SLO for the saturation point")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", default=None, help="Write the results as JSON")
+    parser.add_argument("--compare", default=None, help="Baseline JSON from --save to compare against")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    levels = [float(x) for x in args.steps.split(",") if x.strip()]
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = {(s["mode"], s["level"]): s for s in json.load(f)["steps"]}
+
+    processes = []
+    base_url = args.url
+    if args.launch:
+        base_url, processes = launch(args.launch, args.app, args.port, args.workers, args.sqlite_path, args.ready_timeout)
+    try:
+        steps = []
+        for level in levels:
+            if args.mode == "closed":
+                recorder = closed_loop(base_url, mix, int(level), args.duration, args.warmup, args.seed)
+            else:
+                recorder = open_loop(base_url, mix, level, args.duration, args.warmup, args.seed)
+            row = step_report(args.mode, level, recorder, args.duration)
+            print_step(row, baseline.get((args.mode, level)))
+            steps.append(row)
+    finally:
+        stop(processes)
+
+    knee = saturation(steps, args.max_error_rate, args.slo_ms)
+    if knee:
+        print(f"\nSaturation: {knee['throughput_rps']} req/s at {args.mode} level {knee['level']:g} "
+              f"(p99 {knee['p99_ms']}ms)")
+    else:
+        print("\nSaturation: no step stayed within the error budget" + (" and SLO" if args.slo_ms else ""))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"url": base_url, "launch": args.launch, "mode": args.mode, "mix": {k: v[0] for k, v in mix.items()},
+                       "duration": args.duration, "steps": steps, "saturation": knee}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
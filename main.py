@@ -1,20 +1,195 @@
 # main.py
-from fastapi import FastAPI
-from fastapi.responses import HTMLResponse
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel
-from nl_to_sql_pipeline import run_nl_to_sql
+from typing import Literal, Optional
+from nl_to_sql_pipeline import answerable_without_model, run_nl_to_sql
+from admission import DEFAULT_DEADLINE_MS, Overloaded, admission_stats, get_controller
+from deadlines import Deadline, deadline_stats
+from prompt_assembler import prompt_stats
+from sql_templates import template_stats
+from result_frames import frame_stats
+from profiling import PROFILE_HEADER, PROFILING_ENABLED, list_profiles, profile_file, request_profiler
+from traffic_capture import capture_request, capture_stats
+from explanation_jobs import explanation_events, explanation_job_stats, get_explanation
+from batch_query import batch_stats, plan_batch, run_batch
+from pagination import fetch_next_page
+from db import pool_stats
+from replica_router import replica_stats
+from execution_backends import snapshot_stats
+from startup import lifespan, readiness
+from result_encoding import encode_payload, negotiate
 import os
 
-app = FastAPI(title="NL → SQL Analytics")
+# Preloads and warms up the model in the background; see /ready
+app = FastAPI(title="NL → SQL Analytics", lifespan=lifespan)
 
 # ---------- API MODEL ----------
 class QueryRequest(BaseModel):
     query: str
+    # "fresh" (live MySQL), "fast" (local analytics snapshot) or "auto"
+    freshness: Optional[str] = None
+    # "interactive" (default) or "batch"; batch waits behind interactive traffic
+    priority: Literal["interactive", "batch"] = "interactive"
+    # How long the caller is willing to wait for the answer, queueing included;
+    # stages are cut short (see "degraded" in the response) to fit it
+    deadline_ms: Optional[int] = None
+    # Follow-ups in the same session can be answered from its last result
+    session_id: Optional[str] = None
+    # "deferred" returns SQL and rows without waiting for the explanation;
+    # fetch it from /explain/{result_id}. "none" skips the explanation.
+    explain: Literal["inline", "deferred", "none"] = "inline"
+
+class NextPageRequest(BaseModel):
+    token: str
+
+class BatchItem(BaseModel):
+    query: str
+    session_id: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    queries: list[BatchItem]
+    freshness: Optional[str] = None
+    explain: Literal["inline", "deferred", "none"] = "inline"
 
 # ---------- API ENDPOINT ----------
+# Result encoding follows the Accept header: application/json (rows),
+# application/vnd.nlsql.columnar+json or application/vnd.apache.arrow.stream
 @app.post("/query")
-def query_db(req: QueryRequest):
-    return run_nl_to_sql(req.query)
+def query_db(req: QueryRequest, request: Request):
+    fmt = negotiate(request.headers.get("accept"))
+    # The deadline runs from arrival, so time spent queueing is not available to the stages
+    deadline = Deadline.after_ms(req.deadline_ms or DEFAULT_DEADLINE_MS[req.priority])
+    # No-op unless PROFILING_ENABLED and the X-Profile header (or sampling) asks for it
+    profiler = request_profiler(request.headers.get(PROFILE_HEADER), label=req.query)
+    # Appends the request to the replay log when TRAFFIC_CAPTURE_PATH is set (see replay.py)
+    capture = capture_request(req.query, session_id=req.session_id, priority=req.priority,
+                              freshness=req.freshness, deadline_ms=req.deadline_ms, result_format=fmt,
+                              explain=req.explain)
+    with profiler, capture:
+        try:
+            bypass = answerable_without_model(req.query, session_id=req.session_id)
+            with get_controller().admit(req.priority, req.deadline_ms, bypass=bypass):
+                response = run_nl_to_sql(req.query, result_format="rows" if fmt == "rows" else "columnar",
+                                         freshness=req.freshness, session_id=req.session_id, deadline=deadline,
+                                         explain=req.explain)
+            capture.set_response(response)
+        except Overloaded as e:
+            capture.set_response({"status": "overloaded"})
+            return JSONResponse(
+                content={"status": "overloaded", "error": str(e), "reason": e.reason},
+                status_code=429, headers={"Retry-After": str(e.retry_after)},
+            )
+        body, media_type = encode_payload(response, fmt)
+    headers = {"X-Profile-Id": profiler.id} if hasattr(profiler, "id") else None
+    return Response(content=body, media_type=media_type, headers=headers)
+
+@app.post("/query/batch")
+def query_batch(req: BatchRequest, request: Request):
+    # Newline-delimited JSON, one line per question as it completes (see batch_query.py);
+    # every question is admitted on its own at batch priority
+    fmt = "rows" if negotiate(request.headers.get("accept")) == "rows" else "columnar"
+    entries = [{"query": item.query, "session_id": item.session_id} for item in req.queries]
+    try:
+        plan_batch(entries)
+    except ValueError as e:
+        return JSONResponse(content={"status": "error", "error": str(e)}, status_code=400)
+    items = run_batch(entries, result_format=fmt, freshness=req.freshness, explain=req.explain,
+                      admission=get_controller())
+    return StreamingResponse((encode_payload(item, fmt)[0] + b"\n" for item in items),
+                             media_type="application/x-ndjson")
+
+@app.post("/query/next")
+def query_next(req: NextPageRequest, request: Request):
+    # Continuation pages skip the LLM stages entirely
+    fmt = negotiate(request.headers.get("accept"))
+    response = fetch_next_page(req.token, result_format="rows" if fmt == "rows" else "columnar")
+    body, media_type = encode_payload(response, fmt)
+    return Response(content=body, media_type=media_type)
+
+@app.get("/explain/{result_id}")
+def explanation(result_id: str):
+    # Deferred explanation: status "pending"/"running" until it is ready
+    job = get_explanation(result_id)
+    if job is None:
+        return JSONResponse(content={"error": f"Unknown or expired result id: {result_id}"}, status_code=404)
+    return job
+
+@app.get("/explain/{result_id}/events")
+def explanation_stream(result_id: str):
+    # Server-sent events: one "explanation" event when it is ready ("expired" if it never will be)
+    if get_explanation(result_id) is None:
+        return JSONResponse(content={"error": f"Unknown or expired result id: {result_id}"}, status_code=404)
+    return StreamingResponse(explanation_events(result_id), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache"})
+
+# ---------- METRICS ----------
+@app.get("/metrics/db")
+def db_metrics():
+    # Checkout wait times and utilization of the connection pool
+    return {"pool": pool_stats(), "replicas": replica_stats(), "snapshot": snapshot_stats()}
+
+@app.get("/metrics/queue")
+def queue_metrics():
+    # Admission queue depth, wait times and rejections
+    return admission_stats()
+
+@app.get("/metrics/prompts")
+def prompt_metrics():
+    # Prompt token counts per stage against their budgets
+    return prompt_stats()
+
+@app.get("/metrics/templates")
+def template_metrics():
+    # SQL template library hits (answered without the model) and misses
+    return template_stats()
+
+@app.get("/metrics/frames")
+def frame_metrics():
+    # Follow-ups answered from a session's last result instead of a new query
+    return frame_stats()
+
+@app.get("/metrics/batch")
+def batch_metrics():
+    # /query/batch questions answered, deduplicated, and wall time per question
+    return batch_stats()
+
+@app.get("/metrics/explanations")
+def explanation_metrics():
+    # Deferred explanation jobs: queued, finished, evicted and mean generation time
+    return explanation_job_stats()
+
+@app.get("/metrics/deadlines")
+def deadline_metrics():
+    # Requests that had stages cut short (per stage) or ran out of time
+    return deadline_stats()
+
+@app.get("/metrics/capture")
+def capture_metrics():
+    # Requests written to the replay log, and records dropped when the writer fell behind
+    return capture_stats()
+
+@app.get("/admin/profiles")
+def profiles():
+    # Stored request profiles, newest first (404 unless PROFILING_ENABLED)
+    if not PROFILING_ENABLED:
+        return JSONResponse(content={"error": "Profiling is disabled"}, status_code=404)
+    return {"profiles": list_profiles()}
+
+@app.get("/admin/profiles/{name}")
+def profile_download(name: str):
+    # Collapsed stacks (flamegraph.pl / speedscope), metadata or torch trace of one profile
+    path = profile_file(name) if PROFILING_ENABLED else None
+    if path is None:
+        return JSONResponse(content={"error": f"No such profile file: {name}"}, status_code=404)
+    return FileResponse(path, filename=name, media_type="text/plain" if name.endswith(".collapsed") else "application/json")
+
+# ---------- READINESS ----------
+@app.get("/ready")
+def ready():
+    # 503 until the model is loaded and every stage is warmed up
+    state = readiness()
+    return JSONResponse(content=state, status_code=200 if state["ready"] else 503)
 
 # ---------- UI ENDPOINT ----------
 @app.get("/", response_class=HTMLResponse)
@@ -0,0 +1,81 @@
+# Mock generation backend for load tests and development without a GPU
+# Stands in for generate_batch_local inside inference_server.py (--mock):
+# answers each pipeline stage with a canned completion and sleeps like a
+# batched generate() call would (one prefill plus per-token decode time per
+# batch), so the API, admission control, batching and the database path can
+# be exercised at realistic timings without torch or model weights.
+
+import os
+import re
+import time
+
+MOCK_PREFILL_MS = float(os.getenv("MOCK_PREFILL_MS", 40))        # per generate() call
+MOCK_MS_PER_TOKEN = float(os.getenv("MOCK_MS_PER_TOKEN", 15))    # per decoded token, shared by the batch
+# Decoded tokens per stage (capped by max_new_tokens)
+MOCK_STAGE_TOKENS = {"clarification": 6, "sql": 60, "sql_retry": 60, "explanation": 80}
+
+# Queries the load test uses beyond test_cases.GOLDEN_SQL
+HEAVY_SQL = [
+    {
+        "question": "Show revenue, order count and return rate per customer city and store city",
+        "sql": "SELECT c.city AS customer_city, s.city AS store_city, SUM(o.amount) AS total_revenue, "
+               "COUNT(*) AS order_count, AVG(o.returned) AS return_rate FROM orders o "
+               "JOIN customers c ON o.customer_id = c.customer_id JOIN stores s ON o.store_id = s.store_id "
+               "GROUP BY c.city, s.city ORDER BY total_revenue DESC"
+    },
+    {
+        "question": "Show the number of orders and total spend per customer",
+        "sql": "SELECT o.customer_id, COUNT(*) AS order_count, SUM(o.amount) AS total_spend FROM orders o "
+               "GROUP BY o.customer_id ORDER BY total_spend DESC"
+    },
+]
+FALLBACK_SQL = (
+    "SELECT s.city, SUM(o.amount) AS total_revenue FROM orders o JOIN stores s ON o.store_id = s.store_id "
+    "GROUP BY s.city ORDER BY total_revenue DESC"
+)
+
+
+def _words(text: str):
+    return set(re.findall(r"[a-z0-9]+", text.lower()))
+
+
+class MockGenerator:
+    """Canned completions per stage with simulated batched-generation latency."""
+
+    def __init__(self, prefill_ms: float = MOCK_PREFILL_MS, ms_per_token: float = MOCK_MS_PER_TOKEN):
+        from test_cases import GOLDEN_SQL
+
+        self.prefill = prefill_ms / 1000
+        self.per_token = ms_per_token / 1000
+        self.catalog = [(_words(case["question"]), case["sql"]) for case in GOLDEN_SQL + HEAVY_SQL]
+
+    def _question(self, item) -> str:
+        if isinstance(item, dict):
+            return " ".join(s["text"] for s in item["segments"] if s["kind"] == "question")
+        return item[-1]["content"] if item else ""
+
+    def _sql(self, question: str) -> str:
+        words = _words(question)
+        score, sql = max(((len(words & w) / len(words | w), sql) for w, sql in self.catalog), default=(0, None))
+        return sql if score >= 0.5 else FALLBACK_SQL
+
+    def complete(self, item) -> str:
+        stage = item.get("stage") if isinstance(item, dict) else "clarification"
+        if stage in ("sql", "sql_retry"):
+            return self._sql(self._question(item))
+        if stage == "explanation":
+            return "The query returned the requested figures; the first rows hold the largest values."
+        return "NO_CLARIFICATION_NEEDED"
+
+    def generate_batch(self, batch, params: dict):
+        """Same contract as inference.generate_batch_local: (texts, reports)."""
+        stages = [item.get("stage") if isinstance(item, dict) else "clarification" for item in batch]
+        tokens = max(MOCK_STAGE_TOKENS.get(stage, 32) for stage in stages)
+        tokens = min(tokens, params.get("max_new_tokens") or tokens)
+        time.sleep(self.prefill + tokens * self.per_token)
+
+        texts = [self.complete(item) for item in batch]
+        n = params.get("num_return_sequences") or 1
+        if n > 1:
+            texts = [[text] * n for text in texts]
+        return texts, [None] * len(batch)
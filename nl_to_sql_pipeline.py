@@ -7,7 +7,14 @@ from clarification_engine import check_clarification
 from conversation_state import ConversationState
 from sql_generator import generate_sql
 from sql_executor import execute_sql
+from sql_rewriter import ensure_limit, has_top_level_limit
+from pagination import PAGE_SIZE, next_token, plan_pagination
 from result_explainer import explain_result
+from sql_templates import match_template, record_validated
+from result_frames import can_refine, refine, remember_result
+from traffic_capture import timed
+from deadlines import DeadlineExceeded
+from explanation_jobs import submit_explanation
 
 state = ConversationState()
 
@@ -60,16 +67,62 @@ def _has_unrequested_filters(sql: str, original_query: str, allowed_filter_cols=
     return False
 
 
-def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
+def answerable_without_model(user_query: str, allow_defaults: bool = False, session_id: str = None) -> bool:
+    """True if run_nl_to_sql will answer `user_query` with a fixed clarification
+    question or from the session's last result, touching neither the model nor
+    the database (admission bypass)."""
+    if state.has_pending():
+        return state.is_same_pending(user_query)
+    if can_refine(session_id, user_query):
+        return True
+    tokens = set(user_query.lower().split())
+    return bool(tokens.intersection(AMBIGUOUS_KEYWORDS)) and (STRICT_MODE or not allow_defaults)
+
+
+def run_nl_to_sql(user_query: str, allow_defaults: bool = False, result_format: str = "rows", freshness: str = None,
+                  session_id: str = None, deadline=None, explain: str = "inline", conversation: ConversationState = None):
+    """Answer `user_query`; with a deadlines.Deadline every stage fits the request's
+    remaining time, and the stages cut short are listed under "degraded".
+    explain="deferred" returns as soon as the SQL has run, with a result_id whose
+    explanation is generated in the background (see explanation_jobs.py);
+    explain="none" returns no explanation at all.
+    `conversation` replaces the process-wide pending clarification (batch items)."""
+    args = (user_query, allow_defaults, result_format, freshness, session_id, explain, conversation)
+    if deadline is None:
+        return _run_nl_to_sql(*args)
+    try:
+        with deadline:
+            response = _run_nl_to_sql(*args)
+    except DeadlineExceeded as e:
+        response = {"status": "timeout", "sql": None, "error": str(e)}
+    if deadline.degraded:
+        response["degraded"] = dict(deadline.degraded)
+    return response
+
+
+def _run_nl_to_sql(user_query: str, allow_defaults: bool, result_format: str, freshness: str, session_id: str,
+                   explain: str, conversation: ConversationState):
+    if conversation is None:
+        conversation = state
+
+    # Follow-ups that only filter/sort/re-aggregate the session's last result
+    # are answered from it, without the model or the database
+    if not conversation.has_pending():
+        with timed("refine"):
+            refined = refine(session_id, user_query, result_format=result_format)
+        if refined:
+            return refined
+
     with open("schema.json") as f:
         schema = json.load(f)
+    templated = None
 
     # Quick heuristic: if query contains ambiguous keywords and there's no pending clarification
     tokens = set(user_query.lower().split())
-    if tokens.intersection(AMBIGUOUS_KEYWORDS) and not state.has_pending():
+    if tokens.intersection(AMBIGUOUS_KEYWORDS) and not conversation.has_pending():
         # When strict mode is enabled, always require clarification for 'top' queries
         if STRICT_MODE:
-            state.set_pending(user_query, question="Top by which metric (total revenue, number of orders, or return rate)?")
+            conversation.set_pending(user_query, question="Top by which metric (total revenue, number of orders, or return rate)?")
             return {
                 "status": "needs_clarification",
                 "question": "Top by which metric (total revenue, number of orders, or return rate)?"
@@ -83,7 +136,7 @@ def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
                 "(apply defaults only; DO NOT add extra filters or invent values)"
             )
         else:
-            state.set_pending(user_query, question="Top by which metric (total revenue, number of orders, or return rate)?")
+            conversation.set_pending(user_query, question="Top by which metric (total revenue, number of orders, or return rate)?")
             return {
                 "status": "needs_clarification",
                 "question": "Top by which metric (total revenue, number of orders, or return rate)?"
@@ -92,12 +145,12 @@ def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
     # -------------------------------
     # CASE 1: Pending clarification exists
     # -------------------------------
-    if state.has_pending():
+    if conversation.has_pending():
         # If the user repeated the SAME ambiguous query, re-ask the SAME clarification
-        if state.is_same_pending(user_query):
+        if conversation.is_same_pending(user_query):
             return {
                 "status": "needs_clarification",
-                "question": state.get_pending_question()
+                "question": conversation.get_pending_question()
             }
 
         # If the user provided a clarification-like answer, merge and proceed WITHOUT re-validating clarification
@@ -117,23 +170,30 @@ def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
             return False
 
         if _is_clarification_answer(user_query):
-            full_query = state.resolve_pending(user_query)
+            full_query = conversation.resolve_pending(user_query)
         else:
             # Unrelated query — reset pending and treat as a fresh query
-            state.reset_pending()
+            conversation.reset_pending()
             # continue to normal clarification detection below
             pass
-    elif 'full_query' not in locals():
+
+    if 'full_query' not in locals():
         # Deterministic check for ambiguous 'top' queries when strict mode is enabled
         if STRICT_MODE and tokens.intersection(AMBIGUOUS_KEYWORDS):
-            state.set_pending(user_query, question="Top by which metric (total revenue, number of orders, or return rate)?")
+            conversation.set_pending(user_query, question="Top by which metric (total revenue, number of orders, or return rate)?")
             return {
                 "status": "needs_clarification",
                 "question": "Top by which metric (total revenue, number of orders, or return rate)?"
             }
 
+        # A confident template match has the shape of a question answered before
+        # without clarification, so the model-based clarifier is skipped for it
+        with timed("template"):
+            templated = match_template(user_query, schema)
+
         # Check if clarification is required (fallback to model-based clarifier for other ambiguity types)
-        clarification = check_clarification(user_query, schema)
+        with timed("clarification"):
+            clarification = "NO_CLARIFICATION_NEEDED" if templated else check_clarification(user_query, schema)
 
         if clarification != "NO_CLARIFICATION_NEEDED":
             # If strict mode is enabled, never apply defaults automatically
@@ -143,7 +203,7 @@ def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
                     "(apply defaults only; DO NOT add extra filters or invent values)"
                 )
             else:
-                state.set_pending(user_query, question=clarification)
+                conversation.set_pending(user_query, question=clarification)
                 return {
                     "status": "needs_clarification",
                     "question": clarification
@@ -154,13 +214,19 @@ def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
     # -------------------------------
     # CASE 2: Safe to generate SQL
     # -------------------------------
-    sql = generate_sql(full_query, schema)
+    # Questions shaped like a learned SQL template skip the model entirely
+    if templated is None:
+        with timed("template"):
+            templated = match_template(full_query, schema)
+    with timed("generation"):
+        sql = templated["sql"] if templated else generate_sql(full_query, schema)
 
     # If the model clearly couldn't produce a SQL, optionally retry with defaults (disabled in strict mode)
     if sql == "INSUFFICIENT_INFORMATION":
         if not STRICT_MODE and allow_defaults and DEFAULT_FILL not in full_query:
             full_query = f"{full_query} {DEFAULT_FILL}"
-            sql = generate_sql(full_query, schema)
+            with timed("generation"):
+                sql = generate_sql(full_query, schema)
             if sql == "INSUFFICIENT_INFORMATION":
                 return {
                     "status": "needs_clarification",
@@ -192,16 +258,22 @@ def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
     # -------------------------------
     # CASE 3: Execute SQL safely
     # -------------------------------
-    # Ensure every query has a LIMIT clause to satisfy production constraints
-    def _ensure_limit(stmt: str, default: int = 100) -> str:
-        import re
-        if not re.search(r"\bLIMIT\b", stmt, flags=re.IGNORECASE):
-            return stmt.rstrip().rstrip(';') + f" LIMIT {default}"
-        return stmt
+    generated_sql = sql
+
+    # Queries without their own LIMIT are paged: give them a deterministic
+    # ORDER BY so /query/next can continue from a keyset token.
+    page_plan = None
+    if not has_top_level_limit(sql):
+        page_plan = plan_pagination(sql, schema, page_size=PAGE_SIZE)
+        if page_plan:
+            sql = page_plan["sql"]
 
-    sql = _ensure_limit(sql, default=100)
+    # Ensure every query has a top-level LIMIT clause to satisfy production constraints.
+    # Token-based, so LIMIT inside literals or subqueries does not count.
+    sql = ensure_limit(sql, default=PAGE_SIZE)
 
-    execution_result = execute_sql(sql)
+    with timed("execution"):
+        execution_result = execute_sql(sql, result_format=result_format, freshness=freshness)
 
     if "error" in execution_result:
         return {
@@ -210,21 +282,47 @@ def run_nl_to_sql(user_query: str, allow_defaults: bool = False):
             "error": execution_result["error"]
         }
 
+    # Validated and executed: log the pair so the template library can learn it
+    if not templated and DEFAULT_FILL not in full_query:
+        record_validated(full_query, generated_sql, schema)
+
     # -------------------------------
     # CASE 4: Explain result
     # -------------------------------
-    # Ensure the returned SQL includes a LIMIT before returning success
-    sql = _ensure_limit(sql, default=100)
+    result_id = None
+    if explain == "none":
+        explanation = None
+    elif explain == "deferred":
+        # Rows go back now; the explanation is fetched later by result_id
+        explanation = None
+        result_id = submit_explanation(full_query, sql, execution_result)
+    else:
+        with timed("explanation"):
+            explanation = explain_result(
+                user_query=full_query,
+                sql=sql,
+                execution_result=execution_result
+            )
+
+    if page_plan:
+        # Later pages read the same backend as the first one
+        page_plan["freshness"] = "fast" if execution_result.get("backend") == "snapshot" else "fresh"
 
-    explanation = explain_result(
-        user_query=full_query,
-        sql=sql,
-        execution_result=execution_result
-    )
+    # Keep the result for follow-up refinement; a page or a result cut by its
+    # LIMIT, the row cap or the cost gate does not hold every row, so the
+    # planner will not refine it
+    page_token = next_token(page_plan, execution_result) if page_plan else None
+    complete = page_token is None and not execution_result.get("truncated")
+    remember_result(session_id, execution_result, sql, full_query, complete)
 
-    return {
+    response = {
         "status": "success",
         "sql": sql,
         "result": execution_result,
-        "explanation": explanation
+        "explanation": explanation,
+        "sql_source": "template" if templated else "model",
+        "next_token": page_token
     }
+    if result_id:
+        response["result_id"] = result_id
+    return response
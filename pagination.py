@@ -0,0 +1,315 @@
+# Keyset pagination with signed continuation tokens
+# The first page is produced by the normal pipeline; later pages are fetched
+# from the token alone (validated SQL + ORDER BY key + last key seen), so
+# paging never touches the LLM stages and DB work stays proportional to the
+# page size. OFFSET is used only when no unique ordering can be established.
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import re
+import secrets
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+from sql_rewriter import join_clauses, split_clauses, split_top_level_commas
+
+PAGE_SIZE = 100                 # Rows per page (matches the pipeline's default LIMIT)
+PAGE_TOKEN_TTL = 3600           # Seconds a continuation token stays valid
+TOKEN_VERSION = 2               # 2: Decimal keys travel as tagged numbers
+
+# Tokens carry SQL, so they are HMAC-signed. Set PAGINATION_SECRET when running
+# several workers so tokens issued by one worker are accepted by the others.
+_SECRET = os.getenv("PAGINATION_SECRET", "").encode("utf-8") or secrets.token_bytes(32)
+
+_AGGREGATE_RE = re.compile(r"\b(SUM|COUNT|AVG|MIN|MAX|GROUP_CONCAT)\s*\(", flags=re.IGNORECASE)
+_IDENT_RE = re.compile(r"^[A-Za-z_]\w*(?:\.[A-Za-z_]\w*)?$")
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+# -------------------------------
+# Ordering analysis
+# -------------------------------
+def _select_items(select_text: str):
+    """Return [(expr, label)] for the select list; label is the result column name."""
+    items = []
+    for i, part in enumerate(split_top_level_commas(select_text)):
+        if i == 0:
+            part = re.sub(r"^DISTINCT\s+", "", part, flags=re.IGNORECASE)
+        m = re.match(r"^(.*\S)\s+AS\s+([A-Za-z_]\w*)$", part, flags=re.IGNORECASE | re.S)
+        if not m:
+            # Alias without AS, e.g. "SUM(o.amount) total"
+            m = re.match(r"^(.*[\w)])\s+([A-Za-z_]\w*)$", part, flags=re.S)
+            if m and m.group(2).upper() in ("END", "DESC", "ASC"):
+                m = None
+        if m:
+            expr, label = m.group(1).strip(), m.group(2)
+        else:
+            expr = part.strip()
+            label = expr.split(".")[-1] if _IDENT_RE.match(expr) else expr
+        items.append((expr, label))
+    return items
+
+
+def _norm(expr: str) -> str:
+    return re.sub(r"\s+", "", expr).lower()
+
+
+def _resolve(item: str, select_items):
+    """Map an ORDER BY / GROUP BY expression to (expr, label), or None."""
+    if item.isdigit():
+        idx = int(item) - 1
+        return select_items[idx] if 0 <= idx < len(select_items) else None
+    for expr, label in select_items:
+        if item == label:
+            return expr, label
+    for expr, label in select_items:
+        if _norm(item) == _norm(expr):
+            return expr, label
+    # Qualified vs. bare reference to the same column (o.amount vs amount)
+    bare = item.split(".")[-1]
+    if _IDENT_RE.match(item):
+        for expr, label in select_items:
+            if _IDENT_RE.match(expr) and expr.split(".")[-1] == bare:
+                return expr, label
+    return None
+
+
+def _order_items(order_text: str):
+    items = []
+    for part in split_top_level_commas(order_text or ""):
+        m = re.match(r"^(.*?)\s+(ASC|DESC)$", part, flags=re.IGNORECASE | re.S)
+        if m:
+            items.append((m.group(1).strip(), m.group(2).upper() == "DESC"))
+        else:
+            items.append((part.strip(), False))
+    return items
+
+
+def _single_table(from_text: str):
+    if re.search(r"\bJOIN\b|,", from_text, flags=re.IGNORECASE):
+        return None
+    m = re.match(r"^([A-Za-z_]\w*)", from_text.strip())
+    return m.group(1) if m else None
+
+
+def plan_pagination(sql: str, schema: dict, page_size: int = PAGE_SIZE):
+    """Work out how to page through `sql`.
+
+    Returns None when the statement should not be paged (explicit LIMIT or a
+    single-row aggregate), otherwise a plan dict whose "sql" is the statement
+    with a deterministic ORDER BY (tie-breakers appended) and no LIMIT.
+    """
+    clauses = split_clauses(sql)
+    if clauses is None:
+        return {"mode": "offset", "sql": sql, "keys": [], "aggregate": False, "page_size": page_size}
+    if "LIMIT" in clauses:
+        return None
+
+    aggregate = "GROUP BY" in clauses or bool(_AGGREGATE_RE.search(clauses["SELECT"]))
+    if aggregate and "GROUP BY" not in clauses:
+        return None
+
+    select_items = _select_items(clauses["SELECT"])
+    order = _order_items(clauses.get("ORDER BY"))
+
+    # Tie-breakers that make the ordering unique
+    if aggregate:
+        tiebreakers = split_top_level_commas(clauses["GROUP BY"])
+    else:
+        table = _single_table(clauses["FROM"])
+        tiebreakers = list(schema.get(table, {}).get("primary_key", [])) if table else []
+
+    ordered_exprs = {_norm(e) for e, _ in order}
+    ordered_labels = set()
+    for expr, _ in order:
+        resolved = _resolve(expr, select_items)
+        if resolved:
+            ordered_labels.add(resolved[1])
+    for tb in tiebreakers:
+        resolved = _resolve(tb, select_items)
+        if _norm(tb) in ordered_exprs or (resolved and resolved[1] in ordered_labels):
+            continue
+        order.append((tb, False))
+
+    if order:
+        clauses["ORDER BY"] = ", ".join(f"{e} DESC" if desc else e for e, desc in order)
+    base_sql = join_clauses(clauses)
+
+    keys = []
+    for expr, desc in order:
+        resolved = _resolve(expr, select_items)
+        if resolved is None:
+            keys = None
+            break
+        keys.append({"expr": resolved[0], "label": resolved[1], "desc": desc})
+
+    mode = "keyset" if tiebreakers and keys else "offset"
+    return {
+        "mode": mode,
+        "sql": base_sql,
+        "keys": keys if mode == "keyset" else [],
+        "aggregate": aggregate,
+        "page_size": page_size,
+    }
+
+
+# -------------------------------
+# Next-page SQL
+# -------------------------------
+def _keyset_predicate(keys, placeholder):
+    """(k1 > ?) OR (k1 = ? AND k2 > ?) ... with DESC keys using <."""
+    terms = []
+    for i, key in enumerate(keys):
+        parts = [f"{k['expr']} = {placeholder}" for k in keys[:i]]
+        op = "<" if key["desc"] else ">"
+        parts.append(f"{key['expr']} {op} {placeholder}")
+        terms.append("(" + " AND ".join(parts) + ")")
+    return "(" + " OR ".join(terms) + ")"
+
+
+def _keyset_params(last):
+    last = [_from_jsonable(v) for v in last]
+    params = []
+    for i in range(len(last)):
+        params.extend(last[:i + 1])
+    return params
+
+
+def build_page_sql(state: dict, placeholder: str = "%s"):
+    """Return (sql, params) for the page described by a decoded token."""
+    page_size = int(state["page_size"])
+    if state["mode"] == "offset" or not state.get("last"):
+        offset = int(state.get("offset", 0))
+        return f"{state['sql']} LIMIT {page_size} OFFSET {offset}", []
+
+    clauses = split_clauses(state["sql"])
+    predicate = _keyset_predicate(state["keys"], placeholder)
+    target = "HAVING" if state.get("aggregate") else "WHERE"
+    if clauses.get(target):
+        clauses[target] = f"({clauses[target]}) AND {predicate}"
+    else:
+        clauses[target] = predicate
+    clauses["LIMIT"] = str(page_size)
+    return join_clauses(clauses), _keyset_params(state["last"])
+
+
+# -------------------------------
+# Tokens
+# -------------------------------
+def _jsonable(value):
+    if isinstance(value, Decimal):
+        # Tagged so it binds back as a number: as text, SQLite would compare an
+        # aggregate (no type affinity) with it as number < string
+        return {"decimal": str(value)}
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def _from_jsonable(value):
+    if isinstance(value, dict) and "decimal" in value:
+        return Decimal(value["decimal"])
+    return value
+
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def encode_token(state: dict) -> str:
+    body = json.dumps(dict(state, v=TOKEN_VERSION, iat=int(time.time())), separators=(",", ":")).encode("utf-8")
+    sig = hmac.new(_SECRET, body, hashlib.sha256).digest()
+    return f"{_b64(body)}.{_b64(sig)}"
+
+
+def decode_token(token: str) -> dict:
+    try:
+        body_b64, sig_b64 = token.split(".", 1)
+        body = _unb64(body_b64)
+        sig = _unb64(sig_b64)
+    except Exception as e:
+        raise InvalidPageToken("Malformed continuation token") from e
+
+    expected = hmac.new(_SECRET, body, hashlib.sha256).digest()
+    if not hmac.compare_digest(sig, expected):
+        raise InvalidPageToken("Continuation token signature mismatch")
+
+    state = json.loads(body)
+    if state.get("v") != TOKEN_VERSION:
+        raise InvalidPageToken("Unsupported continuation token version")
+    if time.time() - state.get("iat", 0) > PAGE_TOKEN_TTL:
+        raise InvalidPageToken("Continuation token expired")
+    return state
+
+
+def next_token(plan_or_state: dict, result: dict, offset: int = 0):
+    """Token for the page after `result`, or None if it was the last page."""
+    from result_encoding import last_row
+
+    row_count = result.get("row_count", len(result.get("data", [])))
+    page_size = int(plan_or_state["page_size"])
+    if row_count < page_size:
+        return None
+
+    state = {
+        "mode": plan_or_state["mode"],
+        "sql": plan_or_state["sql"],
+        "keys": plan_or_state.get("keys", []),
+        "aggregate": plan_or_state.get("aggregate", False),
+        "page_size": page_size,
+        "offset": offset + row_count,
+        "last": None,
+    }
+    if plan_or_state.get("freshness"):
+        state["freshness"] = plan_or_state["freshness"]
+
+    if state["mode"] == "keyset":
+        final = last_row(result)
+        try:
+            last = [_jsonable(final[k["label"]]) for k in state["keys"]]
+        except (KeyError, TypeError):
+            last = None
+        if last is None or any(v is None for v in last):
+            # NULL keys cannot be compared with > / <; continue by offset
+            state["mode"] = "offset"
+        else:
+            state["last"] = last
+
+    return encode_token(state)
+
+
+def fetch_next_page(token: str, executor=None, placeholder: str = "%s", result_format: str = "rows") -> dict:
+    """Execute the page a continuation token points at (no LLM involved)."""
+    if executor is None:
+        from sql_executor import execute_sql as executor
+
+    try:
+        state = decode_token(token)
+    except InvalidPageToken as e:
+        return {"status": "error", "sql": None, "error": str(e)}
+
+    sql, params = build_page_sql(state, placeholder=placeholder)
+    kwargs = {"freshness": state["freshness"]} if state.get("freshness") else {}
+    result = executor(sql, params=params or None, result_format=result_format, **kwargs)
+    if "error" in result:
+        return {"status": "error", "sql": sql, "error": result["error"]}
+
+    return {
+        "status": "success",
+        "sql": sql,
+        "result": result,
+        "next_token": next_token(state, result, offset=int(state.get("offset", 0))),
+    }
@@ -0,0 +1,82 @@
+"""prepare_model.py
+
+One-time conversion of a Hugging Face model into a local safetensors layout
+that load_llm() memory-maps directly: weights are saved in the chosen dtype
+(no conversion at startup) next to the tokenizer files and a prepared.json
+manifest. Point PREPARED_MODEL_DIR at the output (default: prepared_model).
+
+Usage:
+python prepare_model.py --model-id Qwen/Qwen2.5-0.5B-Instruct --dtype float16
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+from llm_loader import MODEL_NAME, PREPARED_MANIFEST, PREPARED_MODEL_DIR
+
+DTYPES = ("auto", "float16", "bfloat16", "float32")
+
+
+def prepare_model(model_id: str = MODEL_NAME, output_dir: str = PREPARED_MODEL_DIR, dtype: str = "auto",
+                  max_shard_size: str = "2GB") -> dict:
+    """Convert `model_id` into `output_dir`, replacing any previous preparation."""
+    try:
+        import torch
+        import transformers
+        from transformers import AutoModelForCausalLM, AutoTokenizer
+    except Exception as e:
+        raise RuntimeError("transformers and torch are required. Install with: pip install transformers torch") from e
+
+    if dtype == "auto":
+        dtype = "float16" if torch.cuda.is_available() else "float32"
+
+    started = time.perf_counter()
+    model = AutoModelForCausalLM.from_pretrained(
+        model_id, dtype=getattr(torch, dtype), low_cpu_mem_usage=True, trust_remote_code=True
+    )
+    tokenizer = AutoTokenizer.from_pretrained(model_id, trust_remote_code=True)
+
+    # Write next to the target and swap in, so a running server never sees a half-written model
+    output_dir = os.path.abspath(output_dir)
+    staging = output_dir + ".tmp"
+    shutil.rmtree(staging, ignore_errors=True)
+    model.save_pretrained(staging, safe_serialization=True, max_shard_size=max_shard_size)
+    tokenizer.save_pretrained(staging)
+
+    manifest = {
+        "source_model": model_id,
+        "dtype": dtype,
+        "format": "safetensors",
+        "prepared_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "transformers_version": transformers.__version__,
+        "torch_version": torch.__version__,
+    }
+    with open(os.path.join(staging, PREPARED_MANIFEST), "w") as f:
+        json.dump(manifest, f, indent=2)
+
+    if os.path.exists(output_dir):
+        previous = output_dir + ".old"
+        shutil.rmtree(previous, ignore_errors=True)
+        os.replace(output_dir, previous)
+        os.replace(staging, output_dir)
+        shutil.rmtree(previous, ignore_errors=True)
+    else:
+        os.replace(staging, output_dir)
+
+    manifest["seconds"] = round(time.perf_counter() - started, 1)
+    return manifest
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a model to a local mmap-friendly safetensors layout")
+    parser.add_argument("--model-id", default=MODEL_NAME, help="Model repo id on HF Hub or a local path")
+    parser.add_argument("--output", default=PREPARED_MODEL_DIR, help="Directory for the prepared model")
+    parser.add_argument("--dtype", choices=DTYPES, default="auto",
+                        help="Weight dtype to bake in (auto: float16 on CUDA, float32 on CPU)")
+    parser.add_argument("--max-shard-size", default="2GB")
+    args = parser.parse_args()
+
+    print(f"Preparing {args.model_id} -> {args.output} ...")
+    print(json.dumps(prepare_model(args.model_id, args.output, args.dtype, args.max_shard_size), indent=2))
@@ -0,0 +1,182 @@
+# Opt-in per-request profiling
+# With PROFILING_ENABLED set, a request carrying the X-Profile header (or a
+# random PROFILE_SAMPLE_RATE share of requests) runs under a sampling
+# profiler: a background thread records the request thread's Python stack
+# every PROFILE_INTERVAL_MS, wall-clock, so waits on the database or the
+# inference server show up next to CPU work. Each profile is written as
+# collapsed stacks (flamegraph.pl / speedscope input) plus a JSON sidecar,
+# and the newest PROFILE_KEEP are kept. With PROFILE_TORCH set, an in-process
+# model.generate also runs under torch.profiler (Chrome trace alongside).
+# When profiling is off, request_profiler() returns a shared no-op context.
+
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import nullcontext
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0").lower() in ("1", "true", "yes")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", 0.0))     # share of requests profiled without the header
+PROFILE_HEADER = "X-Profile"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", 5))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", 50))
+PROFILE_TORCH = os.getenv("PROFILE_TORCH", "0").lower() in ("1", "true", "yes")
+
+_NO_PROFILE = nullcontext()
+_active = threading.local()
+_write_lock = threading.Lock()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RequestProfile:
+    """Samples one thread's stack until the context exits, then writes the profile."""
+
+    def __init__(self, label: str, directory: str = PROFILE_DIR, interval_ms: float = PROFILE_INTERVAL_MS):
+        now = time.time()
+        # Sortable by creation time (list_profiles and pruning rely on it)
+        self.id = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:6]}"
+        self.label = label[:200]
+        self.directory = directory
+        self.interval = interval_ms / 1000
+        self.counts = Counter()
+        self.files = []
+        self._stop = threading.Event()
+
+    def _sample(self, thread_id: int):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self.started = time.time()
+        self._t0 = time.perf_counter()
+        self._sampler = threading.Thread(target=self._sample, args=(threading.get_ident(),),
+                                         name=f"profiler-{self.id}", daemon=True)
+        self._sampler.start()
+        _active.profile = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.profile = None
+        self._stop.set()
+        self._sampler.join()
+        self.duration_ms = round((time.perf_counter() - self._t0) * 1000, 1)
+        self.error = repr(exc) if exc is not None else None
+        try:
+            self._write()
+        except OSError:
+            pass   # profiling must never fail the request
+        return False
+
+    def path(self, suffix: str) -> str:
+        return os.path.join(self.directory, f"{self.id}{suffix}")
+
+    def _write(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(".collapsed"), "w") as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+        self.files.insert(0, f"{self.id}.collapsed")
+        meta = {
+            "id": self.id, "label": self.label, "started": self.started, "duration_ms": self.duration_ms,
+            "samples": sum(self.counts.values()), "interval_ms": self.interval * 1000, "error": self.error,
+            "files": self.files,
+        }
+        with open(self.path(".json"), "w") as f:
+            json.dump(meta, f)
+        _prune(self.directory)
+
+
+def request_profiler(header_value: str = None, label: str = ""):
+    """Context manager for one request: a RequestProfile when asked for or sampled, else a no-op."""
+    if not PROFILING_ENABLED:
+        return _NO_PROFILE
+    if header_value not in (None, "", "0") or (PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE):
+        return RequestProfile(label)
+    return _NO_PROFILE
+
+
+def current_profile():
+    return getattr(_active, "profile", None)
+
+
+def torch_profiler():
+    """Context for model.generate: torch.profiler when the calling request is profiled and PROFILE_TORCH is set."""
+    profile = current_profile()
+    if profile is None or not PROFILE_TORCH:
+        return _NO_PROFILE
+    return _TorchTrace(profile)
+
+
+class _TorchTrace:
+    def __init__(self, profile: RequestProfile):
+        self.profile = profile
+
+    def __enter__(self):
+        import torch
+        from torch.profiler import ProfilerActivity, profile
+
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self._prof = profile(activities=activities, record_shapes=False)
+        self._prof.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._prof.__exit__(exc_type, exc, tb)
+        os.makedirs(self.profile.directory, exist_ok=True)
+        name = f"{self.profile.id}.torch{len(self.profile.files)}.json"
+        self._prof.export_chrome_trace(os.path.join(self.profile.directory, name))
+        self.profile.files.append(name)
+        return False
+
+
+# -------------------------------
+# Stored profiles
+# -------------------------------
+def _prune(directory: str):
+    with _write_lock:
+        metas = sorted(f for f in os.listdir(directory) if f.endswith(".json") and ".torch" not in f)
+        for meta in metas[:max(0, len(metas) - PROFILE_KEEP)]:
+            profile_id = meta[:-len(".json")]
+            for name in os.listdir(directory):
+                if name.startswith(profile_id):
+                    os.remove(os.path.join(directory, name))
+
+
+def list_profiles(directory: str = PROFILE_DIR):
+    """Metadata of stored profiles, newest first."""
+    if not os.path.isdir(directory):
+        return []
+    profiles = []
+    for name in sorted(os.listdir(directory), reverse=True):
+        if name.endswith(".json") and ".torch" not in name:
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    profiles.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    return profiles
+
+
+def profile_file(name: str, directory: str = PROFILE_DIR):
+    """Path of a stored profile file, or None for names that are not listed profile files."""
+    for meta in list_profiles(directory):
+        if name in meta.get("files", []) or name == f"{meta['id']}.json":
+            return os.path.join(directory, name)
+    return None
@@ -0,0 +1,222 @@
+# Token-budget-aware prompt assembly
+# A prompt is a plain dict (JSON-serializable, so it can be sent to the
+# inference server): a stage name, a system prompt and a list of user-message
+# segments. assemble() turns it into input ids without re-running the chat
+# template or re-tokenizing static text: the template around the user message
+# and every static segment (instructions, schema tables, stats) are tokenized
+# once and cached. Dynamic text is cut to a character cap before tokenizing,
+# and segments are dropped or truncated to fit the stage budget in this order:
+#   unneeded tables, examples, context, needed tables; the question goes last.
+
+import os
+import threading
+from collections import OrderedDict
+
+PROMPT_BUDGETS = {   # prompt tokens per stage, excluding generated tokens
+    "clarification": int(os.getenv("PROMPT_BUDGET_CLARIFICATION", 2048)),
+    "sql": int(os.getenv("PROMPT_BUDGET_SQL", 3072)),
+    "sql_retry": int(os.getenv("PROMPT_BUDGET_SQL_RETRY", 3072)),
+    "explanation": int(os.getenv("PROMPT_BUDGET_EXPLANATION", 1536)),
+}
+DEFAULT_BUDGET = 2048
+CHARS_PER_TOKEN_CAP = 8      # dynamic text beyond budget * this many chars is cut before tokenizing
+MIN_SEGMENT_TOKENS = 16      # shorter remainders are dropped rather than truncated
+TOKEN_CACHE_SIZE = 512
+
+# Lower rank survives longer; "instructions" are never cut
+KIND_RANK = {"instructions": -1, "question": 0, "tables": 1, "context": 2, "examples": 3, "other_tables": 4}
+
+_SENTINEL = "@@PROMPT_BODY@@"
+
+_token_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {}
+_stats_lock = threading.Lock()
+
+
+# -------------------------------
+# Building prompts
+# -------------------------------
+def segment(name: str, text: str, kind: str, static: bool = False) -> dict:
+    if kind not in KIND_RANK:
+        raise ValueError(f"Unknown segment kind: {kind!r}")
+    return {"name": name, "text": text, "kind": kind, "static": static}
+
+
+def make_prompt(stage: str, system: str, segments) -> dict:
+    return {"stage": stage, "system": system, "segments": list(segments)}
+
+
+def is_prompt(item) -> bool:
+    return isinstance(item, dict) and "segments" in item
+
+
+def relevant_tables(question: str, schema: dict):
+    """Tables the question mentions (by table or column name) plus their
+    foreign-key neighbours; every table when nothing matches."""
+    words = {w.strip(".,?!'\"()").lower() for w in question.split()}
+    words |= {w[:-1] for w in words if w.endswith("s")}
+
+    matched = set()
+    for table, info in schema.items():
+        names = {table.lower(), table.lower().rstrip("s")} | {c.lower() for c in info.get("columns", {})}
+        if names & words:
+            matched.add(table)
+    if not matched:
+        return list(schema)
+
+    neighbours = set()
+    for table, info in schema.items():
+        for fk in info.get("foreign_keys", []):
+            target = fk.split("→")[-1].strip().split(".")[0]
+            if table in matched:
+                neighbours.add(target)
+            if target in matched:
+                neighbours.add(table)
+    needed = matched | neighbours
+    return [t for t in schema if t in needed]
+
+
+def schema_segments(schema: dict, question: str = None):
+    """One static segment per table; tables the question does not need rank lowest."""
+    import json
+
+    needed = set(relevant_tables(question, schema)) if question else set(schema)
+    return [
+        segment(f"table:{table}", json.dumps({table: info}) + "\n",
+                "tables" if table in needed else "other_tables", static=True)
+        for table, info in schema.items()
+    ]
+
+
+# -------------------------------
+# Assembly
+# -------------------------------
+def _tokenizer_key(tokenizer):
+    return getattr(tokenizer, "name_or_path", None) or id(tokenizer)
+
+
+def _encode(tokenizer, text: str):
+    return tokenizer(text, add_special_tokens=False)["input_ids"]
+
+
+def _cached_encode(tokenizer, text: str, counters: dict):
+    key = (_tokenizer_key(tokenizer), text)
+    with _cache_lock:
+        ids = _token_cache.get(key)
+        if ids is not None:
+            _token_cache.move_to_end(key)
+            counters["cache_hits"] += 1
+            return ids
+    ids = _encode(tokenizer, text)
+    counters["cache_misses"] += 1
+    with _cache_lock:
+        _token_cache[key] = ids
+        while len(_token_cache) > TOKEN_CACHE_SIZE:
+            _token_cache.popitem(last=False)
+    return ids
+
+
+def _template_ids(tokenizer, system: str, counters: dict):
+    """Token ids of the chat template before and after the user message."""
+    key = (_tokenizer_key(tokenizer), "\0template", system)
+    with _cache_lock:
+        cached = _token_cache.get(key)
+    if cached is not None:
+        counters["cache_hits"] += 1
+        return cached
+    text = tokenizer.apply_chat_template(
+        [{"role": "system", "content": system}, {"role": "user", "content": _SENTINEL}],
+        tokenize=False,
+        add_generation_prompt=True,
+    )
+    before, after = text.split(_SENTINEL)
+    ids = (_encode(tokenizer, before), _encode(tokenizer, after))
+    counters["cache_misses"] += 1
+    with _cache_lock:
+        _token_cache[key] = ids
+    return ids
+
+
+def assemble(tokenizer, prompt: dict, budget: int = None):
+    """Input ids for `prompt` within the stage budget, plus a report of what was kept."""
+    stage = prompt.get("stage", "unknown")
+    budget = budget or PROMPT_BUDGETS.get(stage, DEFAULT_BUDGET)
+    counters = {"cache_hits": 0, "cache_misses": 0}
+
+    before, after = _template_ids(tokenizer, prompt["system"], counters)
+    remaining = budget - len(before) - len(after)
+    char_cap = budget * CHARS_PER_TOKEN_CAP
+
+    encoded = []
+    for seg in prompt["segments"]:
+        if seg["static"]:
+            ids = _cached_encode(tokenizer, seg["text"], counters)
+        else:
+            ids = _encode(tokenizer, seg["text"][:char_cap])
+        encoded.append(ids)
+
+    kept = [None] * len(encoded)
+    dropped, truncated = [], []
+    order = sorted(range(len(encoded)), key=lambda i: KIND_RANK[prompt["segments"][i]["kind"]])
+    for i in order:
+        seg, ids = prompt["segments"][i], encoded[i]
+        if len(ids) <= remaining or seg["kind"] == "instructions":
+            kept[i] = ids
+        elif seg["kind"] == "question":
+            # Keep both ends: merged clarifications are appended at the tail
+            head = max(remaining, 0) // 2
+            kept[i] = ids[:head] + ids[len(ids) - (max(remaining, 0) - head):]
+            truncated.append(seg["name"])
+        elif remaining >= MIN_SEGMENT_TOKENS and seg["kind"] in ("context", "examples"):
+            kept[i] = ids[:remaining]
+            truncated.append(seg["name"])
+        else:
+            dropped.append(seg["name"])
+            continue
+        remaining -= len(kept[i])
+
+    input_ids = list(before)
+    for ids in kept:
+        if ids is not None:
+            input_ids.extend(ids)
+    input_ids.extend(after)
+
+    report = {
+        "stage": stage,
+        "budget": budget,
+        "prompt_tokens": len(input_ids),
+        "template_tokens": len(before) + len(after),
+        "segment_tokens": {seg["name"]: len(ids) for seg, ids in zip(prompt["segments"], kept) if ids is not None},
+        "dropped": dropped,
+        "truncated": truncated,
+        **counters,
+    }
+    return input_ids, report
+
+
+# -------------------------------
+# Metrics
+# -------------------------------
+def record(report: dict):
+    with _stats_lock:
+        s = _stats.setdefault(report["stage"], {"prompts": 0, "total_tokens": 0, "max_tokens": 0, "last_tokens": 0,
+                                                "budget": report["budget"], "truncated": 0, "dropped": 0,
+                                                "cache_hits": 0, "cache_misses": 0})
+        s["prompts"] += 1
+        s["total_tokens"] += report["prompt_tokens"]
+        s["max_tokens"] = max(s["max_tokens"], report["prompt_tokens"])
+        s["last_tokens"] = report["prompt_tokens"]
+        s["truncated"] += bool(report["truncated"])
+        s["dropped"] += bool(report["dropped"])
+        s["cache_hits"] += report["cache_hits"]
+        s["cache_misses"] += report["cache_misses"]
+
+
+def prompt_stats() -> dict:
+    """Prompt token counts per stage (as seen by this process)."""
+    with _stats_lock:
+        stats = {stage: dict(s, mean_tokens=round(s["total_tokens"] / s["prompts"], 1)) for stage, s in _stats.items()}
+    with _cache_lock:
+        cached = len(_token_cache)
+    return {"stages": stats, "cached_segments": cached}
@@ -19,13 +19,67 @@ OUTPUT FORMAT:
 - No explanation, no markdown, no comments.
 """
 
-def build_user_prompt(user_query: str, schema_json: dict) -> str:
+def build_user_prompt(user_query: str, schema_json: dict, stats: dict = None) -> str:
+    stats_section = ""
+    if stats:
+        from schema_stats import format_stats_for_prompt
+        summary = format_stats_for_prompt(stats)
+        if summary:
+            stats_section = f"""
+TABLE STATISTICS (row counts, indexed columns, known values - use exact spellings, never invent filters):
+{summary}
+"""
     return f"""
 DATABASE SCHEMA (JSON):
 {schema_json}
-
+{stats_section}
 USER QUESTION:
 {user_query}
 
 Generate a valid MySQL SQL query.
 """
+
+
+def build_sql_prompt(user_query: str, schema_json: dict, stats: dict = None) -> dict:
+    """Segmented form of build_user_prompt for prompt_assembler (per-table schema, budgeted)."""
+    from prompt_assembler import make_prompt, schema_segments, segment
+
+    segments = [segment("schema_header", "\nDATABASE SCHEMA (JSON):\n", "instructions", static=True)]
+    segments += schema_segments(schema_json, user_query)
+    if stats:
+        from schema_stats import format_stats_for_prompt
+        summary = format_stats_for_prompt(stats)
+        if summary:
+            segments.append(segment("stats", (
+                "\nTABLE STATISTICS (row counts, indexed columns, known values - use exact spellings, never invent filters):\n"
+                f"{summary}\n"
+            ), "examples", static=True))
+    segments += [
+        segment("question_header", "\nUSER QUESTION:\n", "instructions", static=True),
+        segment("question", f"{user_query}\n", "question"),
+        segment("footer", "\nGenerate a valid MySQL SQL query.\n", "instructions", static=True),
+    ]
+    return make_prompt("sql", SQL_SYSTEM_PROMPT, segments)
+
+
+def build_sql_retry_prompt(user_query: str, schema_json: dict, error: str, previous_sql: str) -> dict:
+    """Correction prompt after a failed validation: only the tables the question needs, bounded previous attempt."""
+    from prompt_assembler import make_prompt, schema_segments, segment
+
+    segments = [
+        segment("correction", (
+            "The previous SQL failed validation with the following error: "
+            f"{error}.\n"
+        ), "context"),
+        segment("rules", (
+            "Only return a single valid SELECT statement that uses tables and columns from the given schema, "
+            "and avoid any forbidden keywords or non-SELECT operations. Return only the SQL query and nothing else.\n"
+            "Schema:\n"
+        ), "instructions", static=True),
+    ]
+    segments += schema_segments(schema_json, user_query)
+    segments += [
+        segment("question", f"Question: {user_query}\n", "question"),
+        segment("previous_attempt", f"Previous attempt: {previous_sql}\n", "context"),
+    ]
+    return make_prompt("sql_retry", SQL_SYSTEM_PROMPT, segments)
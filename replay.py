@@ -0,0 +1,204 @@
+"""replay.py
+
+Re-drives a traffic capture (see traffic_capture.py) through the pipeline of
+the current build and diffs per-stage latency distributions against the
+recorded ones. Model calls are answered from the captured outputs (taking
+their recorded time unless --no-model-latency), so runs are deterministic and
+differences come from the code around the model: templates, clarification,
+SQL post-processing, execution and explanation assembly.
+
+Requests run in-process, without HTTP or admission control; requests of one
+session run in their original order, sessions run concurrently. Requests that
+were shed (429) when captured are skipped. A pending clarification is shared
+by the whole process (nl_to_sql_pipeline.state), so overlapping sessions can
+interleave differently than they did when captured; --concurrency 1 replays
+strictly in arrival order.
+
+Usage examples:
+
+# Capture on the production side
+TRAFFIC_CAPTURE_PATH=traffic.jsonl uvicorn main:app
+
+# Original inter-arrival timing against a SQLite stand-in
+python replay.py traffic.jsonl --sqlite-path bench.db
+
+# As fast as possible, 32 in flight, results kept for later comparison
+python replay.py traffic.jsonl --speed 0 --concurrency 32 --save replay.json
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+SKIPPED_STATUSES = {"overloaded"}
+
+
+def _percentile(sorted_values, q: float) -> float:
+    if not sorted_values:
+        return None
+    # Nearest rank
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q * len(sorted_values)) - 1))
+    return round(sorted_values[index], 2)
+
+
+def distribution(records, stage: str) -> dict:
+    if stage == "total":
+        values = sorted(r["total_ms"] for r in records if "total_ms" in r)
+    else:
+        values = sorted(r["stages"][stage] for r in records if stage in r.get("stages", {}))
+    return {"n": len(values), "p50": _percentile(values, 0.50), "p90": _percentile(values, 0.90),
+            "p99": _percentile(values, 0.99)}
+
+
+def _delta(before, after) -> str:
+    if before is None or after is None:
+        return "-"
+    if before == 0:
+        return "n/a"
+    return f"{(after - before) / before:+.1%}"
+
+
+# -------------------------------
+# Replay
+# -------------------------------
+class Replayer:
+    def __init__(self, strict: bool, model_latency: bool):
+        self.strict = strict
+        self.model_latency = model_latency
+        self.results = []
+        self._lock = threading.Lock()
+        self._session_locks = {}
+
+    def _session_lock(self, key) -> threading.Lock:
+        with self._lock:
+            return self._session_locks.setdefault(key, threading.Lock())
+
+    def _sink(self, data: dict):
+        with self._lock:
+            self.results.append(data)
+
+    def run(self, index: int, original: dict, session_key):
+        from nl_to_sql_pipeline import run_nl_to_sql
+        from traffic_capture import CaptureRecord, ReplayMiss
+
+        request = {k: original.get(k) for k in ("session_id", "priority", "freshness", "deadline_ms", "result_format",
+                                                "explain")}
+        record = CaptureRecord(original["question"], self._sink, index=index, **request)
+        record.replay = {"llm": [dict(call) for call in original.get("llm", [])], "strict": self.strict,
+                         "latency": self.model_latency}
+        fmt = original.get("result_format") or "rows"
+        # A deferred explanation ran off the request path and was not captured
+        explain = "none" if original.get("explain") in ("deferred", "none") else "inline"
+        with self._session_lock(session_key):
+            with record:
+                try:
+                    response = run_nl_to_sql(original["question"], result_format="rows" if fmt == "rows" else "columnar",
+                                             freshness=original.get("freshness"), session_id=original.get("session_id"),
+                                             explain=explain)
+                    record.set_response(response)
+                except ReplayMiss as e:
+                    record.data["status"] = "replay_miss"
+                    record.data["error"] = str(e)
+                record.data["unused_llm"] = len(record.replay["llm"])
+
+
+def replay(records, speed: float, concurrency: int, strict: bool, model_latency: bool):
+    """Replay `records` (arrival order); returns the replayed records in the same order."""
+    replayer = Replayer(strict, model_latency)
+    first_ts = records[0]["ts"] if records else 0
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, original in enumerate(records):
+            if speed > 0:
+                delay = (original["ts"] - first_ts) / speed - (time.monotonic() - started)
+                if delay > 0:
+                    time.sleep(delay)
+            # Anonymous requests are independent; a session's turns depend on each other
+            session_key = original.get("session_id") or f"#{index}"
+            pool.submit(replayer.run, index, original, session_key)
+    return sorted(replayer.results, key=lambda r: r["index"]), time.monotonic() - started
+
+
+def compare(recorded, replayed) -> dict:
+    stages = sorted({stage for r in recorded + replayed for stage in r.get("stages", {})})
+    report = {"stages": {}}
+    for stage in stages + ["total"]:
+        report["stages"][stage] = {"recorded": distribution(recorded, stage), "replayed": distribution(replayed, stage)}
+    pairs = list(zip(recorded, replayed))
+    report["requests"] = len(pairs)
+    report["status_mismatches"] = [
+        {"question": a["question"], "recorded": a.get("status"), "replayed": b.get("status")}
+        for a, b in pairs if a.get("status") != b.get("status")
+    ]
+    report["sql_mismatches"] = [
+        {"question": a["question"], "recorded": a.get("sql"), "replayed": b.get("sql")}
+        for a, b in pairs if a.get("status") == b.get("status") and a.get("sql") != b.get("sql")
+    ]
+    report["replay_misses"] = sum(1 for r in replayed if r.get("status") == "replay_miss")
+    report["unused_llm_outputs"] = sum(r.get("unused_llm", 0) for r in replayed)
+    report["exceptions"] = [r.get("error") for r in replayed if r.get("status") == "exception"]
+    return report
+
+
+def print_report(report: dict, elapsed: float):
+    print(f"Replayed {report['requests']} requests in {elapsed:.1f}s")
+    print(f"  {'stage':14} {'n':>6}  {'p50 rec/replay':>20}  {'p90 rec/replay':>20}  {'p99 rec/replay':>20}  "
+          f"{'Δp50':>7} {'Δp99':>7}")
+    for stage, dist in report["stages"].items():
+        a, b = dist["recorded"], dist["replayed"]
+        cells = [f"{a[q]}/{b[q]}ms" for q in ("p50", "p90", "p99")]
+        print(f"  {stage:14} {b['n']:>6}  {cells[0]:>20}  {cells[1]:>20}  {cells[2]:>20}  "
+              f"{_delta(a['p50'], b['p50']):>7} {_delta(a['p99'], b['p99']):>7}")
+    print(f"  status mismatches: {len(report['status_mismatches'])}, SQL mismatches: {len(report['sql_mismatches'])}, "
+          f"replay misses: {report['replay_misses']}, unused model outputs: {report['unused_llm_outputs']}, "
+          f"exceptions: {len(report['exceptions'])}")
+    for mismatch in report["status_mismatches"][:5]:
+        print(f"    status {mismatch['recorded']} -> {mismatch['replayed']}: {mismatch['question']}")
+    for mismatch in report["sql_mismatches"][:5]:
+        print(f"    SQL changed: {mismatch['question']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a traffic capture and diff per-stage latency")
+    parser.add_argument("log", help="Capture written with TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Arrival-time multiplier: 1 = original timing, 2 = twice as fast, 0 = as fast as possible")
+    parser.add_argument("--concurrency", type=int, default=16, help="Requests in flight at most")
+    parser.add_argument("--on-miss", choices=["error", "model"], default="error",
+                        help="When the build asks for a model output the capture lacks: fail the request or call the model")
+    parser.add_argument("--no-model-latency", action="store_true",
+                        help="Return recorded model outputs immediately instead of after their recorded time")
+    parser.add_argument("--limit", type=int, default=None, help="Replay the first N requests only")
+    parser.add_argument("--sqlite-path", default=None, help="SQLite stand-in for the read replicas (DB_READ_ENDPOINTS)")
+    parser.add_argument("--save", default=None, help="Write the replayed records and the comparison as JSON")
+    args = parser.parse_args()
+
+    # Before the pipeline is imported: a replay must neither feed the template
+    # query log nor capture itself
+    os.environ["QUERY_LOG_PATH"] = ""
+    os.environ["TRAFFIC_CAPTURE_PATH"] = ""
+    if args.sqlite_path:
+        os.environ["DB_READ_ENDPOINTS"] = f"sqlite:///{os.path.abspath(args.sqlite_path)}"
+    from traffic_capture import load_capture
+
+    records = [r for r in load_capture(args.log) if r.get("status") not in SKIPPED_STATUSES][:args.limit]
+    if not records:
+        sys.exit(f"No replayable requests in {args.log}")
+
+    replayed, elapsed = replay(records, args.speed, args.concurrency, strict=args.on_miss == "error",
+                               model_latency=not args.no_model_latency)
+    report = compare(records, replayed)
+    print_report(report, elapsed)
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"log": args.log, "speed": args.speed, "elapsed_s": round(elapsed, 2), "report": report,
+                       "replayed": replayed}, f, indent=2, default=str)
+        print(f"Saved to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# Read-replica routing for generated (read-only) SQL
+# One pool per read endpoint, least-outstanding-requests balancing,
+# health-based ejection and an optional max replica lag check. Falls back
+# to the primary pool (db.get_connection) when no replica is configured or
+# none is healthy. Schema extraction stays on the primary.
+#
+# Endpoints come from DB_READ_ENDPOINTS, comma separated:
+#   DB_READ_ENDPOINTS="replica-1:3306,replica-2:3306"          (MySQL, credentials from db.py)
+#   DB_READ_ENDPOINTS="sqlite:///r1.db,sqlite:///r2.db"         (SQLite stand-ins for tests/benchmarks)
+
+import os
+import random
+import sqlite3
+import threading
+import time
+
+from db import DB_CONFIG, DB_POOL_SIZE, PoolManager, _mysql_connect, _mysql_ping, get_connection
+
+DB_READ_ENDPOINTS = os.getenv("DB_READ_ENDPOINTS", "")
+REPLICA_EJECT_AFTER = int(os.getenv("REPLICA_EJECT_AFTER", 3))          # consecutive failures before ejection
+REPLICA_EJECT_SECONDS = float(os.getenv("REPLICA_EJECT_SECONDS", 30))   # how long an ejected endpoint sits out
+REPLICA_MAX_LAG = float(os.getenv("REPLICA_MAX_LAG", 0))                # seconds; 0 disables the lag check
+REPLICA_LAG_CHECK_INTERVAL = float(os.getenv("REPLICA_LAG_CHECK_INTERVAL", 5))
+REPLICA_FALLBACK_TO_PRIMARY = os.getenv("REPLICA_FALLBACK_TO_PRIMARY", "1").lower() in ("1", "true", "yes")
+
+
+def _sqlite_connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    return conn
+
+
+def _sqlite_ping(conn):
+    conn.execute("SELECT 1")
+
+
+class Endpoint:
+    """One read endpoint: its pool plus health / lag bookkeeping."""
+
+    def __init__(self, spec: str, pool_size: int = DB_POOL_SIZE):
+        self.spec = spec.strip()
+        if self.spec.startswith("sqlite:///"):
+            path = self.spec[len("sqlite:///"):]
+            self.dialect = "sqlite"
+            self.pool = PoolManager(lambda: _sqlite_connect(path), size=pool_size,
+                                    name=self.spec, ping=_sqlite_ping, dialect="sqlite")
+        else:
+            host, _, port = self.spec.replace("mysql://", "").partition(":")
+            config = dict(DB_CONFIG, host=host, port=int(port or DB_CONFIG["port"]))
+            self.dialect = "mysql"
+            self.pool = PoolManager(lambda: _mysql_connect(config), size=pool_size,
+                                    name=self.spec, ping=_mysql_ping, dialect="mysql")
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.lag = None
+        self.lag_checked_at = 0.0
+
+    def available(self, now: float) -> bool:
+        if self.ejected_until > now:
+            return False
+        if REPLICA_MAX_LAG > 0 and self.lag is not None and self.lag > REPLICA_MAX_LAG:
+            return False
+        return self.outstanding < self.pool.size
+
+    def stats(self):
+        return {
+            "endpoint": self.spec,
+            "dialect": self.dialect,
+            "outstanding": self.outstanding,
+            "consecutive_failures": self.failures,
+            "ejected": self.ejected_until > time.monotonic(),
+            "lag_seconds": self.lag,
+            "pool": self.pool.stats(),
+        }
+
+
+class RoutedConnection:
+    """Pooled connection that reports its outcome back to the router on close()."""
+
+    def __init__(self, router, endpoint, conn):
+        self._router = router
+        self._endpoint = endpoint
+        self._conn = conn
+        self._failed = False
+        self.dialect = endpoint.dialect
+        self.endpoint = endpoint.spec
+
+    def mark_failed(self, error=None):
+        self._failed = True
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            conn.close()
+            self._router._finished(self._endpoint, self._failed)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class ReadRouter:
+    def __init__(self, specs, pool_size: int = DB_POOL_SIZE):
+        self.endpoints = [Endpoint(s, pool_size=pool_size) for s in specs if s.strip()]
+        self._lock = threading.Lock()
+
+    # ---- lag ----
+    def _refresh_lag(self, endpoint, now):
+        if REPLICA_MAX_LAG <= 0 or endpoint.dialect != "mysql":
+            return
+        if now - endpoint.lag_checked_at < REPLICA_LAG_CHECK_INTERVAL:
+            return
+        endpoint.lag_checked_at = now
+        conn = None
+        try:
+            conn = endpoint.pool.get_connection(timeout=0)
+            cursor = conn.cursor(dictionary=True)
+            try:
+                try:
+                    cursor.execute("SHOW REPLICA STATUS")
+                    key = "Seconds_Behind_Source"
+                except Exception:
+                    cursor.execute("SHOW SLAVE STATUS")
+                    key = "Seconds_Behind_Master"
+                row = cursor.fetchone()
+            finally:
+                cursor.close()
+            if row is None:
+                endpoint.lag = 0.0          # not a replica (e.g. a second primary in tests)
+            else:
+                value = row.get(key)
+                # NULL means replication is stopped: treat as infinitely behind
+                endpoint.lag = float(value) if value is not None else float("inf")
+        except Exception:
+            pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+    # ---- selection ----
+    def _pick(self, exclude=()):
+        now = time.monotonic()
+        for endpoint in self.endpoints:
+            self._refresh_lag(endpoint, now)
+        with self._lock:
+            candidates = [e for e in self.endpoints if e.available(now) and e.spec not in exclude]
+            if not candidates:
+                return None
+            least = min(e.outstanding for e in candidates)
+            endpoint = random.choice([e for e in candidates if e.outstanding == least])
+            endpoint.outstanding += 1
+            return endpoint
+
+    def _finished(self, endpoint, failed: bool):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failed:
+                endpoint.failures += 1
+                if endpoint.failures >= REPLICA_EJECT_AFTER:
+                    endpoint.ejected_until = time.monotonic() + REPLICA_EJECT_SECONDS
+                    # After the ejection window the endpoint gets one trial request
+                    endpoint.failures = REPLICA_EJECT_AFTER - 1
+            else:
+                endpoint.failures = 0
+
+    def get_connection(self):
+        """Connection to the least busy healthy replica (or the primary as fallback)."""
+        tried = set()
+        while True:
+            endpoint = self._pick(exclude=tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint.spec)
+            try:
+                conn = endpoint.pool.get_connection()
+            except Exception:
+                self._finished(endpoint, failed=True)
+                continue
+            return RoutedConnection(self, endpoint, conn)
+
+        if not REPLICA_FALLBACK_TO_PRIMARY:
+            raise RuntimeError("No healthy read replica available")
+        return get_connection()
+
+    def stats(self):
+        return [e.stats() for e in self.endpoints]
+
+
+# ---- Default router (created lazily) ----
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    global _router
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = ReadRouter(DB_READ_ENDPOINTS.split(",")) if DB_READ_ENDPOINTS.strip() else None
+    return _router
+
+
+def get_read_connection():
+    """Connection for read-only generated SQL: a replica if configured, else the primary."""
+    router = get_router()
+    if router is None:
+        return get_connection()
+    return router.get_connection()
+
+
+def replica_stats():
+    router = get_router()
+    return router.stats() if router is not None else []
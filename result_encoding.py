@@ -0,0 +1,207 @@
+# Compact result encodings for the query API
+# - rows:     [{col: value, ...}, ...]  (original shape)
+# - columnar: column names/types once, values as one array per column
+# - arrow:    Arrow IPC stream (optional, needs pyarrow)
+# JSON is produced by orjson when installed, else by json.dumps with a
+# per-column converter instead of FastAPI's per-value jsonable_encoder.
+
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+try:
+    import orjson
+    _HAS_ORJSON = True
+except Exception:
+    orjson = None
+    _HAS_ORJSON = False
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    _HAS_PYARROW = True
+except Exception:
+    pyarrow = None
+    _HAS_PYARROW = False
+
+JSON_MEDIA_TYPE = "application/json"
+COLUMNAR_MEDIA_TYPE = "application/vnd.nlsql.columnar+json"
+ARROW_MEDIA_TYPE = "application/vnd.apache.arrow.stream"
+
+DECIMAL_TYPES = {"DECIMAL", "NEWDECIMAL"}
+TEMPORAL_TYPES = {"DATE", "DATETIME", "TIMESTAMP", "NEWDATE", "DATETIME2", "TIMESTAMP2"}
+
+
+# -------------------------------
+# Building columnar results
+# -------------------------------
+def type_name(type_code) -> str:
+    """Readable MySQL type name for a cursor.description type code."""
+    if type_code is None:
+        return None
+    try:
+        from mysql.connector import FieldType
+        return FieldType.get_info(type_code)
+    except Exception:
+        return str(type_code)
+
+
+def columnar_from_cursor(cursor, rows) -> dict:
+    """Build a columnar result straight from a tuple cursor's rows."""
+    description = cursor.description or []
+    names = [d[0] for d in description]
+    types = [type_name(d[1]) for d in description]
+    if rows:
+        data = [list(col) for col in zip(*rows)]
+    else:
+        data = [[] for _ in names]
+    return {
+        "format": "columnar",
+        "row_count": len(rows),
+        "columns": names,
+        "types": types,
+        "data": data,
+    }
+
+
+def is_columnar(result: dict) -> bool:
+    return isinstance(result, dict) and result.get("format") == "columnar"
+
+
+def rows_view(result: dict, limit: int = None):
+    """Row dicts for either result shape (the first `limit` rows if given)."""
+    if not is_columnar(result):
+        rows = result.get("data", [])
+        return rows[:limit] if limit is not None else rows
+    names = result["columns"]
+    n = result["row_count"] if limit is None else min(limit, result["row_count"])
+    return [{name: col[i] for name, col in zip(names, result["data"])} for i in range(n)]
+
+
+def last_row(result: dict):
+    if is_columnar(result):
+        if not result["row_count"]:
+            return None
+        return {name: col[-1] for name, col in zip(result["columns"], result["data"])}
+    rows = result.get("data", [])
+    return rows[-1] if rows else None
+
+
+def to_columnar(result: dict) -> dict:
+    """Convert a row-dict result into the columnar shape."""
+    if is_columnar(result) or "data" not in result:
+        return result
+    rows = result["data"]
+    names = list(rows[0].keys()) if rows else []
+    out = {k: v for k, v in result.items() if k != "data"}
+    out.update({
+        "format": "columnar",
+        "row_count": len(rows),
+        "columns": names,
+        "types": [None] * len(names),
+        "data": [[row[name] for row in rows] for name in names],
+    })
+    return out
+
+
+# -------------------------------
+# JSON
+# -------------------------------
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return str(value)
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, set):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _convert_column(values, type_hint=None):
+    """Convert a whole column to JSON-native values in one pass."""
+    if type_hint is None:
+        sample = next((v for v in values if v is not None), None)
+        if isinstance(sample, Decimal):
+            type_hint = "DECIMAL"
+        elif isinstance(sample, (date, datetime)):
+            type_hint = "DATE"
+        else:
+            return values
+    if type_hint in DECIMAL_TYPES:
+        return [None if v is None else float(v) for v in values]
+    if type_hint in TEMPORAL_TYPES:
+        return [None if v is None else v.isoformat() for v in values]
+    return values
+
+
+def columnar_json_ready(result: dict) -> dict:
+    """Columnar result with every column converted to JSON-native values."""
+    out = dict(result)
+    types = result.get("types") or [None] * len(result["data"])
+    out["data"] = [_convert_column(col, t) for col, t in zip(result["data"], types)]
+    return out
+
+
+def dumps(payload) -> bytes:
+    """Fast JSON encoding (orjson when available)."""
+    if _HAS_ORJSON:
+        return orjson.dumps(payload, default=_json_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(payload, default=_json_default, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+# -------------------------------
+# Arrow
+# -------------------------------
+def to_arrow_ipc(payload: dict) -> bytes:
+    """Arrow IPC stream of the result table; other response fields go in schema metadata."""
+    if not _HAS_PYARROW:
+        raise RuntimeError("pyarrow is required for Arrow responses. Install with: pip install pyarrow")
+
+    result = payload.get("result") or {}
+    result = to_columnar(result) if result else {"columns": [], "data": [], "types": []}
+    arrays = [pyarrow.array(col) for col in result["data"]]
+    metadata = {
+        k: (v if isinstance(v, str) else json.dumps(v, default=_json_default))
+        for k, v in payload.items() if k != "result" and v is not None
+    }
+    table = pyarrow.Table.from_arrays(arrays, names=list(result["columns"]), metadata=metadata)
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+# -------------------------------
+# Content negotiation
+# -------------------------------
+def negotiate(accept: str) -> str:
+    """Pick "arrow", "columnar" or "rows" from an Accept header."""
+    accept = (accept or "").lower()
+    if ARROW_MEDIA_TYPE in accept and _HAS_PYARROW:
+        return "arrow"
+    if COLUMNAR_MEDIA_TYPE in accept or ARROW_MEDIA_TYPE in accept:
+        return "columnar"
+    return "rows"
+
+
+def encode_payload(payload: dict, fmt: str):
+    """Return (body_bytes, media_type) for a pipeline response."""
+    if fmt == "arrow":
+        return to_arrow_ipc(payload), ARROW_MEDIA_TYPE
+
+    result = payload.get("result")
+    if fmt == "columnar" and result:
+        payload = dict(payload, result=columnar_json_ready(to_columnar(result)))
+        return dumps(payload), COLUMNAR_MEDIA_TYPE
+
+    if result and is_columnar(result):
+        # Caller asked for rows but the pipeline produced columns
+        rows_result = {k: v for k, v in result.items() if k not in ("format", "columns", "types")}
+        rows_result["data"] = rows_view(result)
+        payload = dict(payload, result=rows_result)
+    return dumps(payload), JSON_MEDIA_TYPE
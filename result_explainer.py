@@ -1,52 +1,22 @@
 # Natural language explanation generator using Qwen2.5-32B
 # This does NOT touch the database
 
-import torch
-from llm_loader import load_llm
-from explaination_prompt import (
-    EXPLANATION_SYSTEM_PROMPT,
-    build_explanation_prompt
-)
-
-tokenizer, model = load_llm()
+from inference import generate_prompt
+from explaination_prompt import build_explanation_segments
+from deadlines import skip_stage, token_budget
 
 def explain_result(user_query: str, sql: str, execution_result: dict) -> str:
     """
     Generates a grounded natural-language explanation
     for the executed SQL and its result.
+    Returns None when the request deadline leaves no time for it (SQL + rows only).
     """
+    max_new_tokens = token_budget("explanation", 200)
+    if not max_new_tokens:
+        skip_stage("explanation")
+        return None
 
-    messages = [
-        {"role": "system", "content": EXPLANATION_SYSTEM_PROMPT},
-        {
-            "role": "user",
-            "content": build_explanation_prompt(
-                user_query=user_query,
-                sql=sql,
-                result=execution_result
-            )
-        }
-    ]
-
-    input_text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True
-    )
-
-    inputs = tokenizer(input_text, return_tensors="pt").to(model.device)
-
-    with torch.no_grad():
-        output = model.generate(
-            **inputs,
-            max_new_tokens=200,
-            temperature=0.2,
-            top_p=0.9
-        )
-
-    explanation = tokenizer.decode(
-        output[0][inputs["input_ids"].shape[-1]:],
-        skip_special_tokens=True
-    ).strip()
+    prompt = build_explanation_segments(user_query=user_query, sql=sql, result=execution_result)
 
-    return explanation
+    # Shared model: local instance preloaded by startup.py, or the inference server
+    return generate_prompt(prompt, max_new_tokens=max_new_tokens, temperature=0.2, top_p=0.9)
@@ -0,0 +1,489 @@
+# Per-session result frames and follow-up refinement
+# The pipeline keeps the last complete result of each session as a columnar
+# frame. Follow-ups that only filter, sort, take the top N or re-aggregate
+# that result ("now only Mumbai", "sort that by order count", "top 3",
+# "total per city") are answered from the frame, column at a time, without
+# the model or the database. Only questions shaped as follow-ups qualify:
+# no metric or time window of their own, and either no lead-in or one that
+# points back ("now", "that", ...). Anything the planner cannot map entirely
+# onto the frame's columns and values returns None and takes the normal path,
+# as do frames that were cut by LIMIT, paging, the row cap or the cost gate
+# (the executor marks those results "truncated": they do not hold every row).
+# Frames are kept per session_id only; requests without one never share them.
+
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+from decimal import Decimal
+from operator import itemgetter
+
+from result_encoding import rows_view, to_columnar
+
+FRAME_SESSIONS_MAX = int(os.getenv("FRAME_SESSIONS_MAX", 256))
+FRAME_TTL_SECONDS = float(os.getenv("FRAME_TTL_SECONDS", 1800))
+
+# Words that carry no refinement meaning around the clauses
+FILLER_WORDS = {
+    "now", "ok", "okay", "and", "then", "also", "please", "show", "me", "give", "list", "just", "only",
+    "that", "it", "them", "this", "these", "those", "the", "results", "result", "rows", "ones", "of",
+    "for", "in", "from", "at", "to", "same", "but", "instead", "again", "a", "is", "are", "equal", "equals",
+}
+# Lead-in words that make a question refer back to the previous result
+FOLLOW_UP_WORDS = {
+    "now", "then", "also", "instead", "again", "just", "only", "that", "it", "them", "this", "these", "those",
+    "same", "ok", "okay", "but",
+}
+# Words of a re-aggregation clause that do not name a metric ("total per city")
+_GROUP_WORDS = {"total", "sum", "summed", "group", "grouped", "aggregate", "aggregated"}
+# A time window makes a question self-contained ("... in the last 6 months")
+_WINDOW = re.compile(
+    r"\b(?:last|past|previous|next)\s+(?:\d+\s+)?(?:day|week|month|quarter|year)s?\b"
+    r"|\b(?:since|between|during|today|yesterday|ytd|mtd)\b|\b(?:19|20)\d\d\b"
+)
+# Measures that cannot be summed when re-aggregating
+NON_ADDITIVE = ("avg", "average", "mean", "rate", "ratio", "pct", "percent", "share", "median")
+
+_CLAUSE_START = re.compile(
+    r"\b(?:only|just|exclude|excluding|without|except|where|with"
+    r"|(?:sort|sorted|order|ordered|rank|ranked)\s+(?:\w+\s+)?by"
+    r"|(?:group|grouped|aggregate|aggregated)\s+(?:\w+\s+)?by"
+    r"|(?:total|totals|sum|summed)\s+(?:\w+\s+)?(?:by|per)|per"
+    r"|(?:top|bottom|first|last|highest|lowest)\s+\d+)\b"
+)
+_COMPARISON = re.compile(
+    r"^(?P<col>.+?)\s*(?P<op>>=|<=|>|<|=|above|over|greater than|more than|at least|below|under|less than|at most)"
+    r"\s*(?P<num>-?[\d,]*\.?\d+)$"
+)
+_OPS = {
+    ">": "gt", "above": "gt", "over": "gt", "greater than": "gt", "more than": "gt",
+    ">=": "ge", "at least": "ge", "<": "lt", "below": "lt", "under": "lt", "less than": "lt",
+    "<=": "le", "at most": "le", "=": "eq",
+}
+_DESCENDING = {"desc", "descending", "highest", "largest", "biggest", "most"}
+_ASCENDING = {"asc", "ascending", "lowest", "smallest", "least", "fewest"}
+
+_stats = {"stored": 0, "refined": 0, "fallbacks": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(key: str):
+    with _stats_lock:
+        _stats[key] += 1
+
+
+# -------------------------------
+# Frames
+# -------------------------------
+class Frame:
+    """A columnar result plus where it came from."""
+
+    def __init__(self, columns, data, sql: str, question: str, complete: bool):
+        self.columns = list(columns)
+        self.data = [list(col) for col in data]
+        self.sql = sql
+        self.question = question
+        self.complete = complete
+
+    @classmethod
+    def from_result(cls, result: dict, sql: str, question: str, complete: bool):
+        columnar = to_columnar(result)
+        return cls(columnar.get("columns", []), columnar.get("data", []), sql, question, complete)
+
+    @property
+    def row_count(self) -> int:
+        return len(self.data[0]) if self.data else 0
+
+    def column(self, name: str):
+        return self.data[self.columns.index(name)]
+
+    def take(self, index):
+        """New frame with the rows at `index`, in that order."""
+        index = list(index)
+        if not index:
+            data = [[] for _ in self.columns]
+        elif len(index) == 1:
+            data = [[col[index[0]]] for col in self.data]
+        else:
+            pick = itemgetter(*index)
+            data = [list(pick(col)) for col in self.data]
+        return Frame(self.columns, data, self.sql, self.question, self.complete)
+
+    def to_result(self, result_format: str = "rows") -> dict:
+        columnar = {"format": "columnar", "row_count": self.row_count, "columns": list(self.columns),
+                    "types": [None] * len(self.columns), "data": self.data}
+        if result_format == "columnar":
+            return columnar
+        return {"row_count": self.row_count, "data": rows_view(columnar)}
+
+
+class FrameStore:
+    """Last frame per session; least recently used sessions and expired frames are evicted."""
+
+    def __init__(self, max_sessions: int = FRAME_SESSIONS_MAX, ttl: float = FRAME_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._frames = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, session_id: str, frame: Frame):
+        with self._lock:
+            self._frames.pop(session_id, None)
+            self._frames[session_id] = (time.monotonic(), frame)
+            while len(self._frames) > self.max_sessions:
+                self._frames.popitem(last=False)
+
+    def get(self, session_id: str):
+        with self._lock:
+            entry = self._frames.get(session_id)
+            if entry is None:
+                return None
+            if time.monotonic() - entry[0] > self.ttl:
+                del self._frames[session_id]
+                return None
+            self._frames.move_to_end(session_id)
+            return entry[1]
+
+    def drop(self, session_id: str):
+        with self._lock:
+            self._frames.pop(session_id, None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._frames)
+
+
+_store = FrameStore()
+
+
+def get_frame_store() -> FrameStore:
+    return _store
+
+
+def remember_result(session_id: str, result: dict, sql: str, question: str, complete: bool):
+    if session_id is None:
+        return
+    _store.put(session_id, Frame.from_result(result, sql, question, complete))
+    _count("stored")
+
+
+def frame_stats() -> dict:
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["sessions"] = len(_store)
+    return stats
+
+
+# -------------------------------
+# Column typing and matching
+# -------------------------------
+def _is_number(values) -> bool:
+    present = [v for v in values if v is not None]
+    return bool(present) and all(isinstance(v, (int, float, Decimal)) and not isinstance(v, bool) for v in present)
+
+
+def _is_identifier(name: str) -> bool:
+    return name.lower() == "id" or name.lower().endswith("_id")
+
+
+def _measures(frame: Frame):
+    return [c for c, col in zip(frame.columns, frame.data) if _is_number(col) and not _is_identifier(c)]
+
+
+def _labels(frame: Frame):
+    return [c for c in frame.columns if c not in _measures(frame)]
+
+
+def _stem(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def _words(text: str):
+    return [_stem(w) for w in re.findall(r"[a-z0-9]+", text.lower())]
+
+
+def _match_column(text: str, columns):
+    """Column whose name words overlap `text` the most (by word-set similarity), or None."""
+    words = set(_words(text)) - FILLER_WORDS
+    if not words:
+        return None
+    best, best_score = None, 0.0
+    for name in columns:
+        name_words = set(_words(name.replace("_", " ")))
+        score = len(words & name_words) / len(name_words | words)
+        if score > best_score:
+            best, best_score = name, score
+    return best if best_score >= 0.3 else None
+
+
+def _column_words(frame: Frame):
+    return {w for c in frame.columns for w in _words(c.replace("_", " "))}
+
+
+def _value_text(value) -> str:
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    return str(value).lower()
+
+
+def _match_values(text: str, frame: Frame):
+    """(column, values) for label values named in `text`; None unless every word is accounted for."""
+    best = None
+    for name in _labels(frame):
+        found, rest = set(), text
+        for value in set(frame.column(name)):
+            if value is None:
+                continue
+            pattern = rf"(?<![\w.-]){re.escape(_value_text(value))}(?![\w.-])"
+            if re.search(pattern, rest):
+                found.add(value)
+                rest = re.sub(pattern, " ", rest)
+        if found and (best is None or len(found) > len(best[1])):
+            best = (name, found, rest)
+    if best is None:
+        return None
+    name, found, rest = best
+    leftover = set(_words(rest)) - FILLER_WORDS - _column_words(frame) - {"or", "nor", "not"}
+    return None if leftover else (name, found)
+
+
+def _parse_number(text: str) -> float:
+    return float(text.replace(",", ""))
+
+
+# -------------------------------
+# Planning
+# -------------------------------
+def _split_clauses(query: str):
+    """Leading text and the clauses that follow it, lower-cased, separators stripped."""
+    text = re.sub(r"[?!;]+|\.(?!\d)", " ", query.lower()).strip()
+    starts = [m.start() for m in _CLAUSE_START.finditer(text)]
+    if not starts:
+        return text, []
+    bounds = starts + [len(text)]
+    clauses = [text[a:b].strip(" ,") for a, b in zip(bounds, bounds[1:])]
+    clauses = [re.sub(r"(?:\s+(?:and|then))+$", "", c).strip(" ,") for c in clauses]
+    return text[:starts[0]], clauses
+
+
+def _plan_filter(body: str, frame: Frame, negate: bool = False):
+    comparison = _COMPARISON.match(body)
+    if comparison and not negate:
+        col = _match_column(comparison.group("col"), _measures(frame))
+        if col is None:
+            return None
+        return {"op": "compare", "column": col, "cmp": _OPS[comparison.group("op")],
+                "value": _parse_number(comparison.group("num"))}
+    matched = _match_values(body, frame)
+    if matched is None:
+        return None
+    col, values = matched
+    return {"op": "exclude" if negate else "filter", "column": col, "values": values}
+
+
+def _plan_sort(body: str, frame: Frame):
+    words = set(_words(body))
+    col = _match_column(" ".join(words - _ASCENDING - _DESCENDING - {"first"}), frame.columns)
+    if col is None:
+        return None
+    if words & _ASCENDING:
+        descending = False
+    elif words & _DESCENDING:
+        descending = True
+    else:
+        descending = col in _measures(frame)
+    return {"op": "sort", "column": col, "descending": descending}
+
+
+def _plan_top(which: str, n: int, body: str, frame: Frame, sort_col):
+    if which in ("first", "last") and not body:
+        return {"op": "head" if which == "first" else "tail", "n": n}
+    measures = _measures(frame)
+    noun, by = (re.split(r"\bby\b", body, 1) + [""])[:2]
+    # "top 3 cities by revenue": the noun must name one of the frame's columns
+    if set(_words(noun)) - FILLER_WORDS - _column_words(frame):
+        return None
+    named = _match_column(noun, _labels(frame)) if noun.strip() else None
+    if named and len(set(frame.column(named))) < frame.row_count:
+        return None   # several rows per city: "top 3 cities" needs re-aggregation first
+    col = _match_column(by, measures) if by.strip() else None
+    if by.strip() and col is None:
+        return None
+    col = col or sort_col or (measures[0] if measures else None)
+    if col is None:
+        return None
+    return {"op": "top", "column": col, "n": n, "descending": which not in ("bottom", "lowest")}
+
+
+def _plan_group(clause: str, frame: Frame):
+    head, body = (re.split(r"\b(?:by|per)\b", clause, 1) + [""])[:2]
+    if set(_words(head)) - FILLER_WORDS - _GROUP_WORDS:
+        return None   # "total revenue per city" names its own metric: a new question
+    col = _match_column(body, _labels(frame))
+    if col is None:
+        return None
+    aggregates = {}
+    for name in _measures(frame):
+        lowered = name.lower()
+        if any(tag in lowered for tag in NON_ADDITIVE):
+            return None
+        aggregates[name] = "min" if lowered.startswith("min") else "max" if lowered.startswith("max") else "sum"
+    return {"op": "group", "column": col, "aggregates": aggregates}
+
+
+def plan_refinement(query: str, frame: Frame):
+    """Operations answering `query` from `frame`, or None when it needs the normal path."""
+    if frame is None or not frame.complete or not frame.row_count:
+        return None
+    if _WINDOW.search(query.lower()):
+        return None
+    lead, clauses = _split_clauses(query)
+    lead_words = set(_words(lead))
+    if not clauses or lead_words - FILLER_WORDS:
+        return None
+    if lead_words and not set(re.findall(r"[a-z]+", lead)) & FOLLOW_UP_WORDS:
+        return None   # "show total ... per city" reads as a question of its own
+
+    plan, sort_col = [], None
+    for clause in clauses:
+        head, _, rest = clause.partition(" ")
+        top = re.match(r"(top|bottom|first|last|highest|lowest)\s+(\d+)\s*(.*)$", clause)
+        if top:
+            step = _plan_top(top.group(1), int(top.group(2)), top.group(3), frame, sort_col)
+        elif re.match(r"(sort|sorted|order|ordered|rank|ranked)\b", clause):
+            step = _plan_sort(clause.split(" by ", 1)[1], frame)
+        elif re.match(r"(group|grouped|aggregate|aggregated|total|totals|sum|summed|per)\b", clause):
+            step = _plan_group(clause, frame)
+        elif head in ("exclude", "excluding", "without", "except"):
+            step = _plan_filter(rest, frame, negate=True)
+        else:
+            body = " ".join(w for w in rest.split() if w not in ("the", "for", "in", "from", "at", "rows", "ones", "those"))
+            if not body:
+                continue   # "only the top 5": the modifier belongs to the next clause
+            step = _plan_filter(body, frame)
+        if step is None:
+            return None
+        if step["op"] in ("sort", "top"):
+            sort_col = step["column"]
+        elif step["op"] == "group":
+            # Later clauses refer to the re-aggregated columns
+            frame = _group(frame, step["column"], step["aggregates"])
+        plan.append(step)
+    return plan or None
+
+
+# -------------------------------
+# Execution
+# -------------------------------
+def _sort_index(values, descending: bool):
+    # None sorts last in both directions
+    if descending:
+        return sorted(range(len(values)), key=lambda i: (values[i] is not None, values[i]), reverse=True)
+    return sorted(range(len(values)), key=lambda i: (values[i] is None, values[i]))
+
+
+def _compare(cmp: str, bound: float):
+    return {
+        "gt": lambda v: v > bound, "ge": lambda v: v >= bound, "lt": lambda v: v < bound,
+        "le": lambda v: v <= bound, "eq": lambda v: v == bound,
+    }[cmp]
+
+
+def _group(frame: Frame, column: str, aggregates: dict) -> Frame:
+    keys = frame.column(column)
+    groups = OrderedDict()
+    for i, key in enumerate(keys):
+        groups.setdefault(key, []).append(i)
+    columns, data = [column], [list(groups)]
+    for name, how in aggregates.items():
+        values = frame.column(name)
+        reduce = {"sum": sum, "min": min, "max": max}[how]
+        out = []
+        for index in groups.values():
+            present = [values[i] for i in index if values[i] is not None]
+            out.append(reduce(present) if present else None)
+        columns.append(name)
+        data.append(out)
+    columns.append("row_count")
+    data.append([len(index) for index in groups.values()])
+    return Frame(columns, data, frame.sql, frame.question, frame.complete)
+
+
+def apply_plan(frame: Frame, plan) -> Frame:
+    for step in plan:
+        op = step["op"]
+        if op in ("filter", "exclude"):
+            values = frame.column(step["column"])
+            keep = op == "filter"
+            frame = frame.take(i for i, v in enumerate(values) if (v in step["values"]) == keep)
+        elif op == "compare":
+            test = _compare(step["cmp"], step["value"])
+            values = frame.column(step["column"])
+            frame = frame.take(i for i, v in enumerate(values) if v is not None and test(float(v)))
+        elif op == "sort":
+            frame = frame.take(_sort_index(frame.column(step["column"]), step["descending"]))
+        elif op == "top":
+            frame = frame.take(_sort_index(frame.column(step["column"]), step["descending"])[:step["n"]])
+        elif op == "head":
+            frame = frame.take(range(min(step["n"], frame.row_count)))
+        elif op == "tail":
+            frame = frame.take(range(max(frame.row_count - step["n"], 0), frame.row_count))
+        elif op == "group":
+            frame = _group(frame, step["column"], step["aggregates"])
+    return frame
+
+
+def describe_step(step: dict) -> str:
+    op = step["op"]
+    if op in ("filter", "exclude"):
+        values = ", ".join(sorted(_value_text(v) for v in step["values"]))
+        return f"{'kept' if op == 'filter' else 'excluded'} {step['column']} in ({values})"
+    if op == "compare":
+        return f"kept {step['column']} {step['cmp']} {step['value']:g}"
+    if op == "sort":
+        return f"sorted by {step['column']} {'descending' if step['descending'] else 'ascending'}"
+    if op == "top":
+        return f"{'top' if step['descending'] else 'bottom'} {step['n']} by {step['column']}"
+    if op in ("head", "tail"):
+        return f"{'first' if op == 'head' else 'last'} {step['n']} rows"
+    return f"re-aggregated per {step['column']}"
+
+
+def can_refine(session_id: str, query: str) -> bool:
+    return session_id is not None and plan_refinement(query, _store.get(session_id)) is not None
+
+
+def refine(session_id: str, query: str, result_format: str = "rows"):
+    """Pipeline response for a follow-up answered from the session's frame, or None."""
+    if session_id is None:
+        return None
+    frame = _store.get(session_id)
+    if frame is None:
+        return None
+    plan = plan_refinement(query, frame)
+    if plan is None:
+        _count("fallbacks")
+        return None
+
+    refined = apply_plan(frame, plan)
+    _store.put(session_id, refined)
+    _count("refined")
+    steps = [describe_step(step) for step in plan]
+    result = refined.to_result(result_format)
+    result["backend"] = "frame"
+    return {
+        "status": "success",
+        "sql": frame.sql,
+        "result": result,
+        "explanation": (f"Refined the previous result ({'; '.join(steps)}) without re-running the query: "
+                        f"{refined.row_count} of {frame.row_count} rows."),
+        "sql_source": "frame",
+        "refinement": steps,
+        "next_token": None,
+    }
@@ -0,0 +1,191 @@
+# Result summarization for the explainer
+# Turns a query result into typed column arrays and per-column statistics
+# (count, nulls, min/max, sum, mean, top-k, share of total), so the
+# explanation rests on every returned row instead of the first five, and the
+# prompt carries a few compact lines instead of reprs of Decimal/date values.
+# Numeric columns are reduced with numpy when installed, otherwise with
+# builtins over the whole column.
+
+import heapq
+import os
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from result_encoding import rows_view, to_columnar
+
+try:
+    import numpy
+    _HAS_NUMPY = True
+except Exception:
+    numpy = None
+    _HAS_NUMPY = False
+
+SUMMARY_TOP_K = int(os.getenv("SUMMARY_TOP_K", 3))
+SUMMARY_MAX_COLUMNS = int(os.getenv("SUMMARY_MAX_COLUMNS", 12))   # wider results keep their first columns
+SUMMARY_MAX_LABEL_CHARS = 40
+
+_NUMERIC = (int, float, Decimal)
+_TEMPORAL = (date, datetime, time, timedelta)
+
+
+# -------------------------------
+# Column typing
+# -------------------------------
+def _is_identifier(name: str) -> bool:
+    name = name.lower()
+    return name == "id" or name.endswith("_id")
+
+
+def column_kind(name: str, values) -> str:
+    """'number', 'temporal', 'label' (ids and text) or 'empty', from the non-null values."""
+    sample = next((v for v in values if v is not None), None)
+    if sample is None:
+        return "empty"
+    if isinstance(sample, bool) or _is_identifier(name):
+        return "label"
+    if isinstance(sample, _NUMERIC) and all(isinstance(v, _NUMERIC) for v in values if v is not None):
+        return "number"
+    if isinstance(sample, _TEMPORAL):
+        return "temporal"
+    return "label"
+
+
+# -------------------------------
+# Per-kind statistics
+# -------------------------------
+def _number_stats(values, k: int) -> dict:
+    if _HAS_NUMPY:
+        # None becomes NaN with dtype=float; Decimals convert through float()
+        arr = numpy.array(values, dtype=float)
+        present = ~numpy.isnan(arr)
+        count = int(present.sum())
+        if not count:
+            return {"count": 0, "nulls": len(values)}
+        kept = arr[present]
+        stats = {"count": count, "nulls": len(values) - count, "min": float(kept.min()), "max": float(kept.max()),
+                 "sum": float(kept.sum()), "mean": float(kept.mean())}
+        top = numpy.argsort(numpy.where(present, -arr, numpy.inf), kind="stable")[:min(k, count)]
+        stats["top_rows"] = [int(i) for i in top]
+        return stats
+
+    floats = [None if v is None else float(v) for v in values]
+    kept = [v for v in floats if v is not None]
+    if not kept:
+        return {"count": 0, "nulls": len(values)}
+    total = sum(kept)
+    stats = {"count": len(kept), "nulls": len(values) - len(kept), "min": min(kept), "max": max(kept),
+             "sum": total, "mean": total / len(kept)}
+    stats["top_rows"] = heapq.nlargest(k, (i for i, v in enumerate(floats) if v is not None), key=floats.__getitem__)
+    return stats
+
+
+def _label_stats(values, k: int) -> dict:
+    present = [v for v in values if v is not None]
+    counts = Counter(present)
+    stats = {"count": len(present), "nulls": len(values) - len(present), "distinct": len(counts)}
+    if len(counts) < len(present):
+        stats["most_common"] = [[_label(v), n] for v, n in counts.most_common(k)]
+    return stats
+
+
+def _temporal_stats(values) -> dict:
+    present = [v for v in values if v is not None]
+    return {"count": len(present), "nulls": len(values) - len(present),
+            "min": _label(min(present)), "max": _label(max(present)), "distinct": len(set(present))}
+
+
+def _label(value) -> str:
+    if isinstance(value, (date, datetime, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return _fmt(float(value))
+    text = str(value)
+    return text if len(text) <= SUMMARY_MAX_LABEL_CHARS else text[:SUMMARY_MAX_LABEL_CHARS - 1] + "…"
+
+
+# -------------------------------
+# Summary
+# -------------------------------
+def summarize_result(result: dict, top_k: int = SUMMARY_TOP_K) -> dict:
+    """Per-column statistics over every row of a rows- or columnar-shaped result."""
+    columnar = to_columnar(result)
+    names = columnar.get("columns", [])[:SUMMARY_MAX_COLUMNS]
+    data = columnar.get("data", [])[:SUMMARY_MAX_COLUMNS]
+    kinds = [column_kind(name, values) for name, values in zip(names, data)]
+
+    # Top rows of a measure are named by the first label-like column
+    label_col = next((i for i, kind in enumerate(kinds) if kind in ("label", "temporal")), None)
+
+    columns = []
+    for name, values, kind in zip(names, data, kinds):
+        if kind == "number":
+            stats = _number_stats(values, top_k)
+            top = stats.pop("top_rows", [])
+            # A constant or 0/1 flag column has no meaningful "highest" rows (its mean is the rate)
+            flag = stats.get("min") == 0 and stats.get("max") == 1 and stats["sum"] == int(stats["sum"])
+            if top and stats["count"] > 1 and stats["max"] > stats["min"] and not flag:
+                share = stats["sum"] > 0 and stats["min"] >= 0
+                stats["top"] = [
+                    {"label": _label(data[label_col][i]) if label_col is not None else f"row {i + 1}",
+                     "value": float(values[i]),
+                     **({"share": round(float(values[i]) / stats["sum"], 4)} if share else {})}
+                    for i in top
+                ]
+        elif kind == "temporal":
+            stats = _temporal_stats(values)
+        elif kind == "label":
+            stats = _label_stats(values, top_k)
+        else:
+            stats = {"count": 0, "nulls": len(values)}
+        columns.append({"name": name, "kind": kind, **stats})
+
+    return {
+        "row_count": columnar.get("row_count", 0),
+        "columns": columns,
+        "omitted_columns": max(0, len(columnar.get("columns", [])) - SUMMARY_MAX_COLUMNS),
+    }
+
+
+def _fmt(x: float) -> str:
+    if x == int(x) and abs(x) < 1e15:
+        return f"{int(x):,}"
+    if abs(x) < 1:
+        return f"{x:.4g}"
+    return f"{x:,.2f}"
+
+
+def format_rows(result: dict, limit: int = SUMMARY_TOP_K) -> str:
+    """The first `limit` rows as 'col=value' lines, values formatted like the summary."""
+    return "\n".join(
+        ", ".join(f"{name}={'NULL' if v is None else _label(v)}" for name, v in row.items())
+        for row in rows_view(result, limit)
+    )
+
+
+def format_summary(summary: dict) -> str:
+    """Compact text form of summarize_result() for the explanation prompt."""
+    lines = [f"Rows: {summary['row_count']}"]
+    for col in summary["columns"]:
+        name, kind = col["name"], col["kind"]
+        nulls = f", {col['nulls']} empty" if col.get("nulls") else ""
+        if kind == "number" and col["count"]:
+            line = (f"{name} (number): min {_fmt(col['min'])}, max {_fmt(col['max'])}, "
+                    f"sum {_fmt(col['sum'])}, mean {_fmt(col['mean'])}{nulls}")
+            if col.get("top"):
+                line += "; highest: " + ", ".join(
+                    f"{t['label']} {_fmt(t['value'])}" + (f" ({t['share']:.1%})" if "share" in t else "")
+                    for t in col["top"]
+                )
+        elif kind == "temporal":
+            line = f"{name} (date): {col['min']} to {col['max']}, {col['distinct']} distinct{nulls}"
+        elif kind == "label":
+            line = f"{name}: {col['distinct']} distinct{nulls}"
+            if col.get("most_common"):
+                line += "; most common: " + ", ".join(f"{v} ({n})" for v, n in col["most_common"])
+        else:
+            line = f"{name}: no values"
+        lines.append(line)
+    if summary.get("omitted_columns"):
+        lines.append(f"({summary['omitted_columns']} more columns not summarized)")
+    return "\n".join(lines)
@@ -0,0 +1,508 @@
+# Pre-aggregated daily rollup of orders and transparent query routing to it
+#
+# orders_daily_rollup holds one row per (order_date, store_id) with the store's
+# city, COUNT(*), SUM(amount) and SUM(returned). It is maintained incrementally
+# from new orders (order_id above a high-water mark) and any validated query
+# that only filters / groups by order_date, store_id or city and only uses
+# SUM(amount), SUM(returned), COUNT(*), AVG(amount) or AVG(returned) is
+# rewritten to read the rollup instead of scanning orders.
+#
+# Every predicate or grouping over those three columns gives the same answer
+# per rollup row as per order row (order_date is a DATE), so the rewrite is
+# exact. Routing only happens while the rollup has absorbed every order.
+# AUTO_INCREMENT ids can commit out of order, so the high-water mark only
+# moves over ids without gaps: a missing id holds it back (and routing with
+# it) until the id commits or ROLLUP_GAP_GRACE_SECONDS pass, after which it is
+# taken to be a rolled-back insert. An insert committing later than that, or
+# orders updated in place (e.g. returned flipped later), need a --rebuild.
+#
+#   python rollups.py --refresh                 (incremental, against MySQL)
+#   python rollups.py --refresh --loop 60       (keep refreshing every 60s)
+#   python rollups.py --rebuild --sqlite-path bench.db
+#   python rollups.py --verify --sqlite-path bench.db
+
+import argparse
+import os
+import re
+import threading
+import time
+
+from sql_rewriter import join_clauses, split_clauses, split_top_level_commas
+
+ROLLUP_TABLE = "orders_daily_rollup"
+ROLLUP_STATE_TABLE = "rollup_state"
+ROLLUP_NAME = "orders_daily"
+ROLLUP_ROUTING = os.getenv("ROLLUP_ROUTING", "1").lower() in ("1", "true", "yes")
+ROLLUP_BATCH_ORDERS = int(os.getenv("ROLLUP_BATCH_ORDERS", 500_000))     # order_id range per refresh transaction
+ROLLUP_REFRESH_INTERVAL = float(os.getenv("ROLLUP_REFRESH_INTERVAL", 0))  # seconds; 0 = refresh externally
+ROLLUP_GAP_GRACE_SECONDS = float(os.getenv("ROLLUP_GAP_GRACE_SECONDS", 300))  # wait for a missing order_id
+
+ROLLUP_DDL = {
+    "mysql": [
+        f"""CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            order_date DATE NOT NULL,
+            store_id INT NOT NULL,
+            city VARCHAR(100) NOT NULL,
+            order_count INT NOT NULL,
+            amount_sum DECIMAL(16, 2) NOT NULL,
+            returned_sum INT NOT NULL,
+            PRIMARY KEY (order_date, store_id),
+            KEY idx_{ROLLUP_TABLE}_city (city, order_date)
+        )""",
+        f"""CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (
+            name VARCHAR(64) PRIMARY KEY,
+            last_order_id BIGINT NOT NULL,
+            refreshed_at DATETIME NOT NULL
+        )""",
+    ],
+    "sqlite": [
+        f"""CREATE TABLE IF NOT EXISTS {ROLLUP_TABLE} (
+            order_date TEXT NOT NULL,
+            store_id INTEGER NOT NULL,
+            city TEXT NOT NULL,
+            order_count INTEGER NOT NULL,
+            amount_sum REAL NOT NULL,
+            returned_sum INTEGER NOT NULL,
+            PRIMARY KEY (order_date, store_id)
+        )""",
+        f"CREATE INDEX IF NOT EXISTS idx_{ROLLUP_TABLE}_city ON {ROLLUP_TABLE} (city, order_date)",
+        f"""CREATE TABLE IF NOT EXISTS {ROLLUP_STATE_TABLE} (
+            name TEXT PRIMARY KEY,
+            last_order_id INTEGER NOT NULL,
+            refreshed_at TEXT NOT NULL
+        )""",
+    ],
+}
+
+_AGGREGATE_SELECT = (
+    "SELECT o.order_date, o.store_id, s.city, COUNT(*), SUM(o.amount), SUM(o.returned) "
+    "FROM orders o JOIN stores s ON o.store_id = s.store_id "
+    "WHERE o.order_id > {p} AND o.order_id <= {p} "
+    "GROUP BY o.order_date, o.store_id, s.city"
+)
+_UPSERT = {
+    "mysql": (
+        f"INSERT INTO {ROLLUP_TABLE} (order_date, store_id, city, order_count, amount_sum, returned_sum) "
+        + _AGGREGATE_SELECT.format(p="%s")
+        + " ON DUPLICATE KEY UPDATE order_count = order_count + VALUES(order_count), "
+        "amount_sum = amount_sum + VALUES(amount_sum), returned_sum = returned_sum + VALUES(returned_sum)"
+    ),
+    "sqlite": (
+        f"INSERT INTO {ROLLUP_TABLE} (order_date, store_id, city, order_count, amount_sum, returned_sum) "
+        + _AGGREGATE_SELECT.format(p="?")
+        + " ON CONFLICT (order_date, store_id) DO UPDATE SET order_count = order_count + excluded.order_count, "
+        "amount_sum = amount_sum + excluded.amount_sum, returned_sum = returned_sum + excluded.returned_sum"
+    ),
+}
+
+
+# -------------------------------
+# Maintenance
+# -------------------------------
+def create_rollup_tables(conn, dialect: str = "mysql"):
+    cursor = conn.cursor()
+    try:
+        for statement in ROLLUP_DDL[dialect]:
+            cursor.execute(statement)
+    finally:
+        cursor.close()
+    conn.commit()
+
+
+_gaps_seen = {}     # missing order_id -> when this process first saw it
+
+
+def _first_gap(cursor, start: int, upto: int, p: str):
+    """Smallest order_id in (start, upto] with no row, or None when the range is complete."""
+    cursor.execute(f"SELECT COUNT(*), MIN(order_id) FROM orders WHERE order_id > {p} AND order_id <= {p}", (start, upto))
+    count, first = cursor.fetchone()
+    if int(count) == upto - start:
+        return None
+    if first is None or int(first) > start + 1:
+        return start + 1
+    cursor.execute(
+        f"SELECT MIN(o.order_id) + 1 FROM orders o WHERE o.order_id > {p} AND o.order_id < {p} "
+        f"AND NOT EXISTS (SELECT 1 FROM orders n WHERE n.order_id = o.order_id + 1)",
+        (start, upto),
+    )
+    return int(cursor.fetchone()[0])
+
+
+def _foldable_upto(cursor, last_id: int, upto: int, p: str, grace: float = ROLLUP_GAP_GRACE_SECONDS) -> int:
+    """Highest id up to `upto` the mark can move to: the first gap younger than `grace` stops it."""
+    now = time.monotonic()
+    start = last_id
+    while True:
+        gap = _first_gap(cursor, start, upto, p)
+        if gap is None:
+            break
+        if now - _gaps_seen.setdefault(gap, now) < grace:
+            upto = gap - 1      # the insert may still be in flight
+            break
+        start = gap             # long gone: a rolled-back insert
+    for gap in [g for g in _gaps_seen if g <= upto]:
+        del _gaps_seen[gap]
+    return upto
+
+
+def refresh(conn=None, dialect: str = "mysql", batch_orders: int = ROLLUP_BATCH_ORDERS, rebuild: bool = False) -> dict:
+    """Fold orders added since the last refresh into the rollup.
+
+    Each batch runs in one transaction that locks the rollup_state row, so
+    concurrent refreshers (several API processes, cron) never count an order twice.
+    The mark stops before an order_id that has not committed yet (see the header).
+    """
+    own_conn = conn is None
+    if own_conn:
+        from db import get_connection
+        conn = get_connection()       # writes go to the primary
+    p = "%s" if dialect == "mysql" else "?"
+    started = time.perf_counter()
+    folded = 0
+    try:
+        create_rollup_tables(conn, dialect)
+        cursor = conn.cursor()
+        try:
+            if rebuild:
+                cursor.execute(f"DELETE FROM {ROLLUP_TABLE}")
+                cursor.execute(f"DELETE FROM {ROLLUP_STATE_TABLE} WHERE name = {p}", (ROLLUP_NAME,))
+                conn.commit()
+
+            while True:
+                if dialect == "sqlite":
+                    cursor.execute("BEGIN IMMEDIATE")
+                lock = " FOR UPDATE" if dialect == "mysql" else ""
+                cursor.execute(f"SELECT last_order_id FROM {ROLLUP_STATE_TABLE} WHERE name = {p}{lock}", (ROLLUP_NAME,))
+                row = cursor.fetchone()
+                if row is None:
+                    cursor.execute(
+                        f"INSERT INTO {ROLLUP_STATE_TABLE} (name, last_order_id, refreshed_at) VALUES ({p}, 0, {p})",
+                        (ROLLUP_NAME, time.strftime("%Y-%m-%d %H:%M:%S")),
+                    )
+                    last_id = 0
+                else:
+                    last_id = int(row[0])
+                cursor.execute("SELECT COALESCE(MAX(order_id), 0) FROM orders")
+                max_id = int(cursor.fetchone()[0])
+                batch_end = min(max_id, last_id + batch_orders)
+                upto = _foldable_upto(cursor, last_id, batch_end, p) if batch_end > last_id else batch_end
+
+                if upto > last_id:
+                    cursor.execute(_UPSERT[dialect], (last_id, upto))
+                    folded += upto - last_id
+                cursor.execute(
+                    f"UPDATE {ROLLUP_STATE_TABLE} SET last_order_id = {p}, refreshed_at = {p} WHERE name = {p}",
+                    (upto, time.strftime("%Y-%m-%d %H:%M:%S"), ROLLUP_NAME),
+                )
+                conn.commit()
+                if upto >= max_id or upto < batch_end:
+                    break
+        finally:
+            cursor.close()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if own_conn:
+            conn.close()
+    return {"last_order_id": upto, "order_ids_folded": folded, "seconds": round(time.perf_counter() - started, 2)}
+
+
+def start_refresh_thread(interval: float = ROLLUP_REFRESH_INTERVAL):
+    """Refresh the rollup in the background every `interval` seconds (0 disables)."""
+    global _refresh_thread
+    if interval <= 0:
+        return
+    with _refresh_lock:
+        if _refresh_thread is not None and _refresh_thread.is_alive():
+            return
+
+        def loop():
+            while True:
+                try:
+                    refresh()
+                except Exception:
+                    pass
+                time.sleep(interval)
+
+        _refresh_thread = threading.Thread(target=loop, name="rollup-refresh", daemon=True)
+        _refresh_thread.start()
+
+
+_refresh_thread = None
+_refresh_lock = threading.Lock()
+
+
+# -------------------------------
+# Matching
+# -------------------------------
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'|\"(?:[^\"\\]|\\.|\"\")*\"")
+_IDENT = re.compile(r"\b([A-Za-z_]\w*)(?:\s*\.\s*([A-Za-z_]\w*))?\b(?!\s*\()")
+_TABLE = r"[`\"]?(\w+)[`\"]?(?:\s+(?:AS\s+)?(?!ON\b|JOIN\b|INNER\b)(\w+))?"
+_FROM = re.compile(
+    rf"^{_TABLE}(?:\s+(?:INNER\s+)?JOIN\s+{_TABLE}\s+ON\s+(\w+)\s*\.\s*(\w+)\s*=\s*(\w+)\s*\.\s*(\w+))?$",
+    re.IGNORECASE,
+)
+# Words that may appear in filters / expressions without being column references
+_NON_COLUMNS = {
+    "AND", "OR", "NOT", "IN", "IS", "NULL", "LIKE", "BETWEEN", "AS", "ASC", "DESC", "CASE", "WHEN", "THEN",
+    "ELSE", "END", "TRUE", "FALSE", "INTERVAL", "DAY", "WEEK", "MONTH", "QUARTER", "YEAR", "HOUR", "MINUTE",
+    "SECOND", "CURRENT_DATE", "CURRENT_TIMESTAMP",
+}
+_DIMENSIONS = {"order_date": "orders", "store_id": "orders", "city": "stores"}
+
+
+def _aggregate_patterns(orders_alias):
+    col = rf"(?:(?:{re.escape(orders_alias)}|orders)\s*\.\s*)?"
+    return [
+        (re.compile(rf"\bSUM\s*\(\s*{col}amount\s*\)", re.I), "SUM({r}.amount_sum)"),
+        (re.compile(rf"\bSUM\s*\(\s*{col}returned\s*\)", re.I), "SUM({r}.returned_sum)"),
+        # COUNT over no rows is 0, SUM over no rows is NULL
+        (re.compile(rf"\bCOUNT\s*\(\s*(?:\*|1|{col}order_id)\s*\)", re.I), "COALESCE(SUM({r}.order_count), 0)"),
+        (re.compile(rf"\bAVG\s*\(\s*{col}amount\s*\)", re.I), "(SUM({r}.amount_sum) * 1.0 / SUM({r}.order_count))"),
+        (re.compile(rf"\bAVG\s*\(\s*{col}returned\s*\)", re.I), "(SUM({r}.returned_sum) * 1.0 / SUM({r}.order_count))"),
+    ]
+
+
+def _parse_from(text: str):
+    """Return (orders_alias, stores_alias or None) for `orders [JOIN stores ON store_id = store_id]`."""
+    m = _FROM.match(text.strip())
+    if not m:
+        return None
+    t1, a1, t2, a2, l_alias, l_col, r_alias, r_col = m.groups()
+    tables = {t1.lower(): a1 or t1}
+    if t2:
+        tables[t2.lower()] = a2 or t2
+    if "orders" not in tables or set(tables) - {"orders", "stores"}:
+        return None
+    orders_alias, stores_alias = tables["orders"], tables.get("stores")
+    if stores_alias:
+        sides = {(l_alias.lower(), l_col.lower()), (r_alias.lower(), r_col.lower())}
+        if sides != {(orders_alias.lower(), "store_id"), (stores_alias.lower(), "store_id")}:
+            return None
+    return orders_alias, stores_alias
+
+
+def _column_refs_ok(text: str, orders_alias: str, stores_alias, select_aliases) -> bool:
+    """True if every column reference in `text` is a rollup dimension (or a select alias)."""
+    aliases = {orders_alias.lower(): "orders", "orders": "orders"}
+    if stores_alias:
+        aliases.update({stores_alias.lower(): "stores", "stores": "stores"})
+    text = text.replace("%s", "?")
+    for qualifier, name in _IDENT.findall(text):
+        if not name:
+            word = qualifier
+            if word.upper() in _NON_COLUMNS or word.lower() in select_aliases or word.startswith("__STR"):
+                continue
+            if word.lower() == "city" and not stores_alias:
+                return False
+            if word.lower() not in _DIMENSIONS:
+                return False
+            continue
+        table = aliases.get(qualifier.lower())
+        if table is None:
+            return False
+        if name.lower() == "store_id":
+            continue
+        if _DIMENSIONS.get(name.lower()) != table:
+            return False
+    return True
+
+
+def match_rollup(sql: str):
+    """Rewrite `sql` to read orders_daily_rollup, or return None if it cannot be answered from it."""
+    masked_literals = []
+
+    def _mask(m):
+        masked_literals.append(m.group(0))
+        return f"__STR{len(masked_literals) - 1}__"
+
+    masked = _STRING.sub(_mask, sql)
+    if re.search(r"\bDISTINCT\b|\bSELECT\b.*\bSELECT\b|\bOVER\s*\(|\*\s*(?:,|\bFROM\b)", masked, re.I | re.S):
+        return None
+    clauses = split_clauses(masked)
+    if not clauses or "FROM" not in clauses:
+        return None
+    parsed = _parse_from(clauses["FROM"])
+    if parsed is None:
+        return None
+    orders_alias, stores_alias = parsed
+
+    patterns = _aggregate_patterns(orders_alias)
+
+    def _rewrite(text):
+        for pattern, repl in patterns:
+            text = pattern.sub(repl.format(r="__ROLLUP"), text)
+        return text
+
+    # A rewritten aggregate without an alias keeps its original text as the column name
+    select_aliases, select_items, column_names = set(), [], []
+    for item in split_top_level_commas(clauses["SELECT"]):
+        replaced = _rewrite(item)
+        m = re.search(r"\bAS\s+[`\"]?(\w+)[`\"]?$", item, re.I) or re.search(r"[\w)]\s+[`\"]?(\w+)[`\"]?$", item)
+        if m:
+            select_aliases.add(m.group(1).lower())
+        elif replaced != item:
+            column = re.sub(r"__STR(\d+)__", lambda s: masked_literals[int(s.group(1))], item.strip())
+            if "`" in column or '"' in column:
+                return None
+            column_names.append(column)
+            replaced = f"{replaced} AS __COLUMN{len(column_names) - 1}__"
+        select_items.append(replaced)
+
+    rewritten = {}
+    for name, text in clauses.items():
+        if name in ("FROM", "LIMIT"):
+            continue
+        replaced = ", ".join(select_items) if name == "SELECT" else _rewrite(text)
+        check = replaced.replace("__ROLLUP.", "")
+        for col in ("amount_sum", "returned_sum", "order_count"):
+            check = re.sub(rf"\b{col}\b", "", check)
+        check = re.sub(r"\bAS __COLUMN\d+__", "", check)
+        if not _column_refs_ok(check, orders_alias, stores_alias, select_aliases if name != "WHERE" else set()):
+            return None
+        rewritten[name] = replaced
+
+    # Without GROUP BY the query returns one aggregate row: every item must be an aggregate
+    if "GROUP BY" not in clauses:
+        for item in split_top_level_commas(rewritten["SELECT"]):
+            outside = re.sub(r"(?:COALESCE\()?SUM\(__ROLLUP\.\w+\)(?:, 0\))?", "", item)
+            outside = re.sub(r"\bAS\s+\w+$", "", outside, flags=re.I)
+            if "__ROLLUP" not in item or re.search(r"\b(order_date|store_id|city)\b", outside, re.I):
+                return None
+
+    # Point every dimension at the rollup (it keeps the orders alias)
+    alias = orders_alias
+    for name, text in rewritten.items():
+        text = text.replace("__ROLLUP.", f"{alias}.")
+        if stores_alias:
+            text = re.sub(rf"\b{re.escape(stores_alias)}\s*\.\s*(city|store_id)\b", rf"{alias}.\1", text, flags=re.I)
+        rewritten[name] = text
+    rewritten["FROM"] = f"{ROLLUP_TABLE} {alias}"
+    if "LIMIT" in clauses:
+        rewritten["LIMIT"] = clauses["LIMIT"]
+
+    out = join_clauses(rewritten)
+    out = re.sub(r"__STR(\d+)__", lambda m: masked_literals[int(m.group(1))], out)
+    return re.sub(r"__COLUMN(\d+)__", lambda m: f"`{column_names[int(m.group(1))]}`", out)
+
+
+# -------------------------------
+# Routing
+# -------------------------------
+def rollup_current(conn) -> bool:
+    """True if the rollup exists and has absorbed every order visible to `conn`."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"SELECT (SELECT last_order_id FROM {ROLLUP_STATE_TABLE} WHERE name = '{ROLLUP_NAME}') "
+            f">= (SELECT COALESCE(MAX(order_id), 0) FROM orders)"
+        )
+        row = cursor.fetchone()
+    except Exception:
+        return False
+    finally:
+        cursor.close()
+    return bool(row and row[0])
+
+
+def route_to_rollup(sql: str, conn):
+    """SQL to run instead of `sql` (reading the rollup), or None to run it unchanged."""
+    if not ROLLUP_ROUTING:
+        return None
+    start_refresh_thread()
+    rewritten = match_rollup(sql)
+    if rewritten is None or not rollup_current(conn):
+        return None
+    return rewritten
+
+
+# -------------------------------
+# Equivalence checks
+# -------------------------------
+EQUIVALENCE_QUERIES = [
+    "SELECT s.city, SUM(o.amount) AS total_revenue FROM orders o JOIN stores s ON o.store_id = s.store_id "
+    "GROUP BY s.city ORDER BY total_revenue DESC",
+    "SELECT o.store_id, COUNT(*) AS order_count, AVG(o.returned) AS return_rate FROM orders o "
+    "WHERE o.order_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY) GROUP BY o.store_id ORDER BY o.store_id",
+    "SELECT s.city, SUM(o.returned) / COUNT(*) AS return_rate FROM orders o JOIN stores s ON o.store_id = s.store_id "
+    "WHERE s.city IN ('Mumbai', 'Delhi') AND o.order_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH) GROUP BY s.city",
+    "SELECT COUNT(*) AS orders, SUM(o.amount) AS revenue, AVG(o.amount) AS avg_order FROM orders o "
+    "WHERE o.order_date >= DATE_SUB(CURDATE(), INTERVAL 90 DAY)",
+    "SELECT o.order_date, SUM(o.amount) AS revenue FROM orders o GROUP BY o.order_date "
+    "HAVING SUM(o.amount) > 1000 ORDER BY o.order_date DESC LIMIT 10",
+]
+
+
+def _rows_equal(a, b, tolerance: float = 1e-6, decimals: float = 1e-4) -> bool:
+    # MySQL rounds AVG() to 4 extra decimals; the rollup divides sums instead
+    if len(a) != len(b):
+        return False
+    for ra, rb in zip(a, b):
+        for va, vb in zip(ra, rb):
+            if va is None or vb is None or isinstance(va, str) or isinstance(vb, str):
+                if str(va) != str(vb):
+                    return False
+            elif abs(float(va) - float(vb)) > max(decimals, tolerance * abs(float(va))):
+                return False
+    return True
+
+
+def verify_equivalence(conn, dialect: str = "mysql", queries=None):
+    """Run each query on the base tables and via the rollup; report matches and timings."""
+    from sql_rewriter import translate_dialect
+
+    results = []
+    for sql in queries or EQUIVALENCE_QUERIES:
+        rewritten = match_rollup(sql)
+        row = {"sql": sql, "matched": rewritten is not None}
+        if rewritten is not None:
+            outputs = {}
+            for variant, stmt in (("base", sql), ("rollup", rewritten)):
+                cursor = conn.cursor()
+                started = time.perf_counter()
+                cursor.execute(translate_dialect(stmt, dialect))
+                rows = cursor.fetchall()
+                row[f"{variant}_ms"] = round((time.perf_counter() - started) * 1000, 2)
+                cursor.close()
+                ordered = re.search(r"\bORDER\s+BY\b", sql, re.I)
+                outputs[variant] = [tuple(r) for r in rows] if ordered else sorted((tuple(r) for r in rows), key=repr)
+            row["equal"] = _rows_equal(outputs["base"], outputs["rollup"])
+            row["rows"] = len(outputs["base"])
+        results.append(row)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain and check the orders daily rollup")
+    parser.add_argument("--refresh", action="store_true", help="Fold new orders into the rollup")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute the rollup from scratch")
+    parser.add_argument("--loop", type=float, default=0, help="With --refresh: repeat every N seconds")
+    parser.add_argument("--verify", action="store_true", help="Compare base-table and rollup answers")
+    parser.add_argument("--sqlite-path", help="Use this SQLite stand-in instead of MySQL")
+    args = parser.parse_args()
+
+    if args.sqlite_path:
+        from data_generator import get_sqlite_connection
+        conn, dialect = get_sqlite_connection(args.sqlite_path), "sqlite"
+    else:
+        from db import get_connection
+        conn, dialect = get_connection(), "mysql"
+
+    try:
+        if args.refresh or args.rebuild:
+            while True:
+                print(refresh(conn, dialect, rebuild=args.rebuild))
+                if args.loop <= 0 or args.rebuild:
+                    break
+                time.sleep(args.loop)
+        if args.verify:
+            for row in verify_equivalence(conn, dialect):
+                print("  " + "  ".join(f"{k}={v}" for k, v in row.items() if k != "sql"))
+                print(f"      | {row['sql']}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""run_benchmark.py
+
+Micro-benchmarks for the execution layer on a scaled dataset.
+
+Usage examples:
+
+# Build a 1M-order SQLite stand-in first
+python data_generator.py --scale 10 --target sqlite --sqlite-path bench.db
+
+# Derived-table wrapper vs. top-level LIMIT/hint rewrite
+python run_benchmark.py --suite rewrite --target sqlite --sqlite-path bench.db
+
+# Same against MySQL (uses db.py credentials)
+python run_benchmark.py --suite rewrite --target mysql
+
+# Base tables vs. the orders daily rollup (builds the rollup first)
+python run_benchmark.py --suite rollup --target sqlite --sqlite-path bench.db
+
+# Live database vs. the embedded analytics snapshot (DuckDB if installed)
+python run_benchmark.py --suite backends --target sqlite --sqlite-path bench.db
+
+# Serial validate-then-retry vs. 4 batched SQL candidates (needs the model)
+python run_benchmark.py --suite candidates --candidates 4 --target sqlite --sqlite-path bench.db
+
+# One question at a time vs. the batch API, whole pipeline (needs the model)
+python run_benchmark.py --suite batch --target sqlite --sqlite-path bench.db
+"""
+import argparse
+import statistics
+import time
+
+from sql_executor import MAX_ROWS, QUERY_TIMEOUT
+
+# Representative generated queries that run unchanged on MySQL and SQLite
+BENCH_QUERIES = {
+    "revenue_per_city": (
+        "SELECT s.city, SUM(o.amount) AS total_revenue FROM orders o "
+        "JOIN stores s ON o.store_id = s.store_id GROUP BY s.city ORDER BY total_revenue DESC"
+    ),
+    "return_rate_per_store": (
+        "SELECT o.store_id, AVG(o.returned) AS return_rate, COUNT(*) AS order_count "
+        "FROM orders o GROUP BY o.store_id ORDER BY return_rate DESC"
+    ),
+    "largest_orders": "SELECT o.order_id, o.amount FROM orders o ORDER BY o.amount DESC",
+    "subquery_sorted": (
+        "SELECT t.city, t.total FROM (SELECT c.city, SUM(o.amount) AS total FROM orders o "
+        "JOIN customers c ON o.customer_id = c.customer_id GROUP BY c.city ORDER BY total DESC) t"
+    ),
+}
+
+# MySQL-dialect queries as the model writes them (translated for other engines)
+DIALECT_QUERIES = {
+    "last_30_days_per_store": (
+        "SELECT o.store_id, SUM(o.amount) AS revenue, COUNT(*) AS orders FROM orders o "
+        "WHERE o.order_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY) GROUP BY o.store_id ORDER BY revenue DESC"
+    ),
+}
+
+
+def _connect(target: str, sqlite_path: str):
+    if target == "sqlite":
+        from data_generator import get_sqlite_connection
+        return get_sqlite_connection(sqlite_path), "sqlite"
+    from db import get_connection
+    return get_connection(), "mysql"
+
+
+def _time_query(conn, sql: str, repeat: int):
+    timings = []
+    rows = 0
+    for _ in range(repeat):
+        cursor = conn.cursor()
+        started = time.perf_counter()
+        cursor.execute(sql)
+        rows = len(cursor.fetchall())
+        timings.append((time.perf_counter() - started) * 1000)
+        cursor.close()
+    return {
+        "rows": rows,
+        "p50_ms": round(statistics.median(timings), 2),
+        "max_ms": round(max(timings), 2),
+    }
+
+
+def _plan(conn, sql: str, dialect: str):
+    cursor = conn.cursor()
+    try:
+        if dialect == "sqlite":
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+            return [r[3] for r in cursor.fetchall()]
+        cursor.execute(f"EXPLAIN FORMAT=TREE {sql}")
+        return cursor.fetchone()[0].splitlines()
+    finally:
+        cursor.close()
+
+
+# -------------------------------
+# Suites
+# -------------------------------
+def suite_rewrite(conn, dialect, args):
+    """Legacy derived-table wrapper vs. sql_rewriter.rewrite_for_execution."""
+    from sql_rewriter import rewrite_for_execution
+
+    timeout_ms = QUERY_TIMEOUT * 1000
+    hint = f"/*+ MAX_EXECUTION_TIME({timeout_ms}) */ " if dialect == "mysql" else ""
+    results = []
+    for name, sql in BENCH_QUERIES.items():
+        variants = {
+            "wrapped": f"SELECT {hint}* FROM ({sql}) AS safe_query LIMIT {MAX_ROWS}",
+            "rewritten": rewrite_for_execution(sql, max_rows=MAX_ROWS, timeout_ms=timeout_ms, dialect=dialect),
+        }
+        for variant, stmt in variants.items():
+            row = {"query": name, "variant": variant}
+            row.update(_time_query(conn, stmt, args.repeat))
+            if args.show_plans:
+                row["plan"] = _plan(conn, stmt, dialect)
+            results.append(row)
+    return results
+
+
+def suite_encoding(conn, dialect, args):
+    """Payload size / serialization time for a 1000-row result in each encoding."""
+    import result_encoding
+
+    sql = f"SELECT order_id, customer_id, store_id, order_date, amount, returned FROM orders LIMIT {MAX_ROWS}"
+    cursor = conn.cursor()
+    cursor.execute(sql)
+    rows = cursor.fetchall()
+    columnar = result_encoding.columnar_from_cursor(cursor, rows)
+    cursor.close()
+    row_dicts = result_encoding.rows_view(columnar)
+
+    encoders = {
+        "rows_dumps": lambda: result_encoding.encode_payload({"result": {"row_count": len(row_dicts), "data": row_dicts}}, "rows")[0],
+        "columnar_dumps": lambda: result_encoding.encode_payload({"result": columnar}, "columnar")[0],
+    }
+    try:
+        from fastapi.encoders import jsonable_encoder
+        import json
+        encoders["rows_fastapi"] = lambda: json.dumps(jsonable_encoder({"result": {"data": row_dicts}})).encode("utf-8")
+    except ImportError:
+        pass
+    if result_encoding._HAS_PYARROW:
+        encoders["arrow_ipc"] = lambda: result_encoding.encode_payload({"result": columnar}, "arrow")[0]
+
+    results = []
+    for name, encode in sorted(encoders.items()):
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            body = encode()
+            timings.append((time.perf_counter() - started) * 1000)
+        results.append({
+            "encoding": name,
+            "rows": len(rows),
+            "bytes": len(body),
+            "p50_ms": round(statistics.median(timings), 3),
+        })
+    return results
+
+
+def suite_backends(conn, dialect, args):
+    """Same queries on the live database and on a freshly synced local snapshot."""
+    import tempfile
+    from execution_backends import SnapshotBackend
+    from sql_rewriter import rewrite_for_execution, translate_dialect
+
+    snapshot = SnapshotBackend(directory=tempfile.mkdtemp(prefix="nlsql-snapshot-"), pool_size=1)
+    sync = snapshot.sync(source=conn)
+    results = [{"query": "(sync)", "variant": snapshot.engine, "rows": sum(sync["tables"].values()),
+                "seconds": sync["seconds"]}]
+
+    snap_conn = snapshot.get_connection()
+    try:
+        for name, sql in {**BENCH_QUERIES, **DIALECT_QUERIES}.items():
+            for variant, target, target_dialect in (("live", conn, dialect), ("snapshot", snap_conn, snapshot.engine)):
+                stmt = rewrite_for_execution(translate_dialect(sql, target_dialect), max_rows=MAX_ROWS,
+                                             timeout_ms=QUERY_TIMEOUT * 1000, dialect=target_dialect)
+                row = {"query": name, "variant": f"{variant}:{target_dialect}"}
+                row.update(_time_query(target, stmt, args.repeat))
+                results.append(row)
+    finally:
+        snap_conn.close()
+    return results
+
+
+def suite_rollup(conn, dialect, args):
+    """Equivalence and latency of base-table queries vs. their orders_daily_rollup rewrites."""
+    import rollups
+
+    results = [dict({"query": "(refresh)"}, **rollups.refresh(conn, dialect))]
+    best = {}
+    for _ in range(args.repeat):
+        for i, row in enumerate(rollups.verify_equivalence(conn, dialect)):
+            row.pop("sql")
+            kept = best.setdefault(i, row)
+            for key in ("base_ms", "rollup_ms"):
+                if key in row:
+                    kept[key] = min(kept[key], row[key])
+            kept["equal"] = kept.get("equal", True) and row.get("equal", True)
+    for i, row in sorted(best.items()):
+        results.append(dict({"query": f"equivalence_{i}"}, **row))
+    return results
+
+
+def suite_candidates(conn, dialect, args):
+    """Generation latency and accuracy on GOLDEN_SQL: one sequence plus retry vs. N batched candidates."""
+    import json
+    import sql_generator
+    from rollups import _rows_equal
+    from sql_rewriter import translate_dialect
+    from test_cases import GOLDEN_SQL
+
+    with open("schema.json") as f:
+        schema = json.load(f)
+
+    def rows(sql):
+        cursor = conn.cursor()
+        try:
+            cursor.execute(translate_dialect(sql, dialect) if dialect != "mysql" else sql)
+            return [tuple(r) for r in cursor.fetchall()]
+        finally:
+            cursor.close()
+
+    expected = [rows(case["sql"]) for case in GOLDEN_SQL]
+    results = []
+    for variant, n in (("serial", 1), (f"candidates_{args.candidates}", args.candidates)):
+        sql_generator.SQL_CANDIDATES = n
+        before = sql_generator.generation_stats()
+        timings, correct = [], 0
+        for _ in range(args.repeat):
+            for case, want in zip(GOLDEN_SQL, expected):
+                started = time.perf_counter()
+                sql = sql_generator.generate_sql(case["question"], schema)
+                timings.append((time.perf_counter() - started) * 1000)
+                try:
+                    correct += _rows_equal(rows(sql), want)
+                except Exception:
+                    pass
+        after = sql_generator.generation_stats()
+        timings.sort()
+        results.append({
+            "variant": variant,
+            "questions": len(timings),
+            "accuracy": round(correct / len(timings), 3),
+            "retries": after["retries"] - before["retries"],
+            "p50_ms": round(statistics.median(timings), 1),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 1),
+            "max_ms": round(timings[-1], 1),
+        })
+    return results
+
+
+def suite_batch(conn, dialect, args):
+    """Whole-pipeline wall time per GOLDEN_SQL question: one run_nl_to_sql at a time vs. run_batch."""
+    import os
+    import replica_router
+    from batch_query import answer_batch
+    from nl_to_sql_pipeline import run_nl_to_sql
+    from test_cases import GOLDEN_SQL
+
+    if dialect == "sqlite" and not replica_router.DB_READ_ENDPOINTS:
+        replica_router.DB_READ_ENDPOINTS = f"sqlite:///{os.path.abspath(args.sqlite_path)}"
+    questions = [case["question"] for case in GOLDEN_SQL]
+    results = []
+    for variant in ("serial", "batch"):
+        elapsed, answered = 0.0, 0
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            if variant == "serial":
+                responses = [run_nl_to_sql(q, explain=args.explain) for q in questions]
+            else:
+                responses = answer_batch(questions, explain=args.explain)
+            elapsed += time.perf_counter() - started
+            answered += sum(1 for r in responses if r["status"] == "success")
+        total = len(questions) * args.repeat
+        results.append({
+            "variant": variant,
+            "questions": total,
+            "answered": answered,
+            "ms_per_question": round(elapsed * 1000 / total, 1),
+            "questions_per_s": round(total / elapsed, 2),
+        })
+    return results
+
+
+SUITES = {
+    "backends": suite_backends,
+    "batch": suite_batch,
+    "candidates": suite_candidates,
+    "encoding": suite_encoding,
+    "rollup": suite_rollup,
+    "rewrite": suite_rewrite,
+}
+
+
+def _print_results(results):
+    for row in results:
+        plan = row.pop("plan", None)
+        print("  " + "  ".join(f"{k}={v}" for k, v in row.items()))
+        for line in plan or []:
+            print(f"      | {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the SQL execution layer")
+    parser.add_argument("--suite", choices=sorted(SUITES), action="append",
+                        help="Suite(s) to run (default: all but candidates and batch, which load the model)")
+    parser.add_argument("--target", choices=["mysql", "sqlite"], default="sqlite")
+    parser.add_argument("--sqlite-path", default="nlsql_bench.db", help="SQLite stand-in built by data_generator.py")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per query")
+    parser.add_argument("--candidates", type=int, default=4, help="Batched SQL candidates for the candidates suite")
+    parser.add_argument("--explain", choices=["inline", "none"], default="inline",
+                        help="Explanation stage in the batch suite")
+    parser.add_argument("--show-plans", action="store_true", help="Print the query plan of each variant")
+    args = parser.parse_args()
+
+    conn, dialect = _connect(args.target, args.sqlite_path)
+    try:
+        for name in args.suite or sorted(s for s in SUITES if s not in ("candidates", "batch")):
+            print(f"\n--- {name} ({dialect}) ---")
+            _print_results(SUITES[name](conn, dialect, args))
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
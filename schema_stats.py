@@ -0,0 +1,311 @@
+# Schema statistics sidecar (schema_stats.json)
+# Row estimates, index definitions, distinct counts estimated from a random
+# sample, exact min/max ranges (small tables and indexed columns) and top
+# values for low-cardinality columns. Kept out of schema.json so the
+# base schema stays small; consumed by the SQL prompt and cost-aware checks.
+
+import json
+import os
+import time
+from datetime import date, datetime
+from decimal import Decimal
+
+STATS_VERSION = 2                # 2: random sample, extrapolated distinct counts, exact ranges only
+SCHEMA_STATS_PATH = os.getenv("SCHEMA_STATS_PATH", "schema_stats.json")
+
+SAMPLE_ROWS = 10_000             # rows sampled (at random) per table
+LOW_CARDINALITY_MAX = 20         # columns with <= this many distinct values get top values
+TOP_VALUES = 10
+DEFAULT_MAX_AGE = 24 * 3600      # refresh stats older than a day
+
+NUMERIC_TYPES = {"INT", "INTEGER", "BIGINT", "SMALLINT", "MEDIUMINT", "TINYINT",
+                 "DECIMAL", "NUMERIC", "FLOAT", "DOUBLE", "REAL"}
+TEMPORAL_TYPES = {"DATE", "DATETIME", "TIMESTAMP"}
+TEXT_TYPES = {"VARCHAR", "CHAR", "TEXT", "ENUM"}
+
+
+def _jsonable(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    return value
+
+
+def _q(identifier: str) -> str:
+    # Backticks are accepted by both MySQL and SQLite
+    return f"`{identifier}`"
+
+
+# -------------------------------
+# Collection
+# -------------------------------
+def _row_estimates(cursor, schema, database_name, dialect):
+    if dialect == "mysql":
+        # InnoDB keeps an estimate in information_schema; no table scan needed
+        cursor.execute(
+            "SELECT table_name, table_rows FROM information_schema.tables WHERE table_schema = %s",
+            (database_name,),
+        )
+        rows = {r[0]: int(r[1] or 0) for r in cursor.fetchall()}
+        return {t: rows.get(t, 0) for t in schema}
+
+    estimates = {}
+    for table in schema:
+        cursor.execute(f"SELECT COUNT(*) FROM {_q(table)}")
+        estimates[table] = int(cursor.fetchone()[0])
+    return estimates
+
+
+def _indexes(cursor, schema, database_name, dialect):
+    """Return {table: [{"name", "unique", "columns", "cardinality"}]}."""
+    indexes = {t: [] for t in schema}
+
+    if dialect == "mysql":
+        cursor.execute(
+            """
+            SELECT table_name, index_name, non_unique, column_name, cardinality
+            FROM information_schema.statistics
+            WHERE table_schema = %s
+            ORDER BY table_name, index_name, seq_in_index
+            """,
+            (database_name,),
+        )
+        by_name = {}
+        for table, name, non_unique, column, cardinality in cursor.fetchall():
+            if table not in indexes:
+                continue
+            idx = by_name.get((table, name))
+            if idx is None:
+                idx = by_name[(table, name)] = {
+                    "name": name,
+                    "unique": not int(non_unique),
+                    "columns": [],
+                    "cardinality": int(cardinality) if cardinality is not None else None,
+                }
+                indexes[table].append(idx)
+            idx["columns"].append(column)
+        return indexes
+
+    for table, info in schema.items():
+        # INTEGER PRIMARY KEY is the rowid in SQLite and never shows up in index_list
+        pk = info.get("primary_key", [])
+        if pk:
+            indexes[table].append({"name": "PRIMARY", "unique": True, "columns": list(pk), "cardinality": None})
+        cursor.execute(f"PRAGMA index_list({_q(table)})")
+        for row in cursor.fetchall():
+            name, unique = row[1], bool(row[2])
+            cursor.execute(f"PRAGMA index_info({_q(name)})")
+            cols = [r[2] for r in cursor.fetchall()]
+            if pk and cols == list(pk):
+                continue
+            indexes[table].append({"name": name, "unique": unique, "columns": cols, "cardinality": None})
+    return indexes
+
+
+def _sample_filter(dialect: str, fraction: float) -> str:
+    """WHERE clause keeping each row with probability `fraction` (rows from the whole table)."""
+    if fraction >= 1:
+        return ""
+    if dialect == "mysql":
+        return f" WHERE RAND() < {fraction:.6f}"
+    if dialect == "sqlite":
+        # RANDOM() is a signed 64-bit integer; keep its low 31 bits
+        return f" WHERE (RANDOM() & 2147483647) < {int(fraction * 2147483648)}"
+    return f" WHERE random() < {fraction:.6f}"
+
+
+def _estimate_distinct(values, population: int, exact: bool) -> int:
+    """Distinct values in the table from a uniform sample of it.
+
+    Haas & Stokes' Duj1 estimator: values seen once in the sample stand for
+    the unseen ones, so a key-like column scales towards population * d/n
+    while a column whose values all repeat (cities) stays at d.
+    """
+    counts = {}
+    for v in values:
+        if v is not None:
+            counts[v] = counts.get(v, 0) + 1
+    d = len(counts)
+    n = len(values)
+    if exact or not n or population <= n:
+        return d
+    f1 = sum(1 for c in counts.values() if c == 1)
+    estimate = n * d / (n - f1 + f1 * n / population)
+    return int(min(population, max(d, round(estimate))))
+
+
+def _column_stats(cursor, table, columns, leading_index_cols, sample_rows, row_estimate=0, dialect="mysql"):
+    """Distinct estimates, min/max and top values for one table from a random sample."""
+    if not columns:
+        return {}
+
+    names = list(columns)
+    # Rows drawn from the whole table, not the first ones in storage order; a
+    # table no larger than the sample is read whole and its stats are exact
+    fraction = min(1.0, sample_rows / row_estimate) if row_estimate else 1.0
+    cursor.execute(
+        f"SELECT {', '.join(_q(c) for c in names)} FROM {_q(table)}"
+        f"{_sample_filter(dialect, fraction)} LIMIT {int(sample_rows)}"
+    )
+    rows = cursor.fetchall()
+    exact = fraction >= 1 and len(rows) < sample_rows
+
+    stats = {}
+    for i, c in enumerate(names):
+        col_type = str(columns[c]).upper()
+        values = [row[i] for row in rows]
+        present = [v for v in values if v is not None]
+        entry = {"distinct_estimate": _estimate_distinct(values, row_estimate, exact)}
+        # Ranges go into the SQL prompt as facts: only whole-table ones
+        if exact and present and (col_type in NUMERIC_TYPES or col_type in TEMPORAL_TYPES):
+            entry["min"], entry["max"] = _jsonable(min(present)), _jsonable(max(present))
+        # Top values for low-cardinality text columns (e.g. city names)
+        if col_type in TEXT_TYPES and 0 < entry["distinct_estimate"] <= LOW_CARDINALITY_MAX:
+            counts = {}
+            for v in present:
+                counts[v] = counts.get(v, 0) + 1
+            top = sorted(counts.items(), key=lambda kv: -kv[1])[:TOP_VALUES]
+            entry["top_values"] = [[_jsonable(v), n] for v, n in top]
+        if exact:
+            entry["exact"] = True
+        stats[c] = entry
+
+    # Exact min/max where an index makes it a cheap lookup
+    for c in names:
+        col_type = str(columns[c]).upper()
+        if c in leading_index_cols and not exact and (col_type in NUMERIC_TYPES or col_type in TEMPORAL_TYPES):
+            cursor.execute(f"SELECT MIN({_q(c)}), MAX({_q(c)}) FROM {_q(table)}")
+            lo, hi = cursor.fetchone()
+            if lo is not None:
+                stats[c]["min"], stats[c]["max"] = _jsonable(lo), _jsonable(hi)
+
+    return stats
+
+
+def collect_stats(conn, schema: dict, database_name: str = None, dialect: str = "mysql",
+                  sample_rows: int = SAMPLE_ROWS) -> dict:
+    """Collect statistics for every table in `schema` over an open connection."""
+    cursor = conn.cursor()
+    try:
+        estimates = _row_estimates(cursor, schema, database_name, dialect)
+        indexes = _indexes(cursor, schema, database_name, dialect)
+
+        tables = {}
+        for table, info in schema.items():
+            leading = {idx["columns"][0] for idx in indexes[table] if idx["columns"]}
+            tables[table] = {
+                "row_estimate": estimates.get(table, 0),
+                "indexes": indexes[table],
+                "columns": _column_stats(cursor, table, info.get("columns", {}), leading, sample_rows,
+                                         estimates.get(table, 0), dialect),
+            }
+    finally:
+        cursor.close()
+
+    return {
+        "version": STATS_VERSION,
+        "database": database_name,
+        "dialect": dialect,
+        "collected_at": time.time(),
+        "sample_rows": sample_rows,
+        "tables": tables,
+    }
+
+
+# -------------------------------
+# Sidecar file
+# -------------------------------
+_cache = {"path": None, "mtime": None, "stats": None}
+
+
+def load_stats(path: str = SCHEMA_STATS_PATH):
+    """Load the stats sidecar, or None if missing or of another version.
+
+    The parsed file is cached and only re-read when its mtime changes.
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    if _cache["path"] == path and _cache["mtime"] == mtime:
+        return _cache["stats"]
+
+    try:
+        with open(path) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if stats.get("version") != STATS_VERSION:
+        stats = None
+
+    _cache.update(path=path, mtime=mtime, stats=stats)
+    return stats
+
+
+def is_stale(stats, max_age: float = DEFAULT_MAX_AGE) -> bool:
+    if not stats:
+        return True
+    return time.time() - stats.get("collected_at", 0) > max_age
+
+
+def refresh_stats(conn, schema: dict, database_name: str = None, dialect: str = "mysql",
+                  path: str = SCHEMA_STATS_PATH, max_age: float = DEFAULT_MAX_AGE,
+                  sample_rows: int = SAMPLE_ROWS, force: bool = False):
+    """Re-collect and atomically rewrite the sidecar if it is older than `max_age`.
+
+    Meant to be run on a schedule (cron / systemd timer). Returns the stats
+    in effect after the call.
+    """
+    current = load_stats(path)
+    if not force and not is_stale(current, max_age) and current.get("database") == database_name:
+        return current
+
+    from extract_schema import write_json_atomic
+
+    stats = collect_stats(conn, schema, database_name=database_name, dialect=dialect, sample_rows=sample_rows)
+    write_json_atomic(path, stats)
+    return stats
+
+
+# -------------------------------
+# Lookups for checks and prompts
+# -------------------------------
+def row_estimate(stats, table: str):
+    """Estimated row count for `table`, or None without stats."""
+    if not stats:
+        return None
+    return stats.get("tables", {}).get(table, {}).get("row_estimate")
+
+
+def indexed_columns(stats, table: str) -> set:
+    """Columns that lead some index on `table` (usable for range/equality lookups)."""
+    if not stats:
+        return set()
+    indexes = stats.get("tables", {}).get(table, {}).get("indexes", [])
+    return {idx["columns"][0] for idx in indexes if idx.get("columns")}
+
+
+def format_stats_for_prompt(stats, max_values: int = TOP_VALUES) -> str:
+    """Compact, model-readable summary of table sizes, indexes and known values."""
+    if not stats:
+        return ""
+
+    lines = []
+    for table, info in stats.get("tables", {}).items():
+        parts = [f"~{info.get('row_estimate', 0):,} rows"]
+        indexed = sorted({idx["columns"][0] for idx in info.get("indexes", []) if idx.get("columns")})
+        if indexed:
+            parts.append("indexed: " + ", ".join(indexed))
+        for col, cstats in info.get("columns", {}).items():
+            if "top_values" in cstats:
+                values = [str(v) for v, _ in cstats["top_values"][:max_values]]
+                parts.append(f"{col} values: " + ", ".join(values))
+            elif "min" in cstats and isinstance(cstats.get("min"), str):
+                parts.append(f"{col} range: {cstats['min']} to {cstats['max']}")
+        lines.append(f"{table}: " + "; ".join(parts))
+    return "\n".join(lines)
@@ -1,58 +1,11 @@
 # seed_data.py
-from faker import Faker
-import random
-from datetime import date, timedelta
-from db import get_connection
+# Seeds the MySQL database with a small demo dataset (4+ stores, 50 customers, 500 orders).
+# Bulk loading lives in data_generator.py; use it directly for larger --scale values.
+# Running it again appends another demo dataset (data_generator.py --reset starts over).
+from data_generator import generate
 
-fake = Faker()
-conn = get_connection()
-cursor = conn.cursor()
+SEED_SCALE = 0.005       # 500 orders, 50 customers
 
-cities = ["Bengaluru", "Mumbai", "Delhi", "Chennai"]
-
-# ---------- INSERT STORES ----------
-store_ids = []
-for city in cities:
-    cursor.execute(
-        "INSERT INTO stores (city) VALUES (%s)",
-        (city,)
-    )
-    store_ids.append(cursor.lastrowid)
-
-# ---------- INSERT CUSTOMERS ----------
-customer_ids = []
-for _ in range(50):
-    cursor.execute(
-        """
-        INSERT INTO customers (name, city, age)
-        VALUES (%s, %s, %s)
-        """,
-        (
-            fake.name(),
-            random.choice(cities),
-            random.randint(18, 65)
-        )
-    )
-    customer_ids.append(cursor.lastrowid)
-
-# ---------- INSERT ORDERS ----------
-for _ in range(500):
-    cursor.execute(
-        """
-        INSERT INTO orders (customer_id, store_id, order_date, amount, returned)
-        VALUES (%s, %s, %s, %s, %s)
-        """,
-        (
-            random.choice(customer_ids),
-            random.choice(store_ids),
-            fake.date_between(start_date="-1y", end_date="today"),
-            round(random.uniform(100, 5000), 2),
-            random.choice([0, 0, 0, 1])  # ~25% returns
-        )
-    )
-
-conn.commit()
-cursor.close()
-conn.close()
-
-print("✅ MySQL database seeded successfully")
+if __name__ == "__main__":
+    generate(scale=SEED_SCALE, target="mysql", method="executemany")
+    print("✅ MySQL database seeded successfully")
@@ -1,18 +1,60 @@
 # Secure SQL execution layer for MySQL
 # Executes ONLY validated SELECT queries
 # Includes timeout, row limits, and safe result formatting
+# Generated SQL is read-only, so it runs on a read replica when
+# DB_READ_ENDPOINTS is configured (see replica_router.py), or on the local
+# analytics snapshot when the caller prefers speed over freshness
+# (see execution_backends.py). Aggregates the daily rollup can answer are
+# rewritten to read it (see rollups.py).
+
+import os
+import sqlite3
+import time
+from decimal import Decimal
 
 import mysql.connector
-from mysql.connector import Error
-from db import get_connection
+from mysql.connector import Error, InterfaceError, OperationalError
+from replica_router import get_read_connection
+from cost_gate import check_query_cost
+from execution_backends import ENGINE_ERRORS, choose_backend, execution_timeout, get_snapshot
+from rollups import ROLLUP_TABLE, route_to_rollup
+from sql_rewriter import convert_placeholders, rewrite_for_execution, top_level_limit, translate_dialect
+from result_encoding import columnar_from_cursor
+from deadlines import execution_timeout_s
 
 MAX_ROWS = 1000          # Hard limit on rows returned
-QUERY_TIMEOUT = 5        # Seconds
+QUERY_TIMEOUT = float(os.getenv("QUERY_TIMEOUT", 5))   # Seconds; less when the request deadline is closer
+
+LOCK_RETRIES = 3         # Re-runs of a statement that hit a lock
+LOCK_RETRY_BACKOFF = 0.05   # Seconds before the first re-run; doubles each time
+
+# Errors that say the endpoint itself is unhealthy (vs. a bad query)
+_ENDPOINT_ERRORS = (InterfaceError, OperationalError)
+_MYSQL_LOCK_ERRNOS = {1205, 1213}   # lock wait timeout, deadlock
+
+
+def _is_lock_error(e) -> bool:
+    """Contention (a rollup refresh or snapshot sync writing), not a broken endpoint."""
+    if isinstance(e, sqlite3.Error):
+        return any(m in str(e) for m in ("locked", "busy"))
+    return getattr(e, "errno", None) in _MYSQL_LOCK_ERRNOS
+
+
+def _is_endpoint_error(e) -> bool:
+    if _is_lock_error(e):
+        return False
+    if isinstance(e, sqlite3.Error):
+        return any(m in str(e) for m in ("unable to open", "disk I/O"))
+    return isinstance(e, _ENDPOINT_ERRORS)
+
 
-def execute_sql(sql: str):
+def execute_sql(sql: str, params=None, result_format: str = "rows", freshness: str = None):
     """
     Executes a validated SELECT SQL query safely.
-    Returns results as list of dictionaries.
+    `params` are bound to %s placeholders (used by keyset pagination).
+    `freshness` picks the backend: "fresh" (MySQL), "fast" (snapshot) or "auto".
+    Returns results as list of dictionaries, or with result_format="columnar"
+    as column names/types plus one value array per column.
     """
 
     if not sql.strip().upper().startswith("SELECT"):
@@ -22,25 +64,97 @@ def execute_sql(sql: str):
             "error": "Only SELECT queries are allowed for execution"
         }
 
+    # Raises DeadlineExceeded when the request has no time left to run it
+    timeout = execution_timeout_s(QUERY_TIMEOUT)
+
     conn = None
     cursor = None
 
     try:
-        conn = get_connection()
-        cursor = conn.cursor(dictionary=True)
+        backend = choose_backend(sql, freshness)
+        conn = get_snapshot().get_connection() if backend == "snapshot" else get_read_connection()
+        dialect = getattr(conn, "dialect", "mysql")
+
+        # Revenue / order count / return rate by date, store or city: read the daily rollup
+        rollup_sql = route_to_rollup(sql, conn)
+        if rollup_sql:
+            sql = rollup_sql
+
+        if dialect != "mysql":
+            sql = translate_dialect(sql, dialect)
+            if params:
+                sql = convert_placeholders(sql, "?")
+                if dialect == "sqlite":
+                    # sqlite3 cannot bind Decimal (keyset values of DECIMAL columns)
+                    params = [float(v) if isinstance(v, Decimal) else v for v in params]
+
+        # Reject / rewrite expensive plans before they tie up the connection
+        # (the gate reads MySQL and SQLite plans; DuckDB snapshots are local scans)
+        decision = check_query_cost(sql, conn, dialect=dialect, params=params,
+                                    mode="off" if dialect == "duckdb" else None)
+        if decision["action"] == "reject":
+            return {
+                "error": "Query rejected by cost gate: " + "; ".join(decision["reasons"])
+            }
+        sql = decision["sql"]
 
-        # Enforce execution timeout (MySQL supports MAX_EXECUTION_TIME hint)
-        timed_sql = f"SELECT /*+ MAX_EXECUTION_TIME({QUERY_TIMEOUT * 1000}) */ * FROM ({sql}) AS safe_query LIMIT {MAX_ROWS}"
+        # Columnar results are built from plain tuples; no per-row dicts
+        if dialect == "mysql":
+            cursor = conn.cursor(dictionary=(result_format != "columnar"))
+        else:
+            cursor = conn.cursor()
 
-        cursor.execute(timed_sql)
-        results = cursor.fetchall()
+        # Enforce execution timeout (MySQL MAX_EXECUTION_TIME hint) and the row cap
+        # directly on the top-level SELECT instead of wrapping it in a derived table
+        timed_sql = rewrite_for_execution(sql, max_rows=MAX_ROWS, timeout_ms=max(1, int(timeout * 1000)), dialect=dialect)
 
+        for attempt in range(LOCK_RETRIES + 1):
+            try:
+                with execution_timeout(conn, cursor, dialect, timeout):
+                    cursor.execute(timed_sql, params if dialect == "mysql" else (params or ()))
+                    results = cursor.fetchall()
+                break
+            except (Error,) + ENGINE_ERRORS as e:
+                if attempt == LOCK_RETRIES or not _is_lock_error(e):
+                    raise
+                time.sleep(LOCK_RETRY_BACKOFF * 2 ** attempt)
+
+        if result_format == "columnar":
+            response = columnar_from_cursor(cursor, results)
+        else:
+            if dialect != "mysql":
+                names = [d[0] for d in cursor.description or []]
+                results = [dict(zip(names, row)) for row in results]
+            response = {
+                "row_count": len(results),
+                "data": results
+            }
+        # Rows may have been cut: the LIMIT (capped at MAX_ROWS) was reached, or the
+        # cost gate lowered it; such a result does not hold every row of the query
+        cap = top_level_limit(timed_sql)
+        if (cap is not None and response["row_count"] >= cap) or decision["action"] == "rewrite":
+            response["truncated"] = True
+        if decision["action"] in ("warn", "rewrite"):
+            response["cost_warnings"] = decision["reasons"]
+        if decision["action"] == "rewrite":
+            response["executed_sql"] = sql
+        response["backend"] = backend
+        if rollup_sql:
+            response["rollup"] = ROLLUP_TABLE
+            response["executed_sql"] = sql
+        if backend == "snapshot":
+            response["snapshot_age_s"] = round(get_snapshot().age(), 1)
+        return response
+
+    except ValueError as e:
+        # Dialect translation could not handle the statement
         return {
-            "row_count": len(results),
-            "data": results
+            "error": str(e)
         }
 
-    except Error as e:
+    except (Error,) + ENGINE_ERRORS as e:
+        if conn is not None and hasattr(conn, "mark_failed") and _is_endpoint_error(e):
+            conn.mark_failed(e)
         return {
             "error": str(e)
         }
@@ -1,11 +1,37 @@
 # End-to-end NL → SQL generation using Qwen2.5-32B with guardrails
 
-import torch
-from llm_loader import load_llm
-from prompt_templates import SQL_SYSTEM_PROMPT, build_user_prompt
+from inference import generate_candidates, generate_prompt
+from prompt_templates import build_sql_prompt, build_sql_retry_prompt
 from sql_guardrails import validate_sql
+from schema_stats import load_stats
+from deadlines import EXECUTION_RESERVE_MS, DeadlineExceeded, current_deadline, skip_stage, token_budget
 
+import os
 import re
+import threading
+
+# SQL_CANDIDATES > 1: generate that many candidates in one batched call and keep
+# the first that validates (or the cheapest by EXPLAIN with SQL_RANK_BY_COST),
+# instead of validate-then-regenerate. The correction retry only runs when no
+# candidate passes.
+SQL_CANDIDATES = int(os.getenv("SQL_CANDIDATES", 1))
+SQL_CANDIDATE_MODE = os.getenv("SQL_CANDIDATE_MODE", "sample").lower()   # sample | beam
+SQL_CANDIDATE_TEMPERATURE = float(os.getenv("SQL_CANDIDATE_TEMPERATURE", 0.7))
+SQL_RANK_BY_COST = os.getenv("SQL_RANK_BY_COST", "0").lower() in ("1", "true", "yes")
+
+_stats = {"calls": 0, "candidates": 0, "valid_candidates": 0, "retries": 0, "insufficient": 0, "guardrail_violations": 0}
+_stats_lock = threading.Lock()
+
+
+def _count(**increments):
+    with _stats_lock:
+        for key, value in increments.items():
+            _stats[key] += value
+
+
+def generation_stats() -> dict:
+    with _stats_lock:
+        return dict(_stats)
 
 
 def _extract_sql_from_model_response(resp: str) -> str:
@@ -40,105 +66,100 @@ def _extract_sql_from_model_response(resp: str) -> str:
 
     return stmt
 
+def _cheapest(candidates):
+    """Candidate with the fewest estimated rows examined; ones EXPLAIN rejects rank last."""
+    from cost_gate import explain
+    from replica_router import get_read_connection
+    from sql_rewriter import translate_dialect
+
+    try:
+        conn = get_read_connection()
+    except RuntimeError:
+        return candidates[0]
+    try:
+        dialect = getattr(conn, "dialect", "mysql")
+        scored = []
+        for i, sql in enumerate(candidates):
+            try:
+                target = sql if dialect == "mysql" else translate_dialect(sql, dialect)
+                rows = explain(target, conn, dialect=dialect)["rows_examined"]
+            except Exception:
+                rows = float("inf")
+            scored.append((rows, i))
+        return candidates[min(scored)[1]]
+    finally:
+        conn.close()
+
 def generate_sql(user_query: str, schema_json: dict, tokenizer=None, model=None) -> str:
     """Generate SQL for a user query.
 
-    If `tokenizer` and `model` are not provided, they will be lazily loaded via `load_llm()`.
-    This avoids heavy model loading at import time which can cause crashes on machines without suitable GPU or PyTorch setup.
+    If `tokenizer` and `model` are not provided, generation goes through `generate_prompt()`:
+    the shared inference server when INFERENCE_SOCKET is set, otherwise the lazily loaded local model.
     """
-    if tokenizer is None or model is None:
-        try:
-            tokenizer, model = load_llm()
-        except RuntimeError as e:
-            # If the failure is due to missing `accelerate` (required for device_map="auto"),
-            # retry loading on CPU to provide a friendlier fallback.
-            msg = str(e).lower()
-            if "accelerate" in msg or "torch.set_default_device" in msg:
-                tokenizer, model = load_llm(force_cpu=True)
-            else:
-                raise
-
-    messages = [
-        {"role": "system", "content": SQL_SYSTEM_PROMPT},
-        {"role": "user", "content": build_user_prompt(user_query, schema_json)}
-    ]
-
-    input_text = tokenizer.apply_chat_template(
-        messages,
-        tokenize=False,
-        add_generation_prompt=True
-    )
-
-    inputs = tokenizer(input_text, return_tensors="pt").to(model.device)
-
-    import torch
-    with torch.no_grad():
-        output = model.generate(
-            **inputs,
-            max_new_tokens=256,
-            temperature=0.1,
-            top_p=0.9
-        )
-
-    response = tokenizer.decode(
-        output[0][inputs["input_ids"].shape[-1]:],
-        skip_special_tokens=True
-    ).strip()
+    # Static segments (instructions, per-table schema, stats) are tokenized once and cached
+    prompt = build_sql_prompt(user_query, schema_json, stats=load_stats())
+    # Leave time to execute the SQL within the request deadline
+    max_new_tokens = token_budget("sql", 256, reserve_ms=EXECUTION_RESERVE_MS)
+    if not max_new_tokens:
+        raise DeadlineExceeded("sql", current_deadline().remaining_ms())
+    n = SQL_CANDIDATES
+    if n > 1:
+        if SQL_CANDIDATE_MODE == "beam":
+            strategy = {"num_beams": n, "do_sample": False}
+        else:
+            strategy = {"do_sample": True, "temperature": SQL_CANDIDATE_TEMPERATURE, "top_p": 0.95}
+        responses = generate_candidates(prompt, n, max_new_tokens=max_new_tokens, tokenizer=tokenizer, model=model,
+                                        **strategy)
+    else:
+        responses = [generate_prompt(prompt, max_new_tokens=max_new_tokens, temperature=0.1, top_p=0.9,
+                                     tokenizer=tokenizer, model=model)]
 
     # Sanitize / extract SQL from the model response (strip code fences/backticks)
-    cleaned = _extract_sql_from_model_response(response)
+    candidates = [_extract_sql_from_model_response(r) for r in responses]
+    _count(calls=1, candidates=len(candidates))
 
     # Preserve the INSUFFICIENT_INFORMATION sentinel if returned by the model
-    if response == "INSUFFICIENT_INFORMATION" or cleaned == "INSUFFICIENT_INFORMATION":
+    # (by a majority of the candidates when there are several)
+    insufficient = sum(1 for r, c in zip(responses, candidates) if "INSUFFICIENT_INFORMATION" in (r, c))
+    if insufficient * 2 > len(candidates):
+        _count(insufficient=1)
         return "INSUFFICIENT_INFORMATION"
 
     # Validate and handle guardrail violations gracefully using the cleaned SQL.
-    try:
-        validate_sql(cleaned, schema_json)
-        return cleaned
-    except ValueError as e:
-        # Attempt one retry with a stricter instruction to the model
-        correction_msg = (
-            "The previous SQL failed validation with the following error: "
-            f"{e}.\nOnly return a single valid SELECT statement that uses tables and columns from the given schema, "
-            "and avoid any forbidden keywords or non-SELECT operations. Return only the SQL query and nothing else.\n"
-            f"Schema: {schema_json} \nPrevious attempt: {cleaned}"
-        )
-
-        messages = [
-            {"role": "system", "content": SQL_SYSTEM_PROMPT},
-            {"role": "user", "content": correction_msg}
-        ]
+    valid, error = [], None
+    for candidate in dict.fromkeys(candidates):
+        try:
+            validate_sql(candidate, schema_json)
+            valid.append(candidate)
+        except ValueError as e:
+            error = error or e
+    _count(valid_candidates=len(valid))
+    if valid:
+        return _cheapest(valid) if SQL_RANK_BY_COST and len(valid) > 1 else valid[0]
+
+    cleaned = candidates[0]
+    # Attempt one retry with a stricter instruction to the model
+    # (only the tables the question needs, within the sql_retry token budget),
+    # unless the request deadline leaves no time for it
+    max_new_tokens = token_budget("sql_retry", 256, reserve_ms=EXECUTION_RESERVE_MS)
+    if not max_new_tokens:
+        skip_stage("sql_retry")
+        _count(guardrail_violations=1)
+        return f"GUARDRAIL_VIOLATION: {error} | Model attempts: original={cleaned!r}, retry skipped (deadline)"
+    _count(retries=1)
+    prompt = build_sql_retry_prompt(user_query, schema_json, str(error), cleaned)
+    candidate = generate_prompt(prompt, max_new_tokens=max_new_tokens, temperature=0.1, top_p=0.9,
+                                tokenizer=tokenizer, model=model)
+
+    candidate_clean = _extract_sql_from_model_response(candidate)
 
-        input_text = tokenizer.apply_chat_template(
-            messages,
-            tokenize=False,
-            add_generation_prompt=True
+    try:
+        validate_sql(candidate_clean, schema_json)
+        return candidate_clean
+    except ValueError as e2:
+        # Return clear guardrail error instead of raising an exception so the demo doesn't crash
+        _count(guardrail_violations=1)
+        return (
+            f"GUARDRAIL_VIOLATION: {str(e2)} | Model attempts: "
+            f"original={cleaned!r}, retry={candidate_clean!r}"
         )
-
-        inputs = tokenizer(input_text, return_tensors="pt").to(model.device)
-
-        with torch.no_grad():
-            output = model.generate(
-                **inputs,
-                max_new_tokens=256,
-                temperature=0.1,
-                top_p=0.9
-            )
-
-        candidate = tokenizer.decode(
-            output[0][inputs["input_ids"].shape[-1]:],
-            skip_special_tokens=True
-        ).strip()
-
-        candidate_clean = _extract_sql_from_model_response(candidate)
-
-        try:
-            validate_sql(candidate_clean, schema_json)
-            return candidate_clean
-        except ValueError as e2:
-            # Return clear guardrail error instead of raising an exception so the demo doesn't crash
-            return (
-                f"GUARDRAIL_VIOLATION: {str(e2)} | Model attempts: "
-                f"original={cleaned!r}, retry={candidate_clean!r}"
-            )
@@ -100,7 +100,7 @@ def validate_sql(sql: str, schema: dict):
     if m:
         clauses['order'] = m.group(1)
 
-    sql_keywords = {"ASC", "DESC", "AND", "OR", "BY", "AS", "ON", "IN", "NOT", "NULL", "IS", "LIKE", "BETWEEN"}
+    sql_keywords = {"ASC", "DESC", "AND", "OR", "BY", "AS", "ON", "IN", "NOT", "NULL", "IS", "LIKE", "BETWEEN", "HAVING"}
     # Extended list of SQL/MySQL built-in functions to avoid misclassification as columns
     sql_functions = {
         "SUM", "COUNT", "MAX", "MIN", "AVG",
@@ -122,7 +122,8 @@ def validate_sql(sql: str, schema: dict):
     # Identify tables and aliases present in FROM and JOIN clauses
     referenced_tables = []  # list of (table_name, alias_or_name)
     # FROM main tables (handle comma-separated lists)
-    m = re.search(r"FROM\s+([^\n]*)", sql, flags=re.IGNORECASE)
+    # (up to the next clause, so commas in GROUP BY / ORDER BY are not read as table lists)
+    m = re.search(r"FROM\s+(.*?)(?:\bWHERE\b|\bGROUP\s+BY\b|\bHAVING\b|\bORDER\s+BY\b|\bLIMIT\b|$)", sql, flags=re.IGNORECASE | re.S)
     if m:
         from_part = m.group(1)
         # split on commas for simple multiple-table FROM lists
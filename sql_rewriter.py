@@ -0,0 +1,460 @@
+# Token-level SQL rewrite stage (runs once, right before execution)
+# - normalizes the statement (comments, trailing semicolons, whitespace)
+# - drops ORDER BY inside subqueries that have no LIMIT (it cannot change the result)
+# - puts the MAX_EXECUTION_TIME hint and an effective LIMIT on the top-level SELECT
+#
+# Works on the sqlparse token stream with parenthesis-depth tracking, so
+# "LIMIT" inside string literals or subqueries is never mistaken for the
+# statement's own LIMIT. Falls back to the legacy derived-table wrapper when
+# sqlparse is not installed.
+
+import re
+
+try:
+    import sqlparse
+    from sqlparse import tokens as T
+    _HAS_SQLPARSE = True
+except Exception:
+    sqlparse = None
+    T = None
+    _HAS_SQLPARSE = False
+
+
+def _leaves(sql: str):
+    """Flattened (ttype, value) leaf tokens of the first statement."""
+    parsed = sqlparse.parse(sql)
+    if not parsed:
+        return []
+    return [(tok.ttype, tok.value) for tok in parsed[0].flatten()]
+
+
+def _is_kw(tok, word: str) -> bool:
+    ttype, value = tok
+    return ttype is not None and ttype in T.Keyword and " ".join(value.upper().split()) == word
+
+
+def _is_punct(tok, char: str) -> bool:
+    return tok[0] is not None and tok[0] in T.Punctuation and tok[1] == char
+
+
+def _is_space(tok) -> bool:
+    return tok[0] is not None and (tok[0] in T.Whitespace or tok[0] in T.Newline)
+
+
+def _join(leaves) -> str:
+    return "".join(v for _, v in leaves)
+
+
+def _normalize_leaves(leaves):
+    """Drop comments/hints and trailing semicolons, collapse whitespace runs."""
+    out = []
+    for tok in leaves:
+        ttype = tok[0]
+        if ttype is not None and ttype in T.Comment:
+            tok = (T.Whitespace, " ")
+        if _is_space(tok):
+            if out and _is_space(out[-1]):
+                continue
+            tok = (T.Whitespace, " ")
+        out.append(tok)
+    while out and (_is_space(out[-1]) or _is_punct(out[-1], ";")):
+        out.pop()
+    while out and _is_space(out[0]):
+        out.pop(0)
+    return out
+
+
+def _scan(leaves):
+    """Find top-level SELECT/LIMIT positions and removable subquery ORDER BYs.
+
+    Returns (select_idx, limit_idx, removals) where removals is a list of
+    (start, stop) index ranges to delete.
+    """
+    select_idx = None
+    limit_idx = None
+    removals = []
+    # Each scope: [is_select_subquery, order_by_idx, has_limit]
+    stack = []
+    expect_first = False
+
+    for i, tok in enumerate(leaves):
+        if _is_space(tok):
+            continue
+
+        if expect_first:
+            stack[-1][0] = tok[0] is not None and tok[0] in T.DML and tok[1].upper() == "SELECT"
+            expect_first = False
+
+        if _is_punct(tok, "("):
+            stack.append([False, None, False])
+            expect_first = True
+            continue
+
+        if _is_punct(tok, ")"):
+            if stack:
+                is_select, order_idx, has_limit = stack.pop()
+                if is_select and order_idx is not None and not has_limit:
+                    removals.append((order_idx, i))
+            continue
+
+        if not stack:
+            if select_idx is None and tok[0] is not None and tok[0] in T.DML and tok[1].upper() == "SELECT":
+                select_idx = i
+            elif _is_kw(tok, "LIMIT"):
+                limit_idx = i
+        else:
+            if _is_kw(tok, "ORDER BY") and stack[-1][0]:
+                stack[-1][1] = i
+            elif _is_kw(tok, "LIMIT"):
+                stack[-1][2] = True
+
+    return select_idx, limit_idx, removals
+
+
+def _remove_ranges(leaves, removals):
+    if not removals:
+        return leaves
+    drop = set()
+    for start, stop in removals:
+        # Take the whitespace before the clause with it
+        while start > 0 and _is_space(leaves[start - 1]):
+            start -= 1
+        drop.update(range(start, stop))
+    return [tok for i, tok in enumerate(leaves) if i not in drop]
+
+
+def _limit_count(leaves, limit_idx):
+    """Return (count_idx, count) for the top-level LIMIT, or (None, None) if non-literal.
+
+    Handles `LIMIT n`, `LIMIT offset, n` and `LIMIT n OFFSET m`.
+    """
+    numbers = []
+    for j in range(limit_idx + 1, len(leaves)):
+        tok = leaves[j]
+        if _is_space(tok):
+            continue
+        if tok[0] is not None and tok[0] in T.Literal.Number.Integer:
+            numbers.append(j)
+            continue
+        if _is_punct(tok, ","):
+            continue
+        break
+    if not numbers:
+        return None, None
+    count_idx = numbers[-1] if len(numbers) == 2 else numbers[0]
+    return count_idx, int(leaves[count_idx][1])
+
+
+def _with_limit(leaves, max_rows, cap):
+    _, limit_idx, _ = _scan(leaves)
+    if limit_idx is None:
+        return leaves + [(T.Whitespace, " "), (T.Keyword, "LIMIT"), (T.Whitespace, " "),
+                         (T.Literal.Number.Integer, str(max_rows))]
+    if cap:
+        count_idx, count = _limit_count(leaves, limit_idx)
+        if count_idx is not None and count > max_rows:
+            leaves = list(leaves)
+            leaves[count_idx] = (T.Literal.Number.Integer, str(max_rows))
+    return leaves
+
+
+def normalize(sql: str) -> str:
+    """Strip comments, hints, trailing semicolons and redundant whitespace."""
+    if not _HAS_SQLPARSE:
+        return sql.strip().rstrip(";").strip()
+    return _join(_normalize_leaves(_leaves(sql)))
+
+
+def has_top_level_limit(sql: str) -> bool:
+    if not _HAS_SQLPARSE:
+        return bool(re.search(r"\bLIMIT\b", sql, flags=re.IGNORECASE))
+    _, limit_idx, _ = _scan(_leaves(sql))
+    return limit_idx is not None
+
+
+def top_level_limit(sql: str):
+    """Row count of the top-level LIMIT, or None when there is none (or it is not a literal)."""
+    if not _HAS_SQLPARSE:
+        m = re.search(r"\bLIMIT\s+(\d+)(?:\s*,\s*(\d+))?(?:\s+OFFSET\s+\d+)?\s*;?\s*$", sql, flags=re.IGNORECASE)
+        return int(m.group(2) or m.group(1)) if m else None
+    leaves = _leaves(sql)
+    _, limit_idx, _ = _scan(leaves)
+    if limit_idx is None:
+        return None
+    return _limit_count(leaves, limit_idx)[1]
+
+
+def ensure_limit(sql: str, default: int) -> str:
+    """Append `LIMIT default` unless the top-level SELECT already has a LIMIT."""
+    if not _HAS_SQLPARSE:
+        if has_top_level_limit(sql):
+            return sql
+        return sql.rstrip().rstrip(";") + f" LIMIT {default}"
+    return _join(_with_limit(_normalize_leaves(_leaves(sql)), default, cap=False))
+
+
+def cap_limit(sql: str, max_rows: int) -> str:
+    """Make the top-level LIMIT at most `max_rows` (adding one if missing)."""
+    if not _HAS_SQLPARSE:
+        return ensure_limit(sql, max_rows)
+    return _join(_with_limit(_normalize_leaves(_leaves(sql)), max_rows, cap=True))
+
+
+def remove_subquery_order_by(sql: str) -> str:
+    """Drop ORDER BY clauses inside subqueries that have no LIMIT of their own."""
+    if not _HAS_SQLPARSE:
+        return sql
+    leaves = _normalize_leaves(_leaves(sql))
+    _, _, removals = _scan(leaves)
+    return _join(_normalize_leaves(_remove_ranges(leaves, removals)))
+
+
+def rewrite_for_execution(sql: str, max_rows: int, timeout_ms: int = None, dialect: str = "mysql") -> str:
+    """Produce the statement actually sent to the database.
+
+    MySQL gets `SELECT /*+ MAX_EXECUTION_TIME(n) */ ...` on the top-level SELECT;
+    every dialect gets a top-level LIMIT capped at `max_rows`.
+    """
+    if not _HAS_SQLPARSE:
+        # Legacy behaviour: wrap in a derived table
+        hint = f"/*+ MAX_EXECUTION_TIME({timeout_ms}) */ " if timeout_ms and dialect == "mysql" else ""
+        return f"SELECT {hint}* FROM ({normalize(sql)}) AS safe_query LIMIT {max_rows}"
+
+    leaves = _normalize_leaves(_leaves(sql))
+    _, _, removals = _scan(leaves)
+    leaves = _normalize_leaves(_remove_ranges(leaves, removals))
+    leaves = _with_limit(leaves, max_rows, cap=True)
+
+    if timeout_ms and dialect == "mysql":
+        select_idx, _, _ = _scan(leaves)
+        if select_idx is not None:
+            hint = [(T.Whitespace, " "), (T.Comment.Multiline.Hint, f"/*+ MAX_EXECUTION_TIME({int(timeout_ms)}) */")]
+            leaves = leaves[:select_idx + 1] + hint + leaves[select_idx + 1:]
+
+    return _join(leaves)
+
+
+def convert_placeholders(sql: str, placeholder: str = "?") -> str:
+    """Rewrite %s placeholders (mysql.connector style) to `placeholder`, skipping string literals."""
+    if not _HAS_SQLPARSE:
+        return sql.replace("%s", placeholder)
+    return "".join(
+        placeholder if ttype is not None and ttype in T.Name.Placeholder and value == "%s" else value
+        for ttype, value in _leaves(sql)
+    )
+
+
+# -------------------------------
+# Clause-level helpers (pagination, rollup matching, refinements)
+# -------------------------------
+CLAUSE_ORDER = ("SELECT", "FROM", "WHERE", "GROUP BY", "HAVING", "ORDER BY", "LIMIT")
+_SET_OPERATORS = {"UNION", "UNION ALL", "UNION DISTINCT", "INTERSECT", "EXCEPT", "MINUS"}
+
+
+def split_clauses(sql: str):
+    """Split a single SELECT into its top-level clauses.
+
+    Returns {"SELECT": "...", "FROM": "...", ...} holding only the clauses
+    present, or None for statements this cannot represent (set operations,
+    CTEs, non-SELECT) or when sqlparse is unavailable.
+    """
+    if not _HAS_SQLPARSE:
+        return None
+
+    leaves = _normalize_leaves(_leaves(sql))
+    clauses = {}
+    current = None
+    depth = 0
+    for tok in leaves:
+        if _is_punct(tok, "("):
+            depth += 1
+        elif _is_punct(tok, ")"):
+            depth -= 1
+        elif depth == 0:
+            ttype = tok[0]
+            word = " ".join(tok[1].upper().split())
+            if ttype is not None and ttype in T.Keyword.CTE:
+                return None
+            if ttype is not None and ttype in T.DML:
+                if word != "SELECT" or "SELECT" in clauses:
+                    return None
+                current = "SELECT"
+                clauses[current] = []
+                continue
+            if ttype is not None and ttype in T.Keyword:
+                if word in _SET_OPERATORS:
+                    return None
+                if word in CLAUSE_ORDER:
+                    if word in clauses:
+                        return None
+                    current = word
+                    clauses[current] = []
+                    continue
+        if current is None:
+            if _is_space(tok):
+                continue
+            return None
+        clauses[current].append(tok)
+
+    if "SELECT" not in clauses:
+        return None
+    return {name: _join(toks).strip() for name, toks in clauses.items()}
+
+
+def join_clauses(clauses: dict) -> str:
+    """Inverse of split_clauses."""
+    return " ".join(f"{name} {clauses[name]}" for name in CLAUSE_ORDER if clauses.get(name))
+
+
+def split_top_level_commas(text: str):
+    """Split a select list / ORDER BY list on commas outside parentheses."""
+    if not _HAS_SQLPARSE:
+        return [part.strip() for part in text.split(",") if part.strip()]
+
+    parts, current, depth = [], [], 0
+    for tok in _leaves(f"SELECT {text}")[1:]:
+        if _is_punct(tok, "("):
+            depth += 1
+        elif _is_punct(tok, ")"):
+            depth -= 1
+        elif depth == 0 and _is_punct(tok, ","):
+            parts.append(_join(current).strip())
+            current = []
+            continue
+        current.append(tok)
+    if current:
+        parts.append(_join(current).strip())
+    return [p for p in parts if p]
+
+
+# -------------------------------
+# Dialect translation (MySQL -> embedded engines)
+# -------------------------------
+# The prompt mandates MySQL date functions (DATE_SUB, CURDATE); DuckDB and
+# SQLite spell them differently (DuckDB even has a date_sub() with different
+# semantics), so generated SQL is translated before running on a snapshot.
+
+_TRANSLATED_CALL = re.compile(r"(DATE_SUB|DATE_ADD|CURDATE|NOW|YEAR|MONTH)\s*\(", re.IGNORECASE)
+# MySQL unit -> (normalized unit, multiplier)
+_INTERVAL_UNITS = {
+    "DAY": ("DAY", 1), "WEEK": ("DAY", 7), "MONTH": ("MONTH", 1), "QUARTER": ("MONTH", 3),
+    "YEAR": ("YEAR", 1), "HOUR": ("HOUR", 1), "MINUTE": ("MINUTE", 1), "SECOND": ("SECOND", 1),
+}
+_SQLITE_MODIFIERS = {"DAY": "days", "MONTH": "months", "YEAR": "years", "HOUR": "hours", "MINUTE": "minutes", "SECOND": "seconds"}
+
+
+def _skip_quoted(sql: str, i: int) -> int:
+    """Index just past the quoted literal/identifier starting at sql[i]."""
+    quote = sql[i]
+    i += 1
+    while i < len(sql):
+        if sql[i] == "\\" and quote != "`":
+            i += 2
+            continue
+        if sql[i] == quote:
+            if i + 1 < len(sql) and sql[i + 1] == quote:
+                i += 2
+                continue
+            return i + 1
+        i += 1
+    return i
+
+
+def _call_args(sql: str, open_idx: int):
+    """Top-level arguments of the call whose "(" is at open_idx, plus the index of its ")"."""
+    depth, start, args = 0, open_idx + 1, []
+    i = open_idx
+    while i < len(sql):
+        ch = sql[i]
+        if ch in "'\"`":
+            i = _skip_quoted(sql, i)
+            continue
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            if depth == 0:
+                args.append(sql[start:i])
+                return [a.strip() for a in args if a.strip()], i
+        elif ch == "," and depth == 1:
+            args.append(sql[start:i])
+            start = i + 1
+        i += 1
+    raise ValueError("Unbalanced parentheses in SQL")
+
+
+def _translate_interval(name: str, args, dialect: str) -> str:
+    if len(args) != 2:
+        raise ValueError(f"{name} expects 2 arguments")
+    base, interval = args
+    m = re.match(r"INTERVAL\s+(.+?)\s+([A-Za-z]+)$", interval, flags=re.IGNORECASE | re.DOTALL)
+    if not m or m.group(2).upper() not in _INTERVAL_UNITS:
+        raise ValueError(f"Unsupported interval in {name}: {interval}")
+    amount = m.group(1).strip().strip("'\"")
+    unit, mult = _INTERVAL_UNITS[m.group(2).upper()]
+    sign = "-" if name == "DATE_SUB" else "+"
+    literal = amount.isdigit()
+    scaled = str(int(amount) * mult) if literal else (f"(({amount}) * {mult})" if mult != 1 else f"({amount})")
+
+    if dialect == "duckdb":
+        expr = f"({base} {sign} INTERVAL {scaled} {unit})"
+        # MySQL keeps DATE for date arithmetic on CURDATE(); DuckDB would widen to TIMESTAMP
+        if base == "CURRENT_DATE" and unit in ("DAY", "MONTH", "YEAR"):
+            expr = f"CAST({expr} AS DATE)"
+        return expr
+
+    func = "date" if unit in ("DAY", "MONTH", "YEAR") else "datetime"
+    modifier = f"'{sign}{scaled} {_SQLITE_MODIFIERS[unit]}'" if literal else f"'{sign}' || {scaled} || ' {_SQLITE_MODIFIERS[unit]}'"
+    return f"{func}({base}, {modifier})"
+
+
+def _translate_call(name: str, args, dialect: str) -> str:
+    if name == "CURDATE":
+        return "CURRENT_DATE" if dialect == "duckdb" else "date('now')"
+    if name == "NOW":
+        return "CURRENT_TIMESTAMP" if dialect == "duckdb" else "datetime('now')"
+    if name in ("YEAR", "MONTH"):
+        if dialect == "duckdb":
+            return f"{name.lower()}({args[0]})"
+        return f"CAST(strftime('{'%Y' if name == 'YEAR' else '%m'}', {args[0]}) AS INTEGER)"
+    return _translate_interval(name, args, dialect)
+
+
+def translate_dialect(sql: str, dialect: str) -> str:
+    """Translate MySQL-specific syntax in `sql` for "duckdb" or "sqlite".
+
+    Handles DATE_SUB / DATE_ADD with INTERVAL, CURDATE(), NOW(), YEAR(), MONTH(),
+    backtick identifiers and double-quoted string literals. Raises ValueError
+    for constructs it cannot translate.
+    """
+    if dialect == "mysql":
+        return sql
+
+    out, i = [], 0
+    while i < len(sql):
+        ch = sql[i]
+        if ch in "'\"":
+            end = _skip_quoted(sql, i)
+            literal = sql[i:end]
+            if ch == '"':
+                # MySQL treats "..." as a string; DuckDB/SQLite as an identifier
+                literal = "'" + literal[1:-1].replace('\\"', '"').replace("'", "''") + "'"
+            out.append(literal)
+            i = end
+            continue
+        if ch == "`":
+            end = _skip_quoted(sql, i)
+            out.append('"' + sql[i + 1:end - 1] + '"')
+            i = end
+            continue
+        prev = sql[i - 1] if i else " "
+        m = None if (prev.isalnum() or prev in "_.") else _TRANSLATED_CALL.match(sql, i)
+        if m:
+            args, close_idx = _call_args(sql, m.end() - 1)
+            args = [translate_dialect(a, dialect) for a in args]
+            out.append(_translate_call(m.group(1).upper(), args, dialect))
+            i = close_idx + 1
+            continue
+        out.append(ch)
+        i += 1
+    return "".join(out)
@@ -0,0 +1,528 @@
+# Parameterized SQL templates learned from validated (question, SQL) pairs
+# Many questions share one shape and differ only in metric, grouping column,
+# time window, filter value or threshold. learn() turns a validated pair into
+# a template by locating those slots in both the question and the SQL; match()
+# maps a new question onto a template with the same shape, fills the slots
+# and runs the SQL through validate_sql (once per template and column choice),
+# so the model is only called when nothing matches confidently.
+#
+# Sources: the golden pairs in test_cases.GOLDEN_SQL and the query log that
+# the pipeline appends every validated, successfully executed model SQL to.
+#
+# Usage:
+# python sql_templates.py --learn          # rebuild sql_templates.json
+# python sql_templates.py --match "Show number of orders per city in the last 3 months"
+
+import difflib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+TEMPLATE_LIBRARY_PATH = os.getenv("TEMPLATE_LIBRARY_PATH", "sql_templates.json")
+QUERY_LOG_PATH = os.getenv("QUERY_LOG_PATH", "query_log.jsonl")
+TEMPLATE_ROUTING = os.getenv("TEMPLATE_ROUTING", "1").lower() in ("1", "true", "yes")
+TEMPLATE_MIN_SIMILARITY = float(os.getenv("TEMPLATE_MIN_SIMILARITY", 0.9))
+LIBRARY_VERSION = 1
+VALIDATED_CACHE_SIZE = 1024
+
+# Metric phrases -> (aggregate, column, output alias); longest phrases are matched first
+METRIC_VOCABULARY = {
+    "revenue": {"phrases": ["total revenue", "revenue", "total sales", "sales", "total amount"],
+                "agg": "SUM", "column": "amount", "alias": "total_revenue"},
+    "order_count": {"phrases": ["number of orders", "order count", "how many orders", "count of orders"],
+                    "agg": "COUNT", "column": "*", "alias": "order_count"},
+    "avg_order_value": {"phrases": ["average order value", "average amount", "avg order value"],
+                        "agg": "AVG", "column": "amount", "alias": "avg_order_value"},
+    "return_rate": {"phrases": ["return rate"], "agg": "AVG", "column": "returned", "alias": "return_rate"},
+    "returns": {"phrases": ["number of returns", "returns"], "agg": "SUM", "column": "returned", "alias": "total_returns"},
+}
+WINDOW_UNITS = {"day": "DAY", "week": "WEEK", "month": "MONTH", "quarter": "QUARTER", "year": "YEAR"}
+
+# Words that change a question's meaning without changing its shape: they must agree exactly
+CRITICAL_WORDS = {
+    "not", "no", "without", "excluding", "except", "above", "below", "over", "under", "more", "less",
+    "least", "most", "top", "bottom", "highest", "lowest", "before", "after", "between", "each", "per",
+    "by", "average", "total", "distinct", "unique", "than", "equal", "first", "since",
+}
+
+_WINDOW_RE = re.compile(r"\b(?:last|past|previous)\s+(?:(\d+)\s+)?(day|week|month|quarter|year)s?\b")
+_DIM_RE = re.compile(r"\b(?:per|by|each|every)\s+([a-z_]+(?:\s+[a-z_]+)?)")
+_NUMBER_RE = re.compile(r"(?<![\w.])(\d+(?:\.\d+)?)(\s*%|\s+percent)?(?![\w.])")
+_SQL_NUMBER_RE = re.compile(r"(?<![\w.'])(\d+(?:\.\d+)?)(?![\w.'])")
+_TABLE_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?", re.IGNORECASE)
+_MARKER_RE = re.compile(r"@@(\d+)(?::(\w+))?@@")
+_NOT_ALIASES = {"ON", "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "GROUP", "ORDER", "LIMIT", "HAVING", "USING"}
+
+
+# -------------------------------
+# Question analysis
+# -------------------------------
+def _dimension_columns(schema: dict):
+    """Spoken name -> column for every non-key column (groupable dimensions)."""
+    names = {}
+    for info in schema.values():
+        keys = set(info.get("primary_key", []))
+        keys |= {fk.split("→")[0].strip() for fk in info.get("foreign_keys", [])}
+        for col in info.get("columns", {}):
+            if col in keys:
+                continue
+            spoken = col.replace("_", " ")
+            names[spoken] = col
+            names[spoken[:-1] + "ies" if spoken.endswith("y") else spoken + "s"] = col
+    return names
+
+
+def _known_values(stats):
+    """Lowercased known value -> (column, value) from the schema_stats sidecar."""
+    values = {}
+    for info in (stats or {}).get("tables", {}).values():
+        for col, cstats in info.get("columns", {}).items():
+            for value, _ in cstats.get("top_values", []):
+                if isinstance(value, str) and len(value) > 1:
+                    values[value.lower()] = (col, value)
+    return values
+
+
+def analyze_question(question: str, schema: dict, stats=None):
+    """Find slot spans in a question.
+
+    Returns (text, spans) with text lowercased and spans a list of
+    (start, end, slot) in question order.
+    """
+    text = " ".join(question.lower().split())
+    spans = []
+
+    def free(start, end):
+        return all(end <= s or start >= e for s, e, _ in spans)
+
+    for m in _WINDOW_RE.finditer(text):
+        spans.append((m.start(), m.end(), {"type": "window", "n": int(m.group(1) or 1), "unit": WINDOW_UNITS[m.group(2)]}))
+
+    phrases = sorted(((p, key) for key, spec in METRIC_VOCABULARY.items() for p in spec["phrases"]), key=lambda x: -len(x[0]))
+    for phrase, key in phrases:
+        for m in re.finditer(rf"\b{re.escape(phrase)}\b", text):
+            if free(m.start(), m.end()):
+                spans.append((m.start(), m.end(), {"type": "metric", "key": key}))
+
+    dims = _dimension_columns(schema)
+    for m in _DIM_RE.finditer(text):
+        words = m.group(1).split()
+        for n in (2, 1):
+            spoken = " ".join(words[:n])
+            if len(words) >= n and spoken in dims:
+                start = m.start(1)
+                if free(start, start + len(spoken)):
+                    spans.append((start, start + len(spoken), {"type": "dim", "column": dims[spoken]}))
+                break
+
+    for lowered, (col, value) in _known_values(stats).items():
+        for m in re.finditer(rf"\b{re.escape(lowered)}\b", text):
+            if free(m.start(), m.end()):
+                spans.append((m.start(), m.end(), {"type": "value", "column": col, "value": value}))
+
+    for m in _NUMBER_RE.finditer(text):
+        if free(m.start(), m.end()):
+            spans.append((m.start(), m.end(), {"type": "number", "value": float(m.group(1)), "percent": bool(m.group(2))}))
+
+    spans.sort(key=lambda s: s[0])
+    return text, spans
+
+
+def _pattern(text: str, spans):
+    """Question tokens with slot spans replaced by <type>."""
+    out, pos = [], 0
+    for start, end, slot in spans:
+        out.append(text[pos:start])
+        out.append(f" <{slot['type']}> ")
+        pos = end
+    out.append(text[pos:])
+    return re.findall(r"<\w+>|[a-z0-9_%']+", "".join(out))
+
+
+def _signature(pattern):
+    slots = tuple(t for t in pattern if t.startswith("<"))
+    critical = tuple(sorted(t for t in pattern if t in CRITICAL_WORDS))
+    return json.dumps([slots, critical])
+
+
+def _literal_words(template_sql: str) -> set:
+    """Words of the string literals a template keeps verbatim (not slots).
+
+    Each must appear in a question the template answers: a filter value the
+    library does not know ('Mumbai' without a stats sidecar) is pinned to the
+    learned question instead of being a near miss for the fuzzy match.
+    """
+    words = set()
+    for literal in re.findall(r"'(?:[^'\\]|\\.|'')*'", template_sql):
+        words.update(re.findall(r"[a-z0-9_%]+", literal[1:-1].lower()))
+    return words
+
+
+# -------------------------------
+# Locating slots in SQL
+# -------------------------------
+def _mask_strings(sql: str) -> str:
+    """Same length as `sql` with string literal contents blanked out."""
+    return re.sub(r"'(?:[^'\\]|\\.|'')*'", lambda m: "'" + " " * (len(m.group(0)) - 2) + "'", sql)
+
+
+def _table_aliases(sql: str):
+    aliases = {}
+    for m in _TABLE_RE.finditer(sql):
+        alias = m.group(2)
+        if not alias or alias.upper() in _NOT_ALIASES:
+            alias = m.group(1)
+        aliases.setdefault(m.group(1), alias)
+    return aliases
+
+
+def _metric_regex(spec: dict):
+    if spec["column"] == "*":
+        return re.compile(r"\bCOUNT\s*\(\s*(?:\*|(?:(\w+)\.)?order_id)\s*\)", re.IGNORECASE)
+    return re.compile(rf"\b{spec['agg']}\s*\(\s*(?:(\w+)\.)?{spec['column']}\s*\)", re.IGNORECASE)
+
+
+def _locate(slot: dict, sql: str, masked: str):
+    """Spans [(start, end, variant)] of `slot` in the SQL, or None if it cannot be placed."""
+    kind = slot["type"]
+    if kind == "window":
+        found = [(m.start(), m.end(), None) for m in
+                 re.finditer(rf"\bINTERVAL\s+'?{slot['n']}'?\s+{slot['unit']}S?\b", masked, re.IGNORECASE)]
+        return found or None
+
+    if kind == "metric":
+        spec = METRIC_VOCABULARY[slot["key"]]
+        found = []
+        for m in _metric_regex(spec).finditer(masked):
+            found.append((m.start(), m.end(), None))
+            alias = re.match(r"\s+AS\s+(\w+)", masked[m.end():], re.IGNORECASE)
+            if alias:
+                name = alias.group(1)
+                found += [(a.start(), a.end(), "alias") for a in re.finditer(rf"(?<![\w.]){re.escape(name)}\b", masked)]
+        return sorted(set(found)) or None
+
+    if kind == "dim":
+        col = slot["column"]
+        found, qualifiers = [], set()
+        for m in re.finditer(rf"(?<![\w.])(?:(\w+)\.)?{col}\b", masked):
+            qualifiers.add(m.group(1))
+            found.append((m.start(), m.end(), None if m.group(1) else "bare"))
+        if len(qualifiers - {None}) > 1:
+            return None   # the same column from two tables: not a single grouping slot
+        return found or None
+
+    if kind == "value":
+        quoted = "'" + slot["value"].replace("'", "''") + "'"
+        found = [(m.start(), m.end(), None) for m in re.finditer(re.escape(quoted), sql, re.IGNORECASE)]
+        return found or None
+
+    if kind == "number":
+        targets = {slot["value"]: "plain"}
+        if slot["percent"]:
+            targets[round(slot["value"] / 100, 10)] = "fraction"
+        found = [(m.start(), m.end(), targets[float(m.group(1))]) for m in _SQL_NUMBER_RE.finditer(masked)
+                 if float(m.group(1)) in targets]
+        # A threshold has to be unambiguous: exactly one literal
+        return found if len(found) == 1 else None
+    return None
+
+
+def learn_pair(question: str, sql: str, schema: dict, stats=None):
+    """Template for a validated pair, or None when no slot could be placed."""
+    from sql_guardrails import validate_sql
+
+    validate_sql(sql, schema)
+    text, spans = analyze_question(question, schema, stats)
+    masked = _mask_strings(sql)
+
+    kept_spans, slots, edits = [], [], []
+    taken = []
+    for start, end, slot in spans:
+        found = _locate(slot, sql, masked)
+        if not found or any(not (e <= s2 or s >= e2) for s, e, _ in found for s2, e2 in taken):
+            continue   # stays literal text in the pattern
+        index = len(slots)
+        slots.append(slot)
+        kept_spans.append((start, end, slot))
+        taken += [(s, e) for s, e, _ in found]
+        for s, e, variant in found:
+            if slot["type"] == "dim" and variant != "bare":
+                variant = None
+            edits.append((s, e, f"@@{index}:{variant}@@" if variant else f"@@{index}@@"))
+        if slot["type"] == "metric":
+            slot["qualifier"] = _metric_regex(METRIC_VOCABULARY[slot["key"]]).search(masked).group(1)
+        elif slot["type"] == "dim":
+            qualified = re.search(rf"(\w+)\.{slot['column']}\b", masked)
+            slot["qualifier"] = qualified.group(1) if qualified else None
+
+    if not slots:
+        return None
+    template_sql = sql
+    for s, e, marker in sorted(edits, reverse=True):
+        template_sql = template_sql[:s] + marker + template_sql[e:]
+
+    pattern = _pattern(text, kept_spans)
+    # A literal the question never mentions cannot be carried over to another question
+    if not _literal_words(template_sql) <= set(pattern):
+        return None
+    return {
+        "pattern": pattern,
+        "signature": _signature(pattern),
+        "slots": [{k: v for k, v in slot.items() if k in ("type", "qualifier", "column")} for slot in slots],
+        "sql": template_sql,
+        "aliases": _table_aliases(sql),
+        "example": question,
+        "count": 1,
+    }
+
+
+# -------------------------------
+# Filling templates
+# -------------------------------
+def _qualifier_for(column: str, template: dict, schema: dict, preferred=None):
+    """Alias of a template table that has `column` (None when no such table)."""
+    tables = [t for t in template["aliases"] if column in schema.get(t, {}).get("columns", {})]
+    if not tables:
+        return None
+    for table in tables:
+        if template["aliases"][table] == preferred:
+            return preferred
+    return template["aliases"][tables[0]]
+
+
+def _render(template_slot: dict, slot: dict, variant, template: dict, schema: dict):
+    kind = slot["type"]
+    if kind == "window":
+        return f"INTERVAL {slot['n']} {slot['unit']}"
+    if kind == "metric":
+        spec = METRIC_VOCABULARY[slot["key"]]
+        if variant == "alias":
+            return spec["alias"]
+        if spec["column"] == "*":
+            return "COUNT(*)"
+        qualifier = _qualifier_for(spec["column"], template, schema, template_slot.get("qualifier"))
+        if qualifier is None:
+            raise ValueError(f"No table in the template has {spec['column']}")
+        return f"{spec['agg']}({qualifier}.{spec['column']})"
+    if kind == "dim":
+        if variant == "bare":
+            return slot["column"]
+        # Prefer the table the learned column came from when it has the new one too
+        qualifier = _qualifier_for(slot["column"], template, schema, template_slot.get("qualifier"))
+        if qualifier is None:
+            raise ValueError(f"No table in the template has {slot['column']}")
+        return f"{qualifier}.{slot['column']}"
+    if kind == "value":
+        if slot["column"] != template_slot["column"]:
+            raise ValueError("Filter value belongs to another column")
+        return "'" + slot["value"].replace("'", "''") + "'"
+    if kind == "number":
+        value = slot["value"] / 100 if variant == "fraction" else slot["value"]
+        return f"{value:g}"
+    raise ValueError(f"Unknown slot type {kind!r}")
+
+
+def fill(template: dict, slots, schema: dict) -> str:
+    def replace(m):
+        index = int(m.group(1))
+        return _render(template["slots"][index], slots[index], m.group(2), template, schema)
+    return _MARKER_RE.sub(replace, template["sql"])
+
+
+# -------------------------------
+# Library
+# -------------------------------
+class TemplateLibrary:
+    def __init__(self, templates=None):
+        self._lock = threading.Lock()
+        self._by_signature = {}
+        self.stats = {"matches": 0, "misses": 0, "rejected_fills": 0, "match_us_total": 0.0}
+        # Fills already validated, keyed by template and the slots that change columns;
+        # windows, thresholds and known filter values only change literals
+        self._validated = OrderedDict()
+        for template in templates or []:
+            self._add(template)
+
+    def _add(self, template: dict):
+        bucket = self._by_signature.setdefault(template["signature"], [])
+        for existing in bucket:
+            if existing["pattern"] == template["pattern"] and existing["sql"] == template["sql"]:
+                existing["count"] += template.get("count", 1)
+                return existing
+        bucket.append(template)
+        return template
+
+    @property
+    def templates(self):
+        with self._lock:
+            return [t for bucket in self._by_signature.values() for t in bucket]
+
+    def learn(self, question: str, sql: str, schema: dict, stats=None):
+        try:
+            template = learn_pair(question, sql, schema, stats)
+        except ValueError:
+            return None
+        if template is None:
+            return None
+        with self._lock:
+            return self._add(template)
+
+    def match(self, question: str, schema: dict, stats=None):
+        """{"sql", "similarity", "example", "slots"} for the best confident match, or None."""
+        from sql_guardrails import validate_sql
+
+        started = time.perf_counter()
+        text, spans = analyze_question(question, schema, stats)
+        pattern = _pattern(text, spans)
+        with self._lock:
+            candidates = list(self._by_signature.get(_signature(pattern), []))
+
+        # Verbatim literals must be asked for by name, not merely resemble the question
+        words = set(pattern)
+        candidates = [t for t in candidates if _literal_words(t["sql"]) <= words]
+        scored = sorted(
+            ((difflib.SequenceMatcher(None, pattern, t["pattern"], autojunk=False).ratio(), t["count"], i, t)
+             for i, t in enumerate(candidates)),
+            reverse=True,
+        )
+        slots = [slot for _, _, slot in spans]
+        result = None
+        for similarity, _, _, template in scored:
+            if similarity < TEMPLATE_MIN_SIMILARITY:
+                break
+            structure = (template["sql"], tuple((slot["type"], slot.get("key"), slot.get("column")) for slot in slots))
+            try:
+                sql = fill(template, slots, schema)
+                if structure not in self._validated:
+                    validate_sql(sql, schema)
+            except ValueError:
+                with self._lock:
+                    self.stats["rejected_fills"] += 1
+                continue
+            with self._lock:
+                self._validated[structure] = True
+                self._validated.move_to_end(structure)
+                while len(self._validated) > VALIDATED_CACHE_SIZE:
+                    self._validated.popitem(last=False)
+            result = {"sql": sql, "similarity": round(similarity, 3), "example": template["example"], "slots": slots}
+            break
+
+        with self._lock:
+            self.stats["matches" if result else "misses"] += 1
+            self.stats["match_us_total"] += (time.perf_counter() - started) * 1e6
+        return result
+
+    def save(self, path: str = TEMPLATE_LIBRARY_PATH):
+        from extract_schema import write_json_atomic
+
+        write_json_atomic(path, {"version": LIBRARY_VERSION, "templates": self.templates})
+
+    @classmethod
+    def load(cls, path: str = TEMPLATE_LIBRARY_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        if data.get("version") != LIBRARY_VERSION:
+            raise ValueError(f"Unsupported template library version in {path}")
+        return cls(data["templates"])
+
+
+def read_query_log(path: str = QUERY_LOG_PATH):
+    """(question, sql) pairs from the query log; unreadable lines are skipped."""
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    yield entry["question"], entry["sql"]
+                except (ValueError, KeyError):
+                    continue
+    except OSError:
+        return
+
+
+def build_library(schema: dict, stats=None, log_path: str = QUERY_LOG_PATH) -> TemplateLibrary:
+    from test_cases import GOLDEN_SQL
+
+    library = TemplateLibrary()
+    for case in GOLDEN_SQL:
+        library.learn(case["question"], case["sql"], schema, stats)
+    for question, sql in read_query_log(log_path):
+        library.learn(question, sql, schema, stats)
+    return library
+
+
+_library = None
+_library_lock = threading.Lock()
+_log_lock = threading.Lock()
+
+
+def get_library(schema: dict) -> TemplateLibrary:
+    """The saved library, or one learned from the golden set and query log."""
+    global _library
+    if _library is None:
+        with _library_lock:
+            if _library is None:
+                try:
+                    _library = TemplateLibrary.load()
+                except (OSError, ValueError):
+                    from schema_stats import load_stats
+                    _library = build_library(schema, load_stats())
+    return _library
+
+
+def match_template(question: str, schema: dict):
+    if not TEMPLATE_ROUTING:
+        return None
+    from schema_stats import load_stats
+    return get_library(schema).match(question, schema, load_stats())
+
+
+def record_validated(question: str, sql: str, schema: dict):
+    """Append a validated, executed model SQL to the query log and learn from it."""
+    from schema_stats import load_stats
+
+    if QUERY_LOG_PATH:
+        line = json.dumps({"question": question, "sql": sql, "at": time.time()})
+        try:
+            with _log_lock, open(QUERY_LOG_PATH, "a") as f:
+                f.write(line + "\n")
+        except OSError:
+            pass   # logging is best effort; the in-memory library still learns
+    if TEMPLATE_ROUTING:
+        get_library(schema).learn(question, sql, schema, load_stats())
+
+
+def template_stats() -> dict:
+    if _library is None:
+        return {"loaded": False}
+    with _library._lock:
+        stats = dict(_library.stats)
+    lookups = stats["matches"] + stats["misses"]
+    stats["avg_match_us"] = round(stats.pop("match_us_total") / lookups, 1) if lookups else 0.0
+    return dict(stats, loaded=True, templates=len(_library.templates))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from schema_stats import load_stats
+
+    parser = argparse.ArgumentParser(description="Learn / inspect parameterized SQL templates")
+    parser.add_argument("--learn", action="store_true", help="Rebuild the library from the golden set and query log")
+    parser.add_argument("--match", metavar="QUESTION", help="Show the SQL a question maps to")
+    parser.add_argument("--log", default=QUERY_LOG_PATH, help="Query log to learn from")
+    args = parser.parse_args()
+
+    with open("schema.json") as f:
+        schema = json.load(f)
+    stats = load_stats()
+
+    if args.learn:
+        library = build_library(schema, stats, args.log)
+        library.save()
+        print(f"Learned {len(library.templates)} templates -> {TEMPLATE_LIBRARY_PATH}")
+    if args.match:
+        print(json.dumps(get_library(schema).match(args.match, schema, stats), indent=2))
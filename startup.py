@@ -0,0 +1,103 @@
+# App startup: preload the LLM, warm up each pipeline stage, report readiness
+# Used as the FastAPI lifespan of main.py and api.py. Loading runs in a
+# background thread so the server binds immediately; /ready answers 503 until
+# the model is loaded and every stage has run one short generation (first-call
+# kernel selection, allocator growth, chat-template compilation).
+# With INFERENCE_SOCKET set the model lives in inference_server.py instead:
+# nothing is loaded here and readiness mirrors the server's.
+
+import os
+import threading
+import time
+from contextlib import asynccontextmanager
+
+PRELOAD_MODEL = os.getenv("PRELOAD_MODEL", "1").lower() in ("1", "true", "yes")
+WARMUP_MAX_NEW_TOKENS = int(os.getenv("WARMUP_MAX_NEW_TOKENS", 4))
+WARMUP_QUESTION = "What is the total revenue per city over the last 30 days?"
+
+_state = {
+    "status": "starting" if PRELOAD_MODEL else "disabled",
+    "load_seconds": None,
+    "warmup_seconds": {},
+    "error": None,
+}
+_state_lock = threading.Lock()
+
+
+def _set(**fields):
+    with _state_lock:
+        _state.update(fields)
+
+
+def _warmup_prompts(schema: dict):
+    """One representative prompt per pipeline stage (also fills the token cache)."""
+    from clarification_prompt import build_clarification_segments
+    from explaination_prompt import build_explanation_segments
+    from prompt_templates import build_sql_prompt
+    from schema_stats import load_stats
+
+    sample_sql = "SELECT s.city, SUM(o.amount) AS revenue FROM orders o JOIN stores s ON o.store_id = s.store_id GROUP BY s.city"
+    sample_result = {"row_count": 1, "data": [{"city": "Mumbai", "revenue": 1000.0}]}
+    return {
+        "clarification": build_clarification_segments(WARMUP_QUESTION, schema),
+        "sql": build_sql_prompt(WARMUP_QUESTION, schema, stats=load_stats()),
+        "explanation": build_explanation_segments(WARMUP_QUESTION, sample_sql, sample_result),
+    }
+
+
+def preload_and_warm_up():
+    """Load the shared model and run one short generation per stage."""
+    import json
+
+    try:
+        from inference import generate_batch_local
+        from llm_loader import load_llm
+
+        _set(status="loading")
+        started = time.perf_counter()
+        tokenizer, model = load_llm()
+        _set(load_seconds=round(time.perf_counter() - started, 2), status="warming_up")
+
+        with open("schema.json") as f:
+            schema = json.load(f)
+        for stage, prompt in _warmup_prompts(schema).items():
+            started = time.perf_counter()
+            generate_batch_local(tokenizer, model, [prompt], {"max_new_tokens": WARMUP_MAX_NEW_TOKENS, "do_sample": False})
+            with _state_lock:
+                _state["warmup_seconds"][stage] = round(time.perf_counter() - started, 2)
+        _set(status="ready")
+    except Exception as e:
+        _set(status="failed", error=str(e))
+
+
+def readiness() -> dict:
+    """Snapshot of the startup state; "ready" is True once requests will be fast."""
+    from inference import get_client, remote_enabled
+
+    if not remote_enabled():
+        return local_readiness()
+    try:
+        status = get_client().status()
+    except RuntimeError as e:
+        return {"status": "inference_unavailable", "error": str(e), "ready": False, "models": []}
+    return dict(status["server"], inference_server={"pid": status["pid"], "scheduler": status["scheduler"]})
+
+
+def local_readiness() -> dict:
+    """Startup state of the model in this process."""
+    from llm_loader import loaded_models
+
+    with _state_lock:
+        state = dict(_state, warmup_seconds=dict(_state["warmup_seconds"]))
+    state["ready"] = state["status"] in ("ready", "disabled")
+    state["models"] = loaded_models()
+    return state
+
+
+@asynccontextmanager
+async def lifespan(app):
+    from inference import remote_enabled
+
+    if PRELOAD_MODEL and not remote_enabled():
+        threading.Thread(target=preload_and_warm_up, name="model-preload", daemon=True).start()
+    yield
@@ -31,3 +31,40 @@ TEST_CASES = [
         "expected_status": "needs_clarification"
     }
 ]
+
+# Golden (question, SQL) pairs: validated MySQL answers, also the seed set
+# for the SQL template library (sql_templates.py)
+GOLDEN_SQL = [
+    {
+        "question": "Show total revenue per city in the last 6 months",
+        "sql": "SELECT s.city, SUM(o.amount) AS total_revenue FROM orders o JOIN stores s ON o.store_id = s.store_id "
+               "WHERE o.order_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH) GROUP BY s.city ORDER BY total_revenue DESC"
+    },
+    {
+        "question": "Show total revenue per city for the last 6 months where return rate is above 10%",
+        "sql": "SELECT s.city, SUM(o.amount) AS total_revenue, AVG(o.returned) AS return_rate FROM orders o "
+               "JOIN stores s ON o.store_id = s.store_id WHERE o.order_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH) "
+               "GROUP BY s.city HAVING AVG(o.returned) > 0.1 ORDER BY total_revenue DESC"
+    },
+    {
+        "question": "Show total revenue per city",
+        "sql": "SELECT s.city, SUM(o.amount) AS total_revenue FROM orders o JOIN stores s ON o.store_id = s.store_id "
+               "GROUP BY s.city ORDER BY total_revenue DESC"
+    },
+    {
+        "question": "Show top stores by total revenue in the last 6 months",
+        "sql": "SELECT o.store_id, s.city, SUM(o.amount) AS total_revenue FROM orders o JOIN stores s ON o.store_id = s.store_id "
+               "WHERE o.order_date >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH) GROUP BY o.store_id, s.city "
+               "ORDER BY total_revenue DESC LIMIT 10"
+    },
+    {
+        "question": "Show average order value by age in the last 12 months",
+        "sql": "SELECT c.age, AVG(o.amount) AS avg_order_value FROM orders o JOIN customers c ON o.customer_id = c.customer_id "
+               "WHERE o.order_date >= DATE_SUB(CURDATE(), INTERVAL 12 MONTH) GROUP BY c.age ORDER BY c.age"
+    },
+    {
+        "question": "What is the total revenue in Mumbai in the last 30 days?",
+        "sql": "SELECT SUM(o.amount) AS total_revenue FROM orders o JOIN stores s ON o.store_id = s.store_id "
+               "WHERE s.city = 'Mumbai' AND o.order_date >= DATE_SUB(CURDATE(), INTERVAL 30 DAY)"
+    },
+]
@@ -0,0 +1,207 @@
+# Traffic capture for replay (see replay.py)
+# With TRAFFIC_CAPTURE_PATH set, every /query request is recorded as one
+# JSON line: question, session, request options, arrival time, status,
+# chosen SQL, per-stage timings and the raw output of every model call.
+# Records go onto a bounded in-memory queue and a background thread appends
+# them to the log, so the request path never waits on disk; when the queue
+# is full the record is dropped and counted instead.
+# The same thread-local record lets replay.py feed recorded model outputs
+# back in place of generation.
+
+import json
+import os
+import queue
+import threading
+import time
+from contextlib import nullcontext
+
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+TRAFFIC_CAPTURE_QUEUE = int(os.getenv("TRAFFIC_CAPTURE_QUEUE", 10000))
+WRITE_BATCH = 256
+
+_NO_TIMER = nullcontext()
+_active = threading.local()
+
+
+# -------------------------------
+# Records
+# -------------------------------
+class _StageTimer:
+    def __init__(self, record, name: str):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+
+    def __exit__(self, exc_type, exc, tb):
+        ms = (time.perf_counter() - self._t0) * 1000
+        stages = self.record.data["stages"]
+        stages[self.name] = round(stages.get(self.name, 0.0) + ms, 3)
+        return False
+
+
+class CaptureRecord:
+    """One request; active for the calling thread between __enter__ and __exit__."""
+
+    def __init__(self, question: str, sink, **request):
+        self.sink = sink
+        self.data = {"ts": time.time(), "question": question, **request, "stages": {}, "llm": []}
+        self.replay = None   # {"llm": recorded calls, "strict": bool, "latency": bool}, set by replay.py
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        _active.record = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _active.record = None
+        self.data["total_ms"] = round((time.perf_counter() - self._t0) * 1000, 3)
+        if exc is not None:
+            self.data.setdefault("status", "exception")
+            self.data["error"] = repr(exc)
+        self.sink(self.data)
+        return False
+
+    def set_response(self, response: dict):
+        self.data["status"] = response.get("status")
+        self.data["sql"] = response.get("sql")
+        self.data["sql_source"] = response.get("sql_source")
+        if response.get("degraded"):
+            self.data["degraded"] = response["degraded"]
+        result = response.get("result")
+        if isinstance(result, dict):
+            self.data["row_count"] = result.get("row_count")
+
+
+class _NullCapture:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set_response(self, response: dict):
+        pass
+
+
+_NULL_CAPTURE = _NullCapture()
+
+
+def capture_request(question: str, **request):
+    """Context manager recording one request when capture is on; a shared no-op otherwise."""
+    if not TRAFFIC_CAPTURE_PATH:
+        return _NULL_CAPTURE
+    return CaptureRecord(question, get_writer().submit, **request)
+
+
+def current_record():
+    return getattr(_active, "record", None)
+
+
+def timed(stage: str):
+    """Adds the block's wall time to `stage` of the active record (no-op when none)."""
+    record = getattr(_active, "record", None)
+    return _StageTimer(record, stage) if record is not None else _NO_TIMER
+
+
+# -------------------------------
+# Model outputs
+# -------------------------------
+class ReplayMiss(RuntimeError):
+    """The replayed build asked the model for more than the capture recorded."""
+
+
+def recorded_output(stage: str):
+    """Next recorded output for `stage` while replaying, else None (generate normally).
+
+    With replay["latency"] the call takes as long as it did when captured, so
+    stage timings stay comparable with the recorded ones.
+    """
+    record = getattr(_active, "record", None)
+    if record is None or record.replay is None:
+        return None
+    calls = record.replay["llm"]
+    for i, call in enumerate(calls):
+        if call["stage"] == stage:
+            calls.pop(i)
+            if record.replay["latency"] and call.get("ms"):
+                time.sleep(call["ms"] / 1000)
+            return call["output"]
+    if record.replay["strict"]:
+        raise ReplayMiss(f"No recorded model output left for stage {stage!r}")
+    return None
+
+
+def capture_llm(stage: str, output, ms: float):
+    record = getattr(_active, "record", None)
+    if record is not None:
+        record.data["llm"].append({"stage": stage, "output": output, "ms": round(ms, 3)})
+
+
+# -------------------------------
+# Writer
+# -------------------------------
+class CaptureWriter:
+    """Appends records to the capture log from a background thread."""
+
+    def __init__(self, path: str, max_queue: int = TRAFFIC_CAPTURE_QUEUE):
+        self.path = path
+        self._queue = queue.Queue(maxsize=max_queue)
+        self.stats = {"captured": 0, "dropped": 0, "write_errors": 0}
+        threading.Thread(target=self._loop, name="traffic-capture", daemon=True).start()
+
+    def submit(self, record: dict):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < WRITE_BATCH:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            lines = "".join(json.dumps(record, default=str) + "\n" for record in batch)
+            try:
+                with open(self.path, "a") as f:
+                    f.write(lines)
+                self.stats["captured"] += len(batch)
+            except OSError:
+                self.stats["write_errors"] += len(batch)
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until queued records are written (tests, shutdown)."""
+        deadline = time.monotonic() + timeout
+        while not self._queue.empty() and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> CaptureWriter:
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = CaptureWriter(TRAFFIC_CAPTURE_PATH)
+    return _writer
+
+
+def capture_stats() -> dict:
+    if not TRAFFIC_CAPTURE_PATH:
+        return {"enabled": False}
+    writer = get_writer()
+    return dict(writer.stats, enabled=True, path=writer.path, queued=writer._queue.qsize())
+
+
+def load_capture(path: str):
+    """Records of a capture log, in arrival order."""
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return sorted(records, key=lambda r: r["ts"])